@@ -0,0 +1,86 @@
+"""Deterministic benchmark inputs.
+
+Fixtures are generated rather than stored, so they are identical on every machine and
+don't bloat the repository. Generating them is not part of any measurement.
+"""
+
+from __future__ import annotations
+
+import os
+
+from functools import lru_cache
+from io import BytesIO
+from typing import Callable
+
+from PIL import Image, ImageDraw
+
+__all__ = (
+    'CAPTIONS',
+    'FIXTURES',
+    'UNIFONT_PATH',
+    'fixture',
+    'has_unifont',
+)
+
+UNIFONT_PATH = './bot/assets/fonts/unifont.ttf'
+
+
+def _frame(size: tuple[int, int], index: int, *, transparent: bool = False) -> Image.Image:
+    width, height = size
+    background = (0, 0, 0, 0) if transparent else (30 + index % 200, 90, 160, 255)
+    image = Image.new('RGBA', size, background)
+    draw = ImageDraw.Draw(image)
+
+    # A moving ball over a few stripes, so that consecutive frames differ like real footage
+    for stripe in range(0, width, max(1, width // 12)):
+        draw.rectangle((stripe, 0, stripe + width // 24, height), fill=((stripe * 7) % 256, 200, 80, 255))
+
+    radius = min(size) // 5
+    x = (index * 7) % max(1, width - radius * 2)
+    draw.ellipse((x, height // 3, x + radius * 2, height // 3 + radius * 2), fill=(240, 40, 40, 255))
+    return image
+
+
+def _static(size: tuple[int, int], fmt: str) -> bytes:
+    stream = BytesIO()
+    image = _frame(size, 0)
+
+    if fmt == 'JPEG':
+        image = image.convert('RGB')
+
+    image.save(stream, fmt)
+    return stream.getvalue()
+
+
+def _gif(size: tuple[int, int], count: int, *, transparent: bool = False) -> bytes:
+    # Pillow keeps fully transparent pixels transparent when saving RGBA frames as a GIF
+    frames = [_frame(size, i, transparent=transparent) for i in range(count)]
+    stream = BytesIO()
+
+    frames[0].save(stream, 'GIF', save_all=True, append_images=frames[1:], duration=40, loop=0, disposal=2)
+    return stream.getvalue()
+
+
+FIXTURES: dict[str, Callable[[], bytes]] = {
+    'static-png': lambda: _static((800, 600), 'PNG'),
+    'static-jpeg': lambda: _static((1600, 1200), 'JPEG'),
+    'large-gif': lambda: _gif((600, 600), 60),
+    'long-gif': lambda: _gif((240, 240), 400),
+    'transparent-gif': lambda: _gif((400, 400), 40, transparent=True),
+}
+
+CAPTIONS: dict[str, str] = {
+    'plain': 'when you finally fix the bug but it was a typo in the config file the whole time',
+    'emoji': 'me watching the deploy 😳🔥🔥 it actually worked 🎉🎉🎉 no way 💀💀',
+    'cjk': '当你终于修好了错误 しかし設定ファイルのタイプミスだった 설정 파일의 오타였다',
+    'unifont': 'ᚠᛁᚱᛋᛏ ᛚᛁᚾᛖ ⠓⠑⠇⠇⠕ ∮ E⋅da = Q ⌬ ⎈ ☃ ✈ ♞',
+}
+
+
+@lru_cache(maxsize=None)
+def fixture(name: str, /) -> bytes:
+    return FIXTURES[name]()
+
+
+def has_unifont() -> bool:
+    return os.path.exists(UNIFONT_PATH)
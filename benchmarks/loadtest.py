@@ -0,0 +1,338 @@
+"""Offline load test: pushes synthetic ``caption`` traffic through a real :class:`Photon`.
+
+Nothing talks to Discord. Messages are built locally and fed to ``Photon.process_commands``,
+every REST call the bot makes is answered by an in-process stand-in (and recorded), gateway
+member queries return nothing, and source images are served by a local aiohttp server.
+
+Run from the repository root::
+
+    python -m benchmarks.loadtest --requests 200 --concurrency 16 --mix static-png=4,large-gif=1
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextvars
+import itertools
+import json
+import os
+import random
+import time
+
+from datetime import datetime, timezone
+from typing import Any, Optional, TYPE_CHECKING
+
+from aiohttp import web
+
+from .fixtures import CAPTIONS, FIXTURES, fixture
+
+if TYPE_CHECKING:
+    from bot import Photon
+
+CONTENT_TYPES = {'png': 'image/png', 'jpeg': 'image/jpeg', 'gif': 'image/gif'}
+
+_current_request: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar('_current_request', default=None)
+_snowflakes = itertools.count(int(time.time() * 1000 - 1420070400000) << 22)
+
+
+def _snowflake() -> int:
+    return next(_snowflakes)
+
+
+def _timestamp() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _percentiles(values: list[float]) -> dict[str, Optional[float]]:
+    if not values:
+        return {'p50': None, 'p95': None, 'p99': None, 'max': None}
+
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {'p50': pick(0.5), 'p95': pick(0.95), 'p99': pick(0.99), 'max': ordered[-1]}
+
+
+class ImageServer:
+    """Serves the benchmark fixtures over HTTP, standing in for image hosts."""
+
+    def __init__(self, *, latency: float = 0) -> None:
+        self.latency: float = latency
+        self.port: int = None  # type: ignore
+        self._runner: web.AppRunner = None  # type: ignore
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        name, _, extension = request.match_info['name'].rpartition('.')
+        if name not in FIXTURES:
+            raise web.HTTPNotFound()
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        return web.Response(body=fixture(name), content_type=CONTENT_TYPES[extension])
+
+    def url(self, name: str) -> str:
+        extension = 'jpeg' if name.endswith('jpeg') else 'gif' if name.endswith('gif') else 'png'
+        return f'http://127.0.0.1:{self.port}/images/{name}.{extension}'
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get('/images/{name}', self._handle)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]  # type: ignore
+
+    async def close(self) -> None:
+        await self._runner.cleanup()
+
+
+class FakeDiscord:
+    """Answers the bot's REST calls locally, and builds the guilds and messages it receives."""
+
+    def __init__(self, bot: Photon, *, latency: float = 0, guilds: int = 1) -> None:
+        self.bot: Photon = bot
+        self.latency: float = latency
+
+        self.calls: list[dict[str, Any]] = []
+        self.uploads: dict[int, int] = {}  # Request ID -> bytes uploaded
+        self.channels: list[Any] = []
+
+        self._install()
+        self._create_guilds(guilds)
+
+    @property
+    def state(self) -> Any:
+        return self.bot._connection
+
+    def _user(self, user_id: int, *, bot: bool = False) -> dict[str, Any]:
+        return {
+            'id': str(user_id),
+            'username': f'user{user_id % 10_000}',
+            'discriminator': '0001',
+            'avatar': None,
+            'bot': bot,
+        }
+
+    def _message(self, channel_id: int, content: str = '', *, author: dict[str, Any] = None) -> dict[str, Any]:
+        return {
+            'id': str(_snowflake()),
+            'channel_id': str(channel_id),
+            'author': author or self._user(self.bot.user.id, bot=True),
+            'content': content,
+            'timestamp': _timestamp(),
+            'edited_timestamp': None,
+            'tts': False,
+            'mention_everyone': False,
+            'mentions': [],
+            'mention_roles': [],
+            'attachments': [],
+            'embeds': [],
+            'pinned': False,
+            'type': 0,
+        }
+
+    async def request(self, route: Any, *, files: Any = None, form: Any = None, **kwargs: Any) -> Any:
+        request_id = _current_request.get()
+        self.calls.append({'method': route.method, 'path': route.path, 'request': request_id})
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if files and request_id is not None:
+            size = 0
+            for file in files:
+                file.fp.seek(0, os.SEEK_END)
+                size += file.fp.tell()
+
+            self.uploads[request_id] = self.uploads.get(request_id, 0) + size
+
+        if route.method in ('POST', 'PATCH') and route.path.startswith('/channels/{channel_id}/messages'):
+            return self._message(route.channel_id)
+
+    async def _query_members(self, *_args: Any, **_kwargs: Any) -> list[Any]:
+        # Without a gateway connection, member searches find nobody
+        return []
+
+    def _install(self) -> None:
+        import discord
+
+        state = self.state
+        state.user = discord.ClientUser(state=state, data=self._user(_snowflake(), bot=True))
+        state.query_members = self._query_members
+        self.bot.http.request = self.bot.instrument_http(self.request)
+
+    def _create_guilds(self, count: int) -> None:
+        import discord
+
+        for _ in range(count):
+            guild_id, channel_id = _snowflake(), _snowflake()
+            guild = discord.Guild(state=self.state, data={
+                'id': str(guild_id),
+                'name': f'guild{guild_id % 10_000}',
+                'owner_id': str(self.bot.user.id),
+                'roles': [],
+                'emojis': [],
+                'features': [],
+                'members': [],
+                'channels': [{
+                    'id': str(channel_id),
+                    'type': 0,
+                    'name': 'general',
+                    'position': 0,
+                    'permission_overwrites': [],
+                }],
+            })
+
+            self.state._add_guild(guild)
+            self.channels.append(guild.get_channel(channel_id))
+
+    def message(self, content: str, *, user_id: int, channel: Any) -> Any:
+        import discord
+
+        data = self._message(channel.id, content, author=self._user(user_id))
+        data['guild_id'] = str(channel.guild.id)
+        data['member'] = {'roles': [], 'joined_at': _timestamp(), 'deaf': False, 'mute': False}
+
+        return discord.Message(state=self.state, channel=channel, data=data)
+
+
+class LagMonitor:
+    """Measures event loop lag by checking how late a periodic sleep wakes up."""
+
+    def __init__(self, interval: float = 0.01) -> None:
+        self.interval: float = interval
+        self.samples: list[float] = []
+        self._task: asyncio.Task = None  # type: ignore
+
+    async def _run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - start - self.interval))
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        self._task.cancel()
+
+
+def _parse_mix(value: str) -> dict[str, float]:
+    mix = {}
+
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in FIXTURES:
+            raise argparse.ArgumentTypeError(f'unknown input type {name!r}, choose from {", ".join(FIXTURES)}')
+
+        mix[name] = float(weight or 1)
+
+    return mix
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    from bot import Photon
+
+    images = ImageServer(latency=args.image_latency)
+    await images.start()
+
+    bot = Photon()
+    fake = FakeDiscord(bot, latency=args.rest_latency, guilds=args.guilds)
+    await bot.extensions_loaded.wait()
+
+    rng = random.Random(args.seed)
+    names, weights = zip(*args.mix.items())
+    captions = [CAPTIONS['plain']] + ([CAPTIONS['emoji']] if args.emoji else [])
+    # A user only ever has one request in flight, or the command's max_concurrency would reject the others
+    idle_users = [_snowflake() for _ in range(max(args.users, args.concurrency))]
+
+    latencies: dict[str, list[float]] = {name: [] for name in names}
+    failures = 0
+    counter = itertools.count()
+
+    async def worker() -> None:
+        nonlocal failures
+
+        while (request_id := next(counter)) < args.requests:
+            name = rng.choices(names, weights)[0]
+            content = f'pt caption {images.url(name)} {rng.choice(captions)}'
+            user_id = idle_users.pop(rng.randrange(len(idle_users)))
+            message = fake.message(content, user_id=user_id, channel=rng.choice(fake.channels))
+
+            _current_request.set(request_id)
+            start = time.perf_counter()
+            try:
+                await bot.process_commands(message)
+            finally:
+                idle_users.append(user_id)
+            elapsed = time.perf_counter() - start
+
+            if request_id in fake.uploads:
+                latencies[name].append(elapsed)
+            else:
+                failures += 1
+
+    lag = LagMonitor()
+    lag.start()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    duration = time.perf_counter() - start
+
+    lag.stop()
+    await bot.close()
+    await images.close()
+
+    completed = sum(map(len, latencies.values()))
+    return {
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'mix': args.mix,
+        'completed': completed,
+        'failed': failures,
+        'duration_s': duration,
+        'throughput_rps': completed / duration,
+        'latency_s': _percentiles(list(itertools.chain.from_iterable(latencies.values()))),
+        'latency_by_input_s': {name: _percentiles(values) for name, values in latencies.items()},
+        'loop_lag_s': _percentiles(lag.samples),
+        'rest_calls': len(fake.calls),
+        'rest_calls_per_request': len(fake.calls) / args.requests,
+        'uploaded_bytes': sum(fake.uploads.values()),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', '-n', type=int, default=100)
+    parser.add_argument('--concurrency', '-c', type=int, default=8, help='requests in flight at once')
+    parser.add_argument('--mix', type=_parse_mix, default=_parse_mix('static-png=4,static-jpeg=2,large-gif=1'),
+                        help='weighted input types, e.g. static-png=4,long-gif=1')
+    parser.add_argument('--users', type=int, default=64, help='distinct synthetic users, at least one per request in flight')
+    parser.add_argument('--guilds', type=int, default=4, help='distinct synthetic guilds')
+    parser.add_argument('--emoji', action='store_true', help='also use emoji captions (needs network access)')
+    parser.add_argument('--rest-latency', type=float, default=0.05, help='simulated Discord REST latency, seconds')
+    parser.add_argument('--image-latency', type=float, default=0.02, help='simulated image host latency, seconds')
+    parser.add_argument('--unlimited-budgets', action='store_true', help='disable admission control budgets')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', '-o', help='write the report to this JSON file')
+    args = parser.parse_args()
+
+    # Must be set before the bot (and so its configuration) is imported
+    os.environ.setdefault('PHOTON_METRICS_PORT', '0')
+    if args.unlimited_budgets:
+        os.environ['PHOTON_USER_BUDGET'] = os.environ['PHOTON_GUILD_BUDGET'] = '1e12'
+
+    report = asyncio.run(run(args))
+    print(json.dumps(report, indent=2))
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
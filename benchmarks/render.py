@@ -0,0 +1,280 @@
+"""Render benchmarks for the caption pipeline and the helpers it is built on.
+
+Run from the repository root::
+
+    python -m benchmarks.render --output bench.json
+    python -m benchmarks.render --output new.json --compare bench.json
+
+Every case reports the median time per stage and in total, frames per second, and how much
+memory a single run took. Memory is measured in a fresh interpreter per case, since Pillow's
+pixel buffers are invisible to tracemalloc and a process' peak RSS never goes back down:
+``rss_peak_kib`` is that process' peak while running the case, and ``rss_growth_kib`` how far
+it rose above what the process used just before. Peaks are exact on Linux; elsewhere they
+are the peak since the process started, which includes importing the bot.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import platform
+import re
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+from io import BytesIO
+from typing import Any, Callable, Optional
+
+import PIL
+from PIL import Image, ImageSequence
+
+from bot.features import IFunnyCaption
+from bot.helpers import StageTimings, wrap_text
+from bot.helpers.pil import FallbackFont
+from bot.helpers.transparency import save_transparent_gif
+
+from .fixtures import CAPTIONS, FIXTURES, fixture, has_unifont
+
+NEEDS_NETWORK = {'emoji'}
+NEEDS_UNIFONT = {'cjk', 'unifont'}
+
+
+RunT = Callable[[], tuple[Optional[StageTimings], int]]
+
+
+def _rss_kib(field: str) -> Optional[int]:
+    try:
+        with open('/proc/self/status') as fp:
+            return int(re.search(rf'^{field}:\s+(\d+) kB', fp.read(), re.MULTILINE).group(1))  # type: ignore
+    except (OSError, AttributeError):
+        return None
+
+
+def _reset_peak_rss() -> None:
+    try:
+        with open('/proc/self/clear_refs', 'w') as fp:
+            fp.write('5')  # Resets VmHWM to the current RSS
+    except OSError:
+        pass
+
+
+def _peak_rss_kib() -> int:
+    # ru_maxrss is in KiB on Linux, but in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return _rss_kib('VmHWM') or (peak // 1024 if sys.platform == 'darwin' else peak)
+
+
+class Case:
+    """A single benchmark.
+
+    ``prepare`` sets up its inputs and returns the function to time, which is called once per
+    iteration and returns ``(timings, frames)``.
+    """
+
+    def __init__(self, name: str, prepare: Callable[[], RunT]) -> None:
+        self.name: str = name
+        self.prepare = prepare
+
+    def measure_memory(self) -> dict[str, int]:
+        """Runs the case once in this process, which should have run nothing else."""
+        run = self.prepare()
+
+        _reset_peak_rss()
+        before = _rss_kib('VmRSS') or _peak_rss_kib()
+        run()
+        peak = _peak_rss_kib()
+
+        return {'rss_peak_kib': peak, 'rss_growth_kib': max(0, peak - before)}
+
+    def measure(self, iterations: int, warmup: int) -> dict[str, Any]:
+        run = self.prepare()
+
+        for _ in range(warmup):
+            run()
+
+        totals: list[float] = []
+        stages: dict[str, list[float]] = {}
+        frames = 0
+
+        for _ in range(iterations):
+            start = time.perf_counter()
+            timings, frames = run()
+            totals.append(time.perf_counter() - start)
+
+            for stage, seconds in timings or ():
+                stages.setdefault(stage, []).append(seconds)
+
+        # Earlier cases would hide this one's peak, so memory is measured in a process of its own
+        output = subprocess.check_output(
+            [sys.executable, '-m', 'benchmarks.render', '--memory-of', self.name], text=True,
+        )
+        memory = json.loads(output)
+
+        total = statistics.median(totals)
+        return {
+            'name': self.name,
+            'iterations': iterations,
+            'ms': {
+                'total': total * 1000,
+                'min': min(totals) * 1000,
+                'stages': {stage: statistics.median(values) * 1000 for stage, values in stages.items()},
+            },
+            'frames': frames,
+            'fps': frames / total if total else None,
+            **memory,
+        }
+
+
+def _font(width: int = IFunnyCaption.MAX_WIDTH) -> FallbackFont:
+    # Built the same way IFunnyCaption builds it, so the settings can't drift apart
+    return IFunnyCaption._create_font(IFunnyCaption._base_font_size(width))
+
+
+def _caption_case(fixture_name: str, caption_name: str) -> Case:
+    def prepare() -> RunT:
+        data, text = fixture(fixture_name), CAPTIONS[caption_name]
+
+        async def render() -> tuple[StageTimings, int]:
+            timings = StageTimings()
+
+            async with IFunnyCaption(data, text=text, timings=timings) as caption:
+                await caption.render()
+                frames = len(caption.durations)
+
+            return timings, frames
+
+        return lambda: asyncio.run(render())
+
+    return Case(f'caption/{fixture_name}/{caption_name}', prepare)
+
+
+def _wrap_text_case(caption_name: str) -> Case:
+    def prepare() -> RunT:
+        font, text = _font(), CAPTIONS[caption_name]
+
+        def run() -> tuple[None, int]:
+            wrap_text(text, font, IFunnyCaption.MAX_WIDTH)  # type: ignore
+            return None, 0
+
+        return run
+
+    return Case(f'wrap_text/{caption_name}', prepare)
+
+
+def _getsize_case(caption_name: str) -> Case:
+    def prepare() -> RunT:
+        font, text = _font(), CAPTIONS[caption_name]
+
+        def run() -> tuple[None, int]:
+            font.getsize(text)
+            return None, 0
+
+        return run
+
+    return Case(f'FallbackFont.getsize/{caption_name}', prepare)
+
+
+def _gif_case(fixture_name: str) -> Case:
+    def prepare() -> RunT:
+        with Image.open(BytesIO(fixture(fixture_name))) as image:
+            frames = [frame.convert('RGBA') for frame in ImageSequence.Iterator(image)]
+
+        def run() -> tuple[StageTimings, int]:
+            timings = StageTimings()
+            save_transparent_gif(frames, 40, BytesIO(), timings=timings)
+            return timings, len(frames)
+
+        return run
+
+    return Case(f'save_transparent_gif/{fixture_name}', prepare)
+
+
+def cases(*, network: bool) -> list[Case]:
+    captions = [
+        name for name in CAPTIONS
+        if (network or name not in NEEDS_NETWORK) and (has_unifont() or name not in NEEDS_UNIFONT)
+    ]
+
+    result = [_caption_case(name, 'plain') for name in FIXTURES]
+    result += [_caption_case('static-png', name) for name in captions if name != 'plain']
+    result += [_wrap_text_case(name) for name in captions]
+    result += [_getsize_case(name) for name in captions]
+    result += [_gif_case(name) for name in FIXTURES if name.endswith('-gif')]
+    return result
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: list[dict[str, Any]], baseline_path: str) -> None:
+    with open(baseline_path) as fp:
+        baseline = {case['name']: case for case in json.load(fp)['cases']}
+
+    print(f'\n{"case":<48} {"before":>10} {"after":>10} {"change":>8}')
+    for case in current:
+        if (before := baseline.get(case['name'])) is None:
+            continue
+
+        old, new = before['ms']['total'], case['ms']['total']
+        print(f'{case["name"]:<48} {old:>8.2f}ms {new:>8.2f}ms {(new - old) / old:>+8.1%}')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', '-o', help='write machine-readable results to this JSON file')
+    parser.add_argument('--compare', '-c', help='compare against a previous results file')
+    parser.add_argument('--filter', '-k', default='', help='only run cases whose name contains this')
+    parser.add_argument('--iterations', '-n', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--offline', action='store_true', help='skip cases that fetch emoji over the network')
+    parser.add_argument('--memory-of', help=argparse.SUPPRESS)  # Used internally, see Case.measure
+    args = parser.parse_args()
+
+    if args.memory_of:
+        case = next(case for case in cases(network=True) if case.name == args.memory_of)
+        print(json.dumps(case.measure_memory()))
+        return
+
+    results = []
+    for case in cases(network=not args.offline):
+        if args.filter not in case.name:
+            continue
+
+        result = case.measure(args.iterations, args.warmup)
+        results.append(result)
+
+        stages = ' '.join(f'{stage}={ms:.1f}' for stage, ms in result['ms']['stages'].items())
+        fps = f' {result["fps"]:.0f} frames/s' if result['frames'] else ''
+        print(
+            f'{case.name:<48} {result["ms"]["total"]:>9.2f}ms{fps} '
+            f'peak +{result["rss_growth_kib"] / 1024:.1f} MiB  {stages}',
+            flush=True,
+        )
+
+    if not has_unifont():
+        print('note: unifont.ttf is missing, skipped the CJK/unifont fallback captions', file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({
+                'commit': _commit(),
+                'timestamp': time.time(),
+                'python': platform.python_version(),
+                'pillow': PIL.__version__,
+                'cases': results,
+            }, fp, indent=2)
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
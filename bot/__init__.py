@@ -1,2 +1,3 @@
 from .core.bot import Photon
 from .core.models import *
+from .core.errors import *
@@ -0,0 +1,223 @@
+"""Captions images from the command line, the same way the ``caption`` command does.
+
+Inputs are either a directory, where every image can have its caption in a ``.txt`` file
+of the same name next to it, or a CSV manifest with ``path`` and ``text`` columns (paths
+are relative to the manifest). ``--text`` is used for every image without a caption of its own.
+
+Run from the repository root::
+
+    python -m bot.caption templates/ --text "when the code compiles" --output out/
+    python -m bot.caption manifest.csv --output out/ --jobs 8
+
+Each output is named after its source file, suffix included (``a.jpg`` becomes ``a.jpg.png``),
+so sources must have distinct file names.
+
+Images are rendered in a process pool, with the bot's encoder settings, output formats and
+upload size limit; images that can't be made to fit it are reported as failed, like the bot
+would. This imports the whole ``bot`` package, discord.py and the bot's configuration included,
+but never connects. Each worker process prewarms the fonts and common emojis once, like
+the bot does after startup, and keeps its own caches for every image it renders; they aren't
+shared with other workers or with a running bot.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import csv
+import logging
+import os
+import shutil
+import sys
+import time
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, NamedTuple, Optional
+
+from .core.config import SPOOL_OUTPUTS
+from .core.degradation import DegradationPolicy
+from .core.errors import OutputTooLarge
+from .extensions.generation import ImageGeneration
+from .features import IFunnyCaption
+from .helpers import ImageData, ImageFinder, StageTimings
+from .helpers.emoji import prewarm_emoji
+
+__all__ = (
+    'CaptionJob',
+    'CaptionResult',
+    'find_jobs',
+    'render_job',
+    'main',
+)
+
+log = logging.getLogger(__name__)
+
+SUFFIXES = {*ImageFinder.ALLOWED_SUFFIXES, '.gif'}
+
+
+class CaptionJob(NamedTuple):
+    source: Path
+    text: str
+
+
+class CaptionResult(NamedTuple):
+    job: CaptionJob
+    output: Path
+    format: str
+    size: int
+    attempts: int
+    elapsed: float
+    stages: dict[str, float]
+
+
+def _read_caption(path: Path, /) -> Optional[str]:
+    sidecar = path.with_suffix('.txt')
+    if sidecar.is_file():
+        return sidecar.read_text(encoding='utf-8').strip()
+
+    return None
+
+
+def find_jobs(source: Path, /, *, text: str = None) -> list[CaptionJob]:
+    """Lists the images to caption in a directory or CSV manifest, with their captions.
+
+    Raises :class:`ValueError` if an image has no caption, or two images share a file name.
+    """
+    if source.is_dir():
+        paths = sorted(path for path in source.iterdir() if path.suffix.lower() in SUFFIXES)
+        captions = {path: _read_caption(path) for path in paths}
+    else:
+        with source.open(newline='', encoding='utf-8') as file:
+            rows = list(csv.DictReader(file))
+
+        captions = {}
+        for row in rows:
+            path = source.parent / row['path']
+            captions[path] = row.get('text') or _read_caption(path)
+
+    names: dict[str, Path] = {}
+    for path in captions:
+        if (other := names.setdefault(path.name, path)) != path:
+            raise ValueError(f'{other} and {path} have the same file name, so their outputs would overwrite each other')
+
+    jobs = []
+    for path, caption in captions.items():
+        caption = caption or text
+        if not caption:
+            raise ValueError(f'No caption given for {path}')
+
+        jobs.append(CaptionJob(path, caption))
+
+    return jobs
+
+
+def _prewarm(widths: list[int], emoji: bool) -> None:
+    # Like the bot's prewarming, this only saves time later, so failing here isn't fatal
+    try:
+        for width in widths:
+            IFunnyCaption.prewarm(width)
+
+        if emoji:
+            prewarm_emoji()
+    except Exception:
+        log.warning('Prewarming failed', exc_info=True)
+
+
+async def _render(job: CaptionJob, output: Path, options: dict[str, Any]) -> CaptionResult:
+    timings = StageTimings()
+
+    with timings.stage('read'):
+        data = ImageData(job.source.read_bytes())
+
+    async with IFunnyCaption(data, text=job.text, timings=timings, **options) as caption:
+        await caption.render()
+        result = caption.result
+
+    # The pipeline returns its smallest attempt when nothing fits, which the bot couldn't upload either
+    if (max_bytes := options.get('max_bytes')) is not None and result.size > max_bytes:
+        result.stream.close()
+        raise OutputTooLarge(result.size, max_bytes)
+
+    # Keeping the source's suffix stops a.jpg and a.png from overwriting each other
+    destination = output / f'{job.source.name}.{result.extension}'
+
+    with timings.stage('write'), result.stream, destination.open('wb') as file:
+        shutil.copyfileobj(result.stream, file)
+
+    return CaptionResult(
+        job, destination, result.format, result.size, result.attempts, timings.elapsed, timings.stages,
+    )
+
+
+def render_job(job: CaptionJob, output: Path, options: dict[str, Any]) -> CaptionResult:
+    """Captions one image and writes it to the output directory. This blocks."""
+    return asyncio.run(_render(job, output, options))
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m bot.caption', description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('source', type=Path, help='a directory of images, or a CSV manifest')
+    parser.add_argument('--output', '-o', type=Path, default=Path('captioned'), help='directory to write to')
+    parser.add_argument('--text', '-t', help='caption for images without one of their own')
+    parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count() or 2, help='worker processes')
+    parser.add_argument(
+        '--level', type=int, default=0, choices=range(len(DegradationPolicy.LEVELS)),
+        help='quality level to render at, as picked by the bot under load (default: full quality)',
+    )
+    parser.add_argument(
+        '--max-kb', type=int, default=ImageGeneration.DEFAULT_UPLOAD_LIMIT // 1024,
+        help='fit outputs into this many KiB, 0 for no limit (default: the bot\'s upload limit)',
+    )
+    parser.add_argument('--offline', action='store_true', help='don\'t prefetch common emojis')
+    parser.add_argument('--quiet', '-q', action='store_true', help='only report failures')
+    args = parser.parse_args(argv)
+
+    try:
+        jobs = find_jobs(args.source, text=args.text)
+    except (OSError, ValueError, KeyError) as exc:
+        parser.error(str(exc))
+
+    args.output.mkdir(parents=True, exist_ok=True)
+
+    quality = DegradationPolicy.LEVELS[args.level]
+    options = dict(max_bytes=args.max_kb * 1024 or None, spool_output=SPOOL_OUTPUTS, **quality._asdict())
+    widths = [quality.max_width or IFunnyCaption.MAX_WIDTH]
+
+    start = time.perf_counter()
+    failures = 0
+
+    with ProcessPoolExecutor(args.jobs, initializer=_prewarm, initargs=(widths, not args.offline)) as pool:
+        futures = {pool.submit(render_job, job, args.output, options): job for job in jobs}
+
+        for done, future in enumerate(as_completed(futures), start=1):
+            job = futures[future]
+            prefix = f'[{done}/{len(jobs)}]'
+
+            try:
+                result = future.result()
+            except Exception as exc:
+                failures += 1
+                print(f'{prefix} {job.source}: failed: {exc!r}', file=sys.stderr)
+                continue
+
+            if not args.quiet:
+                print(
+                    f'{prefix} {job.source} -> {result.output} '
+                    f'({result.format}, {result.size / 1024:,.1f} KiB, {result.elapsed * 1000:,.0f} ms)',
+                    file=sys.stderr,
+                )
+
+    elapsed = time.perf_counter() - start
+    print(
+        f'Captioned {len(jobs) - failures}/{len(jobs)} images in {elapsed:.1f}s '
+        f'({len(jobs) / elapsed:.1f}/s, {args.jobs} workers)',
+        file=sys.stderr,
+    )
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,20 +1,67 @@
 from __future__ import annotations
 
+import asyncio
+import functools
+import importlib
+import logging
 import os
+import time
 import aiohttp
 import discord
 
-from dotenv import load_dotenv
 from discord.ext import commands
 from jishaku.flags import Flags
 
-from typing import TYPE_CHECKING
+from typing import Any, Awaitable, Callable, Optional, TYPE_CHECKING
 
-from .models import Context
+from .config import (
+    DEGRADE_AT,
+    DEGRADE_INTERVAL,
+    FETCH_CONNECT_TIMEOUT,
+    FETCH_DISCORD_PER_HOST,
+    FETCH_DNS_TTL,
+    FETCH_KEEPALIVE,
+    FETCH_PER_HOST,
+    FETCH_POOL_SIZE,
+    FETCH_POOL_TIMEOUT,
+    FETCH_READ_TIMEOUT,
+    FETCH_RETRIES,
+    FETCH_TOTAL_TIMEOUT,
+    GUILD_BUDGET,
+    GUILD_BUDGET_REFILL,
+    LOOP_BLOCK_THRESHOLD,
+    LOOP_MONITOR_INTERVAL,
+    MEMORY_BUDGET,
+    MEMORY_WAIT,
+    METRICS_HOST,
+    METRICS_PORT,
+    PROFILE_DIRECTORY,
+    PROFILE_MAX_BYTES,
+    PROFILE_SLOW_RENDERS,
+    PROFILE_THRESHOLD,
+    PROFILE_TRACE_MEMORY,
+    RECOVER_AT,
+    RENDER_DEADLINE,
+    RENDER_QUEUE_SIZE,
+    RENDER_WORKERS,
+    USER_BUDGET,
+    USER_BUDGET_REFILL,
+)
+from .degradation import DegradationPolicy
+from .errors import PhotonError, RenderCancelled
+from .exporter import MetricsServer
+from .fetch import FetchClient
+from .memory import MemoryBudget
+from .metrics import Metrics
+from .models import Context, current_context
+from .monitor import LoopMonitor
+from .profiling import SlowRenderProfiler
+from .ratelimit import CostLimiter
+from .scheduler import RenderScheduler
 
 __all__ = 'Photon',
 
-load_dotenv()
+log = logging.getLogger(__name__)
 
 Flags.NO_UNDERSCORE = True
 Flags.NO_DM_TRACEBACK = True
@@ -30,13 +77,38 @@ ALLOWED_MENTIONS = discord.AllowedMentions(
 )
 
 
-class Photon(commands.Bot):
+class Photon(commands.AutoShardedBot):
     ERROR_EMOJI = '<a:ferrisBongoHyper:878045828500029480>'
+    REST_CALL_BUCKETS = (1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 30)
 
     if TYPE_CHECKING:
         session: aiohttp.ClientSession
+        fetcher: FetchClient
+        scheduler: RenderScheduler
+        limiter: CostLimiter
+        memory: MemoryBudget
+        metrics: Metrics
+        metrics_server: MetricsServer
+        degradation: DegradationPolicy
+        loop_monitor: LoopMonitor
+        profiler: Optional[SlowRenderProfiler]
+        extensions_loaded: asyncio.Event
+
+    def __init__(
+        self,
+        *,
+        shard_ids: Optional[list[int]] = None,
+        shard_count: Optional[int] = None,
+        cluster_id: Optional[int] = None,
+        cluster_count: int = 1,
+        metrics_port: int = METRICS_PORT,
+    ) -> None:
+        self.cluster_id: Optional[int] = cluster_id
+        self.cluster_count: int = cluster_count
+        self._metrics_port: int = metrics_port
+        self._started_at: float = time.perf_counter()
+        self._first_command: bool = True
 
-    def __init__(self) -> None:
         super().__init__(
             command_prefix=self.__class__._get_prefix,
             case_insensitive=True,
@@ -49,31 +121,156 @@ class Photon(commands.Bot):
             activity=discord.Activity(
                 name='with images',
                 type=discord.ActivityType.playing
-            )
+            ),
+            shard_ids=shard_ids,
+            shard_count=shard_count,
         )
         self.setup()
 
     async def _get_prefix(self, _message: discord.Message) -> list[str]:
         return ['photon', 'Photon', 'pt']  # Too lazy to make a decent prefix system so here you go
 
-    def load_extensions(self) -> None:
-        self.load_extension('jishaku')
+    @staticmethod
+    def _extension_names() -> list[str]:
+        names = ['jishaku']
 
         for extension in os.listdir('./bot/extensions'):
             if extension.endswith('.py') and not extension.startswith('_'):
-                self.load_extension(f'bot.extensions.{extension[:-3]}')
+                names.append(f'bot.extensions.{extension[:-3]}')
+
+        return names
+
+    def load_extensions(self) -> None:
+        for name in self._extension_names():
+            self.load_extension(name)
+
+    async def _load_extensions(self) -> None:
+        # Importing the extensions (and the libraries they pull in) is the slow part of
+        # loading them, so do that in a thread while the gateway connects
+        start = time.perf_counter()
+        names = self._extension_names()
+
+        try:
+            await asyncio.to_thread(lambda: [importlib.import_module(name) for name in names])
+            self.load_extensions()
+        finally:
+            self.extensions_loaded.set()
+
+        self.metrics.gauge(
+            'photon_extensions_load_seconds', 'Time it took to import and load the extensions',
+        ).set(time.perf_counter() - start)
+
+    async def _prewarm(self) -> None:
+        from ..features import IFunnyCaption
+        from ..helpers.emoji import prewarm_emoji
+
+        start = time.perf_counter()
+        widths = {IFunnyCaption.MAX_WIDTH}
+        widths.update(level.max_width for level in DegradationPolicy.LEVELS if level.max_width)
+
+        results = await asyncio.gather(
+            *(asyncio.to_thread(IFunnyCaption.prewarm, width) for width in sorted(widths)),
+            asyncio.to_thread(prewarm_emoji),
+            return_exceptions=True,
+        )
+
+        for result in results:
+            if isinstance(result, Exception):
+                log.warning('Prewarming failed', exc_info=result)
+
+        self.metrics.gauge(
+            'photon_prewarm_seconds', 'Time it took to load fonts and common emojis after startup',
+        ).set(time.perf_counter() - start)
+
+    def instrument_http(self, request: Callable[..., Awaitable[Any]], /) -> Callable[..., Awaitable[Any]]:
+        """Wraps a REST request function to count calls, per command when made on behalf of one."""
+        counter = self.metrics.counter('photon_rest_requests_total', 'REST requests made to Discord')
+
+        @functools.wraps(request)
+        async def instrumented(route: Any, /, **kwargs: Any) -> Any:
+            ctx = current_context.get()
+            command = ctx.command.qualified_name if ctx is not None and ctx.command is not None else 'none'
+
+            counter.inc(command=command, method=route.method)
+            if ctx is not None:
+                ctx.rest_calls += 1
+
+            return await request(route, **kwargs)
+
+        return instrumented
 
     def setup(self) -> None:
         self.session = aiohttp.ClientSession()
+        self.metrics = Metrics()
+        self.http.request = self.instrument_http(self.http.request)
+        self.fetcher = FetchClient(
+            self.metrics,
+            pool_size=FETCH_POOL_SIZE,
+            per_host=FETCH_PER_HOST,
+            discord_per_host=FETCH_DISCORD_PER_HOST,
+            keepalive=FETCH_KEEPALIVE,
+            dns_ttl=FETCH_DNS_TTL,
+            pool_timeout=FETCH_POOL_TIMEOUT,
+            connect_timeout=FETCH_CONNECT_TIMEOUT,
+            read_timeout=FETCH_READ_TIMEOUT,
+            total_timeout=FETCH_TOTAL_TIMEOUT,
+            retries=FETCH_RETRIES,
+        )
+        self.metrics_server = MetricsServer(self.metrics, host=METRICS_HOST, port=self._metrics_port)
+        self.loop_monitor = LoopMonitor(self.metrics, interval=LOOP_MONITOR_INTERVAL, threshold=LOOP_BLOCK_THRESHOLD)
+        self.loop_monitor.start(self.loop)
+
+        self.profiler = None
+        if PROFILE_SLOW_RENDERS:
+            self.profiler = SlowRenderProfiler(
+                self.metrics,
+                directory=PROFILE_DIRECTORY,
+                threshold=PROFILE_THRESHOLD,
+                max_bytes=PROFILE_MAX_BYTES,
+                trace_memory=PROFILE_TRACE_MEMORY,
+            )
+        self.scheduler = RenderScheduler(
+            workers=RENDER_WORKERS,
+            max_queue=RENDER_QUEUE_SIZE,
+            deadline=RENDER_DEADLINE,
+        )
+        self.scheduler.start(self.loop)
+        # Clusters run on the same host, so they split its memory budget
+        self.memory = MemoryBudget(self.metrics, capacity=MEMORY_BUDGET // self.cluster_count, max_wait=MEMORY_WAIT)
+        self.limiter = CostLimiter(
+            user_capacity=USER_BUDGET,
+            user_rate=USER_BUDGET_REFILL,
+            guild_capacity=GUILD_BUDGET,
+            guild_rate=GUILD_BUDGET_REFILL,
+        )
+        self.degradation = DegradationPolicy(
+            self.scheduler,
+            self.metrics,
+            degrade_at=DEGRADE_AT,
+            recover_at=RECOVER_AT,
+            interval=DEGRADE_INTERVAL,
+        )
+        self.degradation.start(self.loop)
         self.loop.create_task(self._dispatch_first_ready())
-        self.load_extensions()
+
+        if self._metrics_port:
+            self.loop.create_task(self.metrics_server.start())
+
+        self.extensions_loaded = asyncio.Event()
+        self.loop.create_task(self._load_extensions())
 
     async def _dispatch_first_ready(self) -> None:
         await self.wait_until_ready()
         self.dispatch('first_ready')
 
     async def on_first_ready(self) -> None:
-        print(f'Logged in as {self.user} (ID: {self.user.id})')
+        cluster = '' if self.cluster_id is None else f' as cluster {self.cluster_id} (shards {self.shard_ids})'
+        print(f'Logged in as {self.user} (ID: {self.user.id}){cluster}')
+
+        self.metrics.gauge(
+            'photon_startup_seconds', 'Time from process start until the bot was ready',
+        ).set(time.perf_counter() - self._started_at)
+        self.loop.create_task(self._prewarm())
 
     async def on_command_error(self, ctx: commands.Context, error: Exception) -> None:
         if isinstance(error, commands.CommandNotFound):
@@ -84,21 +281,78 @@ class Photon(commands.Bot):
 
         error = getattr(error, 'original', error)
 
+        if isinstance(error, RenderCancelled) and error.reason == RenderCancelled.MESSAGE_DELETED:
+            return  # Deleted on purpose, there's nobody left to tell
+
+        if isinstance(error, PhotonError):
+            return await ctx.send(f'{self.ERROR_EMOJI} {error}')
+
         if isinstance(error, discord.NotFound) and error.code == 10062:
             return
 
         await ctx.send(error)
         raise error
 
+    async def on_command_completion(self, ctx: Context) -> None:
+        if self._first_command:
+            self._first_command = False
+            self.metrics.gauge(
+                'photon_first_command_seconds', 'Time from process start until the first command completed',
+            ).set(time.perf_counter() - self._started_at)
+
+        timings = getattr(ctx, 'timings', None)
+        if timings is None:
+            return
+
+        command = ctx.command.qualified_name
+        histogram = self.metrics.histogram('photon_command_stage_seconds', 'Time spent in each stage of a command')
+
+        for stage, seconds in timings:
+            histogram.observe(seconds, command=command, stage=stage)
+
+        histogram.observe(timings.elapsed, command=command, stage='total')
+
+        self.metrics.histogram(
+            'photon_command_rest_calls', 'REST requests made for each command', buckets=self.REST_CALL_BUCKETS,
+        ).observe(ctx.rest_calls, command=command)
+
+        if ctx.final_response is not None:
+            self.metrics.histogram(
+                'photon_command_first_response_seconds', 'Time until a command showed a preview or its result',
+            ).observe(ctx.first_response, command=command)
+            self.metrics.histogram(
+                'photon_command_final_result_seconds', 'Time until a command showed its result',
+            ).observe(ctx.final_response, command=command)
+
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent) -> None:
+        self.scheduler.cancel(payload.message_id, RenderCancelled.MESSAGE_DELETED)
+
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent) -> None:
+        for message_id in payload.message_ids:
+            self.scheduler.cancel(message_id, RenderCancelled.MESSAGE_DELETED)
+
     async def process_commands(self, message: discord.Message) -> None:
         if message.author.bot:
             return
 
+        if not self.extensions_loaded.is_set():
+            await self.extensions_loaded.wait()
+
         ctx = await self.get_context(message, cls=Context)
-        await self.invoke(ctx)
+        token = current_context.set(ctx)
+
+        try:
+            await self.invoke(ctx)
+        finally:
+            current_context.reset(token)
 
     async def close(self) -> None:
+        await self.metrics_server.close()
+        self.loop_monitor.close()
+        self.degradation.close()
+        await self.scheduler.close()
         await self.session.close()
+        await self.fetcher.close()
         await super().close()
 
     def run(self) -> None:
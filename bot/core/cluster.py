@@ -0,0 +1,335 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import re
+import signal
+import time
+
+import aiohttp
+from aiohttp import web
+from typing import Any, Optional
+
+from .config import METRICS_HOST, METRICS_PORT
+
+__all__ = (
+    'Cluster',
+    'Supervisor',
+    'split_shards',
+)
+
+log = logging.getLogger(__name__)
+
+SAMPLE_REGEX = re.compile(r'^(?P<name>[a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(?P<labels>.*)\})? (?P<value>\S+)$')
+
+
+def split_shards(shard_count: int, clusters: int) -> list[list[int]]:
+    """Splits shard IDs into ``clusters`` contiguous, evenly sized ranges."""
+    size, extra = divmod(shard_count, clusters)
+    ranges, start = [], 0
+
+    for i in range(clusters):
+        end = start + size + (i < extra)
+        ranges.append(list(range(start, end)))
+        start = end
+
+    return ranges
+
+
+async def _report_health(bot: Any, cluster_id: int, health: multiprocessing.Queue, interval: float) -> None:
+    while True:
+        scheduler = bot.scheduler
+
+        try:
+            health.put_nowait({
+                'cluster': cluster_id,
+                'pid': os.getpid(),
+                'time': time.time(),
+                'ready': bot.is_ready(),
+                'shards': list(bot.shard_ids or ()),
+                'guilds': len(bot.guilds),
+                'latency': bot.latency if bot.is_ready() else None,
+                'render_queued': scheduler.queued,
+                'render_active': scheduler.active,
+            })
+        except queue.Full:
+            pass
+
+        await asyncio.sleep(interval)
+
+
+def _run_cluster(
+    cluster_id: int,
+    shard_ids: list[int],
+    shard_count: int,
+    cluster_count: int,
+    health: multiprocessing.Queue,
+    interval: float,
+    metrics_port: int,
+) -> None:
+    from .bot import Photon
+
+    bot = Photon(
+        shard_ids=shard_ids,
+        shard_count=shard_count,
+        cluster_id=cluster_id,
+        cluster_count=cluster_count,
+        metrics_port=metrics_port,
+    )
+    bot.loop.create_task(_report_health(bot, cluster_id, health, interval))
+    bot.run()
+
+
+class Cluster:
+    """A process running a range of shards, as seen by the :class:`Supervisor`."""
+
+    def __init__(self, cluster_id: int, shard_ids: list[int]) -> None:
+        self.id: int = cluster_id
+        self.shard_ids: list[int] = shard_ids
+
+        self.process: Optional[multiprocessing.Process] = None
+        self.started_at: float = 0
+        self.restarts: int = 0
+        self.health: dict[str, Any] = {}
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    @property
+    def metrics_port(self) -> int:
+        # Every cluster serves its own metrics, the supervisor scrapes and merges them
+        return METRICS_PORT and METRICS_PORT + 1 + self.id
+
+
+class Supervisor:
+    """Runs Photon as several processes ("clusters"), each owning a range of shards.
+
+    Crashed clusters are restarted with exponential backoff, and so are clusters that
+    stop reporting their health. The supervisor serves every cluster's metrics merged
+    under a ``cluster`` label at ``/metrics``, and their latest health reports at ``/health``.
+    """
+
+    HEALTH_INTERVAL = 10
+    HEALTH_TIMEOUT = 120  # Includes the time it takes to log in and become ready
+    STABLE_AFTER = 300  # A cluster that ran for this long has its backoff reset
+    MAX_BACKOFF = 300
+
+    def __init__(self, *, clusters: int, shard_count: Optional[int] = None) -> None:
+        self.cluster_count: int = clusters
+        self.shard_count: Optional[int] = shard_count
+        self.clusters: list[Cluster] = []
+
+        self._context = multiprocessing.get_context('spawn')
+        self._health: multiprocessing.Queue = self._context.Queue(maxsize=1024)
+        self._closing: bool = False
+        self._stopping: asyncio.Event = None  # type: ignore
+        self._restarting: dict[int, asyncio.Task] = {}
+        self._runner: web.AppRunner = None  # type: ignore
+
+    async def _recommended_shards(self) -> int:
+        headers = {'Authorization': f'Bot {os.environ["TOKEN"]}'}
+
+        async with aiohttp.ClientSession(headers=headers) as session:
+            async with session.get('https://discord.com/api/v9/gateway/bot') as response:
+                response.raise_for_status()
+                return (await response.json())['shards']
+
+    def _spawn(self, cluster: Cluster) -> None:
+        cluster.process = self._context.Process(
+            target=_run_cluster,
+            args=(
+                cluster.id,
+                cluster.shard_ids,
+                self.shard_count,
+                len(self.clusters),
+                self._health,
+                self.HEALTH_INTERVAL,
+                cluster.metrics_port,
+            ),
+            name=f'photon-cluster-{cluster.id}',
+        )
+        cluster.process.start()
+        cluster.started_at = time.monotonic()
+        cluster.health = {}
+
+        log.info('Started cluster %d (shards %s, pid %d)', cluster.id, cluster.shard_ids, cluster.process.pid)
+
+    def _drain_health(self) -> None:
+        while True:
+            try:
+                report = self._health.get_nowait()
+            except queue.Empty:
+                return
+
+            cluster = self.clusters[report['cluster']]
+            if cluster.process is not None and report['pid'] == cluster.process.pid:
+                cluster.health = report
+
+    def _stale(self, cluster: Cluster) -> bool:
+        last_seen = cluster.health.get('time')
+        if last_seen is None:
+            return time.monotonic() - cluster.started_at > self.HEALTH_TIMEOUT
+
+        return time.time() - last_seen > self.HEALTH_TIMEOUT
+
+    async def _restart(self, cluster: Cluster, reason: str) -> None:
+        if time.monotonic() - cluster.started_at > self.STABLE_AFTER:
+            cluster.restarts = 0
+
+        delay = min(self.MAX_BACKOFF, 2 ** cluster.restarts)
+        cluster.restarts += 1
+
+        log.warning('Cluster %d %s, restarting in %ds (restart #%d)', cluster.id, reason, delay, cluster.restarts)
+
+        if cluster.alive:
+            cluster.process.terminate()  # type: ignore
+            await asyncio.to_thread(cluster.process.join, 10)  # type: ignore
+
+            if cluster.alive:
+                cluster.process.kill()  # type: ignore
+
+        await asyncio.sleep(delay)
+
+        if not self._closing:
+            self._spawn(cluster)
+
+    async def _watch(self) -> None:
+        restarting = self._restarting
+
+        while not self._stopping.is_set():
+            self._drain_health()
+
+            for cluster in self.clusters:
+                if cluster.id in restarting and not restarting[cluster.id].done():
+                    continue
+
+                if not cluster.alive:
+                    reason = f'exited with code {cluster.process.exitcode}'  # type: ignore
+                elif self._stale(cluster):
+                    reason = 'stopped reporting health'
+                else:
+                    continue
+
+                restarting[cluster.id] = asyncio.create_task(self._restart(cluster, reason))
+
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=1)
+            except asyncio.TimeoutError:
+                pass
+
+    @staticmethod
+    def _relabel(text: str, cluster_id: int, families: dict[str, list[str]]) -> None:
+        """Adds a cluster's samples, labelled with its ID, to the lines of their metric family."""
+        family = None
+
+        for line in text.splitlines():
+            if line.startswith('#'):
+                # HELP and TYPE lines come first and only once per family
+                family = line.split()[2]
+                lines = families.setdefault(family, [])
+
+                if line not in lines:
+                    lines.append(line)
+                continue
+
+            if family is None or not (match := SAMPLE_REGEX.match(line)):
+                continue
+
+            labels = f'cluster="{cluster_id}"'
+            if match['labels']:
+                labels += ',' + match['labels']
+
+            families[family].append(f'{match["name"]}{{{labels}}} {match["value"]}')
+
+    async def _handle_metrics(self, _request: web.Request) -> web.Response:
+        families: dict[str, list[str]] = {
+            'photon_cluster_up': ['# TYPE photon_cluster_up gauge'],
+            'photon_cluster_restarts': ['# TYPE photon_cluster_restarts gauge'],
+        }
+
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5)) as session:
+            for cluster in self.clusters:
+                try:
+                    async with session.get(f'http://127.0.0.1:{cluster.metrics_port}/metrics') as response:
+                        text = await response.text()
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    up = 0
+                else:
+                    up = 1
+                    self._relabel(text, cluster.id, families)
+
+                families['photon_cluster_up'].append(f'photon_cluster_up{{cluster="{cluster.id}"}} {up}')
+                families['photon_cluster_restarts'].append(
+                    f'photon_cluster_restarts{{cluster="{cluster.id}"}} {cluster.restarts}'
+                )
+
+        lines = [line for family in families.values() for line in family]
+        return web.Response(text='\n'.join(lines) + '\n', content_type='text/plain')
+
+    async def _handle_health(self, _request: web.Request) -> web.Response:
+        return web.json_response([
+            {'cluster': cluster.id, 'alive': cluster.alive, 'restarts': cluster.restarts, **cluster.health}
+            for cluster in self.clusters
+        ])
+
+    async def _serve(self) -> None:
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle_metrics)
+        app.router.add_get('/health', self._handle_health)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, METRICS_HOST, METRICS_PORT).start()
+
+    async def _shutdown(self) -> None:
+        self._closing = True
+        log.info('Shutting down %d clusters', len(self.clusters))
+
+        for task in self._restarting.values():
+            task.cancel()
+
+        for cluster in self.clusters:
+            if cluster.alive:
+                cluster.process.terminate()  # type: ignore
+
+        for cluster in self.clusters:
+            if cluster.process is not None:
+                await asyncio.to_thread(cluster.process.join, 30)
+
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def start(self) -> None:
+        self._stopping = asyncio.Event()
+
+        if self.shard_count is None:
+            self.shard_count = await self._recommended_shards()
+
+        clusters = min(self.cluster_count, self.shard_count)
+        self.clusters = [
+            Cluster(i, shard_ids) for i, shard_ids in enumerate(split_shards(self.shard_count, clusters))
+        ]
+
+        log.info('Running %d shards across %d clusters', self.shard_count, clusters)
+
+        for cluster in self.clusters:
+            self._spawn(cluster)
+
+        if METRICS_PORT:
+            await self._serve()
+
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self._stopping.set)
+
+        try:
+            await self._watch()
+        finally:
+            await self._shutdown()
+
+    def run(self) -> None:
+        asyncio.run(self.start())
@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import os
+
+from dotenv import load_dotenv
+from typing import Callable, TypeVar
+
+T = TypeVar('T')
+
+__all__ = (
+    'env',
+    'RENDER_WORKERS',
+    'RENDER_QUEUE_SIZE',
+    'RENDER_DEADLINE',
+    'SPOOL_INPUTS_OVER',
+    'SPOOL_OUTPUTS',
+    'MEMORY_BUDGET',
+    'MEMORY_WAIT',
+    'MAX_IMAGE_PIXELS',
+    'MAX_ANIMATION_PIXELS',
+    'FETCH_POOL_SIZE',
+    'FETCH_PER_HOST',
+    'FETCH_DISCORD_PER_HOST',
+    'FETCH_KEEPALIVE',
+    'FETCH_DNS_TTL',
+    'FETCH_POOL_TIMEOUT',
+    'FETCH_CONNECT_TIMEOUT',
+    'FETCH_READ_TIMEOUT',
+    'FETCH_TOTAL_TIMEOUT',
+    'FETCH_RETRIES',
+    'CONVERSION_CACHE_TTL',
+    'CONVERSION_CACHE_MISS_TTL',
+    'CONVERSION_CACHE_UNTRACKED_MEMBER_TTL',
+    'USER_BUDGET',
+    'USER_BUDGET_REFILL',
+    'GUILD_BUDGET',
+    'GUILD_BUDGET_REFILL',
+    'DEGRADE_AT',
+    'RECOVER_AT',
+    'DEGRADE_INTERVAL',
+    'PROGRESS_EDIT_IN_PLACE',
+    'PREVIEW_ANIMATIONS',
+    'PREVIEW_MIN_FRAMES',
+    'METRICS_HOST',
+    'METRICS_PORT',
+    'LOOP_MONITOR_INTERVAL',
+    'LOOP_BLOCK_THRESHOLD',
+    'PROFILE_SLOW_RENDERS',
+    'PROFILE_THRESHOLD',
+    'PROFILE_DIRECTORY',
+    'PROFILE_MAX_BYTES',
+    'PROFILE_TRACE_MEMORY',
+)
+
+load_dotenv()
+
+
+def env(name: str, default: T, cast: Callable[[str], T] = None) -> T:
+    """Reads a configuration value from the environment, falling back to the given default."""
+    try:
+        value = os.environ[name]
+    except KeyError:
+        return default
+
+    if cast is None and isinstance(default, bool):
+        return value.lower() in ('1', 'true', 'yes', 'on')  # type: ignore
+
+    return (cast or type(default))(value)
+
+
+# Rendering
+RENDER_WORKERS: int = env('PHOTON_RENDER_WORKERS', os.cpu_count() or 2)
+RENDER_QUEUE_SIZE: int = env('PHOTON_RENDER_QUEUE_SIZE', 32)
+RENDER_DEADLINE: float = env('PHOTON_RENDER_DEADLINE', 60.0)  # Seconds a single render may run for
+
+# Downloads larger than this many KiB are spooled to a memory-mapped temporary file
+SPOOL_INPUTS_OVER: int = env('PHOTON_SPOOL_INPUTS_OVER_KB', 1024) * 1024
+SPOOL_OUTPUTS: bool = env('PHOTON_SPOOL_OUTPUTS', False)  # Encode renders into temporary files
+
+# Memory renders may reserve altogether, in MiB, and how many seconds one waits for it before giving up.
+# The budget is for the whole host: with several clusters, each process gets an even share of it.
+MEMORY_BUDGET: int = env('PHOTON_MEMORY_BUDGET_MB', 1024) * 1024 * 1024
+MEMORY_WAIT: float = env('PHOTON_MEMORY_WAIT', 15.0)
+
+# Images are refused before decoding past this many pixels per frame, or over all frames of an animation
+MAX_IMAGE_PIXELS: int = env('PHOTON_MAX_IMAGE_PIXELS', 4096 * 4096)
+MAX_ANIMATION_PIXELS: int = env('PHOTON_MAX_ANIMATION_PIXELS', 500_000_000)
+
+# Image fetching, with one connection pool for Discord's CDN and one for every other host
+FETCH_POOL_SIZE: int = env('PHOTON_FETCH_POOL_SIZE', 64)  # Connections per pool
+FETCH_PER_HOST: int = env('PHOTON_FETCH_PER_HOST', 8)
+FETCH_DISCORD_PER_HOST: int = env('PHOTON_FETCH_DISCORD_PER_HOST', 32)
+FETCH_KEEPALIVE: float = env('PHOTON_FETCH_KEEPALIVE', 30.0)  # Seconds idle connections are kept open
+FETCH_DNS_TTL: int = env('PHOTON_FETCH_DNS_TTL', 300)  # Seconds
+FETCH_POOL_TIMEOUT: float = env('PHOTON_FETCH_POOL_TIMEOUT', 5.0)  # Seconds to wait for a free connection
+FETCH_CONNECT_TIMEOUT: float = env('PHOTON_FETCH_CONNECT_TIMEOUT', 5.0)
+FETCH_READ_TIMEOUT: float = env('PHOTON_FETCH_READ_TIMEOUT', 10.0)  # Seconds without receiving any data
+FETCH_TOTAL_TIMEOUT: float = env('PHOTON_FETCH_TOTAL_TIMEOUT', 30.0)  # Seconds for a whole fetch, retries included
+FETCH_RETRIES: int = env('PHOTON_FETCH_RETRIES', 2)
+
+# Seconds members and emojis looked up from command arguments are remembered, and lookups that found nothing
+CONVERSION_CACHE_TTL: float = env('PHOTON_CONVERSION_CACHE_TTL', 300.0)
+CONVERSION_CACHE_MISS_TTL: float = env('PHOTON_CONVERSION_CACHE_MISS_TTL', 60.0)
+# Seconds members are remembered without the members intent, when changes to them can't be seen
+CONVERSION_CACHE_UNTRACKED_MEMBER_TTL: float = env('PHOTON_CONVERSION_CACHE_UNTRACKED_MEMBER_TTL', 10.0)
+
+# Admission control, in cost units (roughly megapixels rendered, see IFunnyCaption.estimate_cost)
+USER_BUDGET: float = env('PHOTON_USER_BUDGET', 60.0)
+USER_BUDGET_REFILL: float = env('PHOTON_USER_BUDGET_REFILL', 1.0)  # Per second
+GUILD_BUDGET: float = env('PHOTON_GUILD_BUDGET', 240.0)
+GUILD_BUDGET_REFILL: float = env('PHOTON_GUILD_BUDGET_REFILL', 4.0)  # Per second
+
+# Load-adaptive quality, in queued jobs per render worker
+DEGRADE_AT: float = env('PHOTON_DEGRADE_AT', 1.0)
+RECOVER_AT: float = env('PHOTON_RECOVER_AT', 0.25)
+DEGRADE_INTERVAL: float = env('PHOTON_DEGRADE_INTERVAL', 10.0)  # Seconds between steps
+
+# Edit one progress message into the result, instead of deleting it and sending the result
+PROGRESS_EDIT_IN_PLACE: bool = env('PHOTON_PROGRESS_EDIT_IN_PLACE', True)
+
+# Show the first frame of animations with at least this many frames while the rest renders (needs the above)
+PREVIEW_ANIMATIONS: bool = env('PHOTON_PREVIEW_ANIMATIONS', False)
+PREVIEW_MIN_FRAMES: int = env('PHOTON_PREVIEW_MIN_FRAMES', 30)
+
+# Prometheus metrics endpoint, set the port to 0 to disable it
+METRICS_HOST: str = env('PHOTON_METRICS_HOST', '127.0.0.1')
+METRICS_PORT: int = env('PHOTON_METRICS_PORT', 9184)
+
+# Event loop monitoring, in seconds
+LOOP_MONITOR_INTERVAL: float = env('PHOTON_LOOP_MONITOR_INTERVAL', 0.25)
+LOOP_BLOCK_THRESHOLD: float = env('PHOTON_LOOP_BLOCK_THRESHOLD', 0.1)
+
+# Profiling of slow renders (opt-in)
+PROFILE_SLOW_RENDERS: bool = env('PHOTON_PROFILE_SLOW_RENDERS', False)
+PROFILE_THRESHOLD: float = env('PHOTON_PROFILE_THRESHOLD', 5.0)  # Seconds
+PROFILE_DIRECTORY: str = env('PHOTON_PROFILE_DIRECTORY', './profiles')
+PROFILE_MAX_BYTES: int = env('PHOTON_PROFILE_MAX_MB', 100) * 1024 * 1024
+PROFILE_TRACE_MEMORY: bool = env('PHOTON_PROFILE_TRACE_MEMORY', True)
@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+
+from typing import NamedTuple, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .metrics import Metrics
+    from .scheduler import RenderScheduler
+
+__all__ = (
+    'QualityLevel',
+    'DegradationPolicy',
+)
+
+log = logging.getLogger(__name__)
+
+
+class QualityLevel(NamedTuple):
+    """Render settings for one step of degradation. ``None`` means "no limit"."""
+    max_width: Optional[int]
+    max_frames: Optional[int]
+    colors: Optional[int]
+
+
+class DegradationPolicy:
+    """Trades output quality for throughput when the render backlog grows.
+
+    Load is measured as the number of queued jobs per worker. Once every worker is busy
+    and the backlog reaches ``degrade_at``, quality drops one level; once it falls to
+    ``recover_at`` it goes back up one level. At most one step is taken per ``interval``
+    seconds, so quality follows sustained load rather than single bursts.
+    """
+
+    LEVELS = (
+        QualityLevel(max_width=None, max_frames=None, colors=None),
+        QualityLevel(max_width=500, max_frames=200, colors=192),
+        QualityLevel(max_width=400, max_frames=120, colors=128),
+        QualityLevel(max_width=320, max_frames=60, colors=64),
+    )
+
+    def __init__(
+        self,
+        scheduler: RenderScheduler,
+        metrics: Metrics,
+        *,
+        degrade_at: float,
+        recover_at: float,
+        interval: float,
+    ) -> None:
+        self.scheduler: RenderScheduler = scheduler
+        self.degrade_at: float = degrade_at
+        self.recover_at: float = recover_at
+        self.interval: float = interval
+        self.level: int = 0
+
+        self._changed_at: float = 0
+        self._task: asyncio.Task = None  # type: ignore
+
+        self._level_gauge = metrics.gauge('photon_render_quality_level', 'Current render degradation level (0 is full quality)')
+        self._changes = metrics.counter('photon_render_quality_changes_total', 'Render degradation level changes')
+        self._queued_gauge = metrics.gauge('photon_render_queue_depth', 'Render jobs waiting for a worker')
+        self._utilization_gauge = metrics.gauge('photon_render_worker_utilization', 'Fraction of render workers busy')
+
+        self._level_gauge.set(0)
+
+    @property
+    def quality(self) -> QualityLevel:
+        return self.LEVELS[self.level]
+
+    def _set_level(self, level: int, *, backlog: float, utilization: float) -> None:
+        direction = 'degrade' if level > self.level else 'recover'
+        log.warning(
+            'Render quality %s: level %d -> %d (backlog %.2f jobs/worker, utilization %.0f%%, %s)',
+            direction, self.level, level, backlog, utilization * 100, self.LEVELS[level],
+        )
+
+        self.level = level
+        self._changed_at = time.monotonic()
+        self._level_gauge.set(level)
+        self._changes.inc(direction=direction)
+
+    def evaluate(self) -> QualityLevel:
+        """Re-reads the scheduler's load, stepping the quality level if needed."""
+        scheduler = self.scheduler
+        backlog = scheduler.queued / scheduler.workers
+        utilization = scheduler.utilization
+
+        self._queued_gauge.set(scheduler.queued)
+        self._utilization_gauge.set(utilization)
+
+        if time.monotonic() - self._changed_at < self.interval:
+            return self.quality
+
+        if utilization >= 1 and backlog >= self.degrade_at and self.level < len(self.LEVELS) - 1:
+            self._set_level(self.level + 1, backlog=backlog, utilization=utilization)
+        elif backlog <= self.recover_at and self.level > 0:
+            self._set_level(self.level - 1, backlog=backlog, utilization=utilization)
+
+        return self.quality
+
+    async def _run(self) -> None:
+        while True:
+            self.evaluate()
+            await asyncio.sleep(self.interval / 2)
+
+    def start(self, loop: asyncio.AbstractEventLoop, /) -> None:
+        self._task = loop.create_task(self._run())
+
+    def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+from discord.ext import commands
+
+__all__ = (
+    'PhotonError',
+    'QueueFull',
+    'BudgetExceeded',
+    'OutputTooLarge',
+    'RenderTooLarge',
+    'RenderBusy',
+    'RenderCancelled',
+    'DeadlineExceeded',
+)
+
+
+class PhotonError(commands.CommandError):
+    """Base class for errors whose message is meant to be shown to the user as-is."""
+
+
+class QueueFull(PhotonError):
+    """Raised when the render queue cannot accept any more jobs."""
+
+    def __init__(self, size: int, /) -> None:
+        self.size: int = size
+        super().__init__(f'The render queue is full right now ({size:,} jobs waiting), try again in a bit.')
+
+
+class BudgetExceeded(PhotonError):
+    """Raised when a job costs more than what is left of a user's or guild's render budget."""
+
+    def __init__(self, scope: str, retry_after: float, /) -> None:
+        self.scope: str = scope
+        self.retry_after: float = retry_after
+
+        who = 'You are' if scope == 'user' else 'This server is'
+        super().__init__(f'{who} rendering too much right now, try again in {retry_after:.1f}s.')
+
+
+class OutputTooLarge(PhotonError):
+    """Raised when a render could not be made small enough to upload."""
+
+    def __init__(self, size: int, limit: int, /) -> None:
+        self.size: int = size
+        self.limit: int = limit
+
+        import humanize  # Only needed once something goes wrong, so kept off the startup path
+
+        their_size = humanize.naturalsize(size, binary=True, format='%.2f')
+        limit_size = humanize.naturalsize(limit, binary=True, format='%.2f')
+        super().__init__(f'The result is too large to upload, even at lower quality. ({their_size} > {limit_size})')
+
+    def __reduce__(self) -> tuple[type, tuple[int, int]]:
+        # Raised in worker processes, e.g. by ``python -m bot.caption``
+        return type(self), (self.size, self.limit)
+
+
+class RenderTooLarge(PhotonError):
+    """Raised when rendering an image would take more memory than the bot has for rendering altogether."""
+
+    def __init__(self, size: int, limit: int, /) -> None:
+        self.size: int = size
+        self.limit: int = limit
+
+        import humanize  # Only needed once something goes wrong, so kept off the startup path
+
+        their_size = humanize.naturalsize(size, binary=True, format='%.2f')
+        limit_size = humanize.naturalsize(limit, binary=True, format='%.2f')
+        super().__init__(f'This image takes too much memory to render. (about {their_size} > {limit_size})')
+
+
+class RenderBusy(PhotonError):
+    """Raised when a render waited too long for memory to be freed up by other renders."""
+
+    def __init__(self, waited: float, /) -> None:
+        self.waited: float = waited
+        super().__init__('Too many large images are being rendered right now, try again in a bit.')
+
+
+class RenderCancelled(PhotonError):
+    """Raised from a render that was cancelled before it could finish."""
+
+    MESSAGE_DELETED = 'message deleted'  # The command's message was deleted while it rendered
+
+    def __init__(self, reason: str, /) -> None:
+        self.reason: str = reason
+        super().__init__(f'Render cancelled ({reason}).')
+
+
+class DeadlineExceeded(RenderCancelled):
+    """Raised from a render that ran past its deadline."""
+
+    def __init__(self, timeout: float, /) -> None:
+        self.timeout: float = timeout
+        super().__init__('deadline')
+        self.args = (f'Rendering took too long (over {timeout:.0f}s), try a smaller image.',)
@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+import logging
+
+from aiohttp import web
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .metrics import Metrics
+
+__all__ = 'MetricsServer',
+
+log = logging.getLogger(__name__)
+
+
+class MetricsServer:
+    """Serves a metrics registry over HTTP at ``/metrics``, for Prometheus to scrape."""
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self, metrics: Metrics, *, host: str, port: int) -> None:
+        self.metrics: Metrics = metrics
+        self.host: str = host
+        self.port: int = port
+
+        self._runner: web.AppRunner = None  # type: ignore
+
+    async def _handle_metrics(self, _request: web.Request) -> web.Response:
+        return web.Response(body=self.metrics.render().encode(), headers={'Content-Type': self.CONTENT_TYPE})
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle_metrics)
+
+        self._runner = runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+
+        try:
+            await web.TCPSite(runner, self.host, self.port).start()
+        except OSError:
+            log.exception('Could not serve metrics on %s:%d', self.host, self.port)
+            await self.close()
+        else:
+            log.info('Serving metrics on http://%s:%d/metrics', self.host, self.port)
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None  # type: ignore
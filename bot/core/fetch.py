@@ -0,0 +1,299 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import time
+
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, TYPE_CHECKING
+
+import aiohttp
+from yarl import URL
+
+if TYPE_CHECKING:
+    from .metrics import Metrics
+
+__all__ = (
+    'FetchPool',
+    'FetchClient',
+)
+
+log = logging.getLogger(__name__)
+
+
+class FetchPool:
+    """A session with its own connection pool, reporting how busy that pool is.
+
+    Requests count as in use from when they get a connection, new or pooled, until their response
+    is released; requests need a :meth:`request_context` for that. Time spent waiting for a free
+    connection is recorded per request, along with whether a pooled connection was reused and
+    whether the host was found in the DNS cache.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        metrics: Metrics,
+        *,
+        size: int,
+        per_host: int,
+        keepalive: float,
+        dns_ttl: int,
+        timeout: aiohttp.ClientTimeout,
+    ) -> None:
+        self.name: str = name
+        self.size: int = size
+        self.in_use: int = 0
+        self.waiting: int = 0
+
+        self._in_use = metrics.gauge('photon_fetch_pool_in_use', 'Image fetches holding a pooled connection')
+        self._waiting = metrics.gauge('photon_fetch_pool_waiting', 'Image fetches waiting for a free connection')
+        self._saturation = metrics.gauge(
+            'photon_fetch_pool_saturation', 'Share of the connection pool in use, from 0 to 1',
+        )
+        self._wait_time = metrics.histogram(
+            'photon_fetch_pool_wait_seconds', 'Time image fetches spent waiting for a free connection',
+        )
+        self._connections = metrics.counter('photon_fetch_connections_total', 'Connections used by image fetches')
+        self._dns = metrics.counter('photon_fetch_dns_lookups_total', 'DNS lookups made by image fetches')
+
+        trace = aiohttp.TraceConfig()
+        trace.on_connection_queued_start.append(self._on_queued_start)
+        trace.on_connection_queued_end.append(self._on_queued_end)
+        trace.on_connection_create_end.append(self._on_connection_created)
+        trace.on_connection_reuseconn.append(self._on_connection_reused)
+        trace.on_dns_cache_hit.append(self._on_dns_cache_hit)
+        trace.on_dns_cache_miss.append(self._on_dns_cache_miss)
+        trace.on_request_end.append(self._on_request_end)
+        trace.on_request_exception.append(self._on_request_exception)
+
+        connector = aiohttp.TCPConnector(
+            limit=size,
+            limit_per_host=per_host,
+            keepalive_timeout=keepalive,
+            use_dns_cache=True,
+            ttl_dns_cache=dns_ttl,
+        )
+        self.session: aiohttp.ClientSession = aiohttp.ClientSession(
+            connector=connector, timeout=timeout, trace_configs=[trace],
+        )
+
+    def _update(self) -> None:
+        self._in_use.set(self.in_use, pool=self.name)
+        self._waiting.set(self.waiting, pool=self.name)
+        self._saturation.set(min(1.0, self.in_use / self.size), pool=self.name)
+
+    @staticmethod
+    def request_context() -> SimpleNamespace:
+        """State for one request, passed to the session as ``trace_request_ctx``."""
+        return SimpleNamespace(holding=False)
+
+    def _hold(self, context: SimpleNamespace) -> None:
+        request = context.trace_request_ctx
+        if request is None or request.holding:
+            return
+
+        request.holding = True
+        self.in_use += 1
+        self._update()
+
+    def release(self, request: SimpleNamespace, /) -> None:
+        """Stops counting the request as in use, once its response is released."""
+        if not request.holding:
+            return
+
+        request.holding = False
+        self.in_use -= 1
+        self._update()
+
+    async def _on_queued_start(self, _session: Any, context: SimpleNamespace, _params: Any) -> None:
+        context.queued_at = time.perf_counter()
+        self.waiting += 1
+        self._update()
+
+    def _stop_waiting(self, context: SimpleNamespace) -> None:
+        queued_at = getattr(context, 'queued_at', None)
+        if queued_at is None:
+            return
+
+        context.queued_at = None
+        self.waiting -= 1
+        self._wait_time.observe(time.perf_counter() - queued_at, pool=self.name)
+        self._update()
+
+    async def _on_queued_end(self, _session: Any, context: SimpleNamespace, _params: Any) -> None:
+        self._stop_waiting(context)
+
+    async def _on_request_end(self, _session: Any, context: SimpleNamespace, _params: Any) -> None:
+        # Requests that time out or are cancelled while queued never see the end of the queue
+        self._stop_waiting(context)
+
+    async def _on_request_exception(self, _session: Any, context: SimpleNamespace, _params: Any) -> None:
+        self._stop_waiting(context)
+
+        if context.trace_request_ctx is not None:
+            self.release(context.trace_request_ctx)
+
+    async def _on_connection_created(self, _session: Any, context: SimpleNamespace, _params: Any) -> None:
+        self._connections.inc(pool=self.name, kind='new')
+        self._hold(context)
+
+    async def _on_connection_reused(self, _session: Any, context: SimpleNamespace, _params: Any) -> None:
+        self._connections.inc(pool=self.name, kind='reused')
+        self._hold(context)
+
+    async def _on_dns_cache_hit(self, *_: Any) -> None:
+        self._dns.inc(pool=self.name, result='hit')
+
+    async def _on_dns_cache_miss(self, *_: Any) -> None:
+        self._dns.inc(pool=self.name, result='miss')
+
+    async def close(self) -> None:
+        await self.session.close()
+
+
+class FetchClient:
+    """Fetches images over HTTP, with separate connection pools for Discord's CDN and everywhere else.
+
+    Discord's CDN is trusted with more connections per host than arbitrary hosts, which are
+    capped so that one slow site can't take up the whole pool. Connections are kept alive and
+    DNS results cached between fetches.
+
+    Connection failures, timeouts before a response arrives and transient statuses (see
+    ``RETRY_STATUSES``) are retried up to ``retries`` times, with jittered exponential backoff.
+    Responses are handed over as soon as their headers arrive; reading the body is covered by
+    the read and total timeouts but is never retried.
+
+    ``total_timeout`` covers a whole fetch: every attempt, the backoff between them and reading
+    the body share it.
+    """
+
+    DISCORD_HOSTS = ('discordapp.com', 'discordapp.net', 'discord.com')
+    RETRY_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+    BACKOFF_BASE = 0.25  # Seconds
+    BACKOFF_MAX = 4.0  # Seconds
+
+    def __init__(
+        self,
+        metrics: Metrics,
+        *,
+        pool_size: int,
+        per_host: int,
+        discord_per_host: int,
+        keepalive: float,
+        dns_ttl: int,
+        pool_timeout: float,
+        connect_timeout: float,
+        read_timeout: float,
+        total_timeout: float,
+        retries: int,
+    ) -> None:
+        self.retries: int = retries
+        self.total_timeout: float = total_timeout
+
+        self._requests = metrics.counter('photon_fetch_requests_total', 'Image fetch requests, by response status')
+        self._retries = metrics.counter('photon_fetch_retries_total', 'Image fetch requests that were retried')
+        self._latency = metrics.histogram(
+            'photon_fetch_response_seconds', 'Time until an image fetch got its response headers',
+        )
+
+        self._timeouts: dict[str, float] = dict(
+            connect=pool_timeout + connect_timeout,  # Includes waiting for a free connection
+            sock_connect=connect_timeout,
+            sock_read=read_timeout,
+        )
+        timeout = aiohttp.ClientTimeout(total=total_timeout, **self._timeouts)
+        options = dict(size=pool_size, keepalive=keepalive, dns_ttl=dns_ttl, timeout=timeout)
+
+        self.discord: FetchPool = FetchPool('discord', metrics, per_host=discord_per_host, **options)
+        self.external: FetchPool = FetchPool('external', metrics, per_host=per_host, **options)
+
+    def pool_for(self, url: str, /) -> FetchPool:
+        host = URL(url).host or ''
+
+        if any(host == domain or host.endswith('.' + domain) for domain in self.DISCORD_HOSTS):
+            return self.discord
+
+        return self.external
+
+    def _backoff(self, attempt: int, /) -> float:
+        return random.uniform(0, min(self.BACKOFF_MAX, self.BACKOFF_BASE * 2 ** attempt))
+
+    @staticmethod
+    def _retry_after(response: aiohttp.ClientResponse, /) -> float:
+        try:
+            return float(response.headers.get('Retry-After', 0))
+        except ValueError:
+            return 0
+
+    async def _send(
+        self, pool: FetchPool, url: str, request: SimpleNamespace, /, **kwargs: Any,
+    ) -> aiohttp.ClientResponse:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.total_timeout
+        attempt = 0
+
+        while True:
+            start = time.perf_counter()
+            last = attempt == self.retries
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise asyncio.TimeoutError
+
+            timeout = aiohttp.ClientTimeout(total=remaining, **self._timeouts)
+
+            try:
+                response = await pool.session.get(url, timeout=timeout, trace_request_ctx=request, **kwargs)
+            except (aiohttp.InvalidURL, aiohttp.ClientSSLError):
+                self._requests.inc(pool=pool.name, status='error')
+                raise
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as exc:
+                self._requests.inc(pool=pool.name, status='error')
+                if last:
+                    raise
+
+                reason = 'timeout' if isinstance(exc, asyncio.TimeoutError) else 'connection'
+                delay = self._backoff(attempt)
+            else:
+                self._requests.inc(pool=pool.name, status=response.status)
+                self._latency.observe(time.perf_counter() - start, pool=pool.name)
+
+                if last or response.status not in self.RETRY_STATUSES:
+                    return response
+
+                reason = str(response.status)
+                delay = min(self.BACKOFF_MAX, max(self._backoff(attempt), self._retry_after(response)))
+                response.release()
+                pool.release(request)
+
+            # Retrying is pointless if the next attempt would have no time left
+            if loop.time() + delay >= deadline:
+                raise asyncio.TimeoutError
+
+            self._retries.inc(pool=pool.name, reason=reason)
+            log.debug('Retrying fetch of %s in %.2fs (%s)', url, delay, reason)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    @asynccontextmanager
+    async def get(self, url: str, /, **kwargs: Any) -> AsyncIterator[aiohttp.ClientResponse]:
+        """Sends a GET request, retrying transient failures, and releases the response afterwards."""
+        pool = self.pool_for(url)
+        request = pool.request_context()
+
+        try:
+            response = await self._send(pool, url, request, **kwargs)
+
+            try:
+                yield response
+            finally:
+                response.release()
+        finally:
+            pool.release(request)
+
+    async def close(self) -> None:
+        await self.discord.close()
+        await self.external.close()
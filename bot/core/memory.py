@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import asyncio
+import time
+
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, TYPE_CHECKING
+
+from .errors import RenderBusy, RenderTooLarge
+
+if TYPE_CHECKING:
+    from .metrics import Metrics
+
+__all__ = 'MemoryBudget',
+
+
+class MemoryBudget:
+    """Reserves the memory renders are estimated to need against one budget for the whole process.
+
+    Renders reserve their estimate (see ``IFunnyCaption.estimate_memory``) before they are queued,
+    so a render waiting for memory never holds a worker, and give it back once they are done. A
+    render that doesn't fit waits, in order of arrival, for up to ``max_wait`` seconds before it is
+    rejected with :class:`RenderBusy`. One that could never fit, needing more than ``capacity`` on
+    its own, is rejected right away with :class:`RenderTooLarge`.
+
+    Waiters are served strictly in order, so a large render isn't starved by a stream of small ones.
+    """
+
+    SIZE_BUCKETS = tuple(1024 * 1024 * 2 ** i for i in range(0, 13))  # 1 MiB to 4 GiB
+
+    def __init__(self, metrics: Metrics, *, capacity: int, max_wait: float) -> None:
+        self.capacity: int = capacity
+        self.max_wait: float = max_wait
+        self.reserved: int = 0
+
+        self._waiters: deque[tuple[int, asyncio.Future[None]]] = deque()
+
+        self._reserved = metrics.gauge('photon_memory_reserved_bytes', 'Memory reserved by running renders')
+        self._waiting = metrics.gauge('photon_memory_waiting', 'Renders waiting for memory to be freed up')
+        self._wait_time = metrics.histogram('photon_memory_wait_seconds', 'Time renders spent waiting for memory')
+        self._estimates = metrics.histogram(
+            'photon_memory_estimate_bytes', 'Memory renders were estimated to need', buckets=self.SIZE_BUCKETS,
+        )
+        self._rejections = metrics.counter('photon_memory_rejections_total', 'Renders refused for lack of memory')
+
+        metrics.gauge('photon_memory_budget_bytes', 'Memory renders may reserve altogether').set(capacity)
+        self._update()
+
+    @property
+    def available(self) -> int:
+        return self.capacity - self.reserved
+
+    @property
+    def waiting(self) -> int:
+        return sum(not future.done() for _, future in self._waiters)
+
+    def _update(self) -> None:
+        self._reserved.set(self.reserved)
+        self._waiting.set(self.waiting)
+
+    def _wake(self) -> None:
+        while self._waiters:
+            size, future = self._waiters[0]
+
+            if not future.done():
+                if size > self.available:
+                    break
+
+                self.reserved += size
+                future.set_result(None)
+
+            self._waiters.popleft()
+
+        self._update()
+
+    def _release(self, size: int, /) -> None:
+        self.reserved -= size
+        self._wake()
+
+    async def _acquire(self, size: int, /) -> None:
+        self._wake()  # Drops waiters that gave up from the front of the line
+
+        if not self._waiters and size <= self.available:
+            self.reserved += size
+            self._update()
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((size, future))
+        self._update()
+
+        try:
+            await asyncio.wait((future,), timeout=self.max_wait)
+        except BaseException:
+            if future.done():
+                self._release(size)
+            else:
+                future.cancel()
+                self._wake()
+            raise
+
+        if not future.done():
+            future.cancel()
+            self._wake()
+
+            self._rejections.inc(reason='timeout')
+            raise RenderBusy(self.max_wait)
+
+    @asynccontextmanager
+    async def reserve(self, size: int, /) -> AsyncIterator[None]:
+        """Reserves ``size`` bytes for the duration of the block, waiting for them if needed."""
+        self._estimates.observe(size)
+
+        if size > self.capacity:
+            self._rejections.inc(reason='too_large')
+            raise RenderTooLarge(size, self.capacity)
+
+        start = time.perf_counter()
+        await self._acquire(size)
+        self._wait_time.observe(time.perf_counter() - start)
+
+        try:
+            yield
+        finally:
+            self._release(size)
@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import bisect
+import math
+
+from collections import deque
+from typing import Iterator, Optional, Union
+
+Number = Union[int, float]
+LabelsT = tuple[tuple[str, str], ...]
+
+__all__ = (
+    'Counter',
+    'Gauge',
+    'Histogram',
+    'Metrics',
+)
+
+
+def _labels(labels: dict[str, object]) -> LabelsT:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: LabelsT) -> str:
+    if not labels:
+        return ''
+
+    def escape(value: str) -> str:
+        return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in labels) + '}'
+
+
+def _format_value(value: Number) -> str:
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+
+    return str(value)
+
+
+class _Metric:
+    TYPE: str = None  # type: ignore
+
+    def __init__(self, name: str, documentation: str) -> None:
+        self.name: str = name
+        self.documentation: str = documentation
+        self._values: dict[LabelsT, Number] = {}
+
+    def get(self, **labels: object) -> Number:
+        return self._values.get(_labels(labels), 0)
+
+    def samples(self) -> Iterator[tuple[str, LabelsT, Number]]:
+        for labels, value in self._values.items():
+            yield self.name, labels, value
+
+
+class Counter(_Metric):
+    """A value that only ever goes up."""
+    TYPE = 'counter'
+
+    def inc(self, amount: Number = 1, **labels: object) -> None:
+        key = _labels(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """A value that can be set to anything."""
+    TYPE = 'gauge'
+
+    def set(self, value: Number, **labels: object) -> None:
+        self._values[_labels(labels)] = value
+
+
+class Histogram(_Metric):
+    """A distribution of observed values.
+
+    Observations are counted into fixed buckets for export, and the most recent
+    ``WINDOW`` observations of every label set are kept to compute quantiles locally.
+    """
+    TYPE = 'histogram'
+
+    DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+    WINDOW = 1024
+
+    def __init__(self, name: str, documentation: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, documentation)
+        self.buckets: tuple[float, ...] = tuple(sorted(buckets))
+
+        self._counts: dict[LabelsT, list[int]] = {}
+        self._sums: dict[LabelsT, float] = {}
+        self._recent: dict[LabelsT, deque[float]] = {}
+
+    def label_sets(self) -> Iterator[dict[str, str]]:
+        for labels in self._counts:
+            yield dict(labels)
+
+    def observe(self, value: float, **labels: object) -> None:
+        key = _labels(labels)
+
+        try:
+            counts = self._counts[key]
+        except KeyError:
+            counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+            self._sums[key] = 0
+            self._recent[key] = deque(maxlen=self.WINDOW)
+
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[key] += value
+        self._recent[key].append(value)
+
+    def count(self, **labels: object) -> int:
+        return sum(self._counts.get(_labels(labels), ()))
+
+    def quantile(self, q: float, /, **labels: object) -> Optional[float]:
+        """Computes the ``q``-quantile (0 to 1) of the recent observations, or ``None`` if there are none."""
+        recent = self._recent.get(_labels(labels))
+        if not recent:
+            return None
+
+        ordered = sorted(recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def samples(self) -> Iterator[tuple[str, LabelsT, Number]]:
+        for labels, counts in self._counts.items():
+            cumulative = 0
+
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                yield f'{self.name}_bucket', labels + (('le', _format_value(float(bound))),), cumulative
+
+            yield f'{self.name}_sum', labels, self._sums[labels]
+            yield f'{self.name}_count', labels, cumulative
+
+
+class Metrics:
+    """A registry of every metric the bot records."""
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, _Metric] = {}
+
+    def __iter__(self) -> Iterator[_Metric]:
+        return iter(self._metrics.values())
+
+    def _get_or_create(self, cls: type[_Metric], name: str, documentation: str, **kwargs) -> _Metric:
+        try:
+            metric = self._metrics[name]
+        except KeyError:
+            metric = self._metrics[name] = cls(name, documentation, **kwargs)
+            return metric
+
+        if not isinstance(metric, cls):
+            raise TypeError(f'Metric {name!r} is already registered as a {metric.TYPE}')
+
+        return metric
+
+    def counter(self, name: str, documentation: str = '') -> Counter:
+        return self._get_or_create(Counter, name, documentation)  # type: ignore
+
+    def gauge(self, name: str, documentation: str = '') -> Gauge:
+        return self._get_or_create(Gauge, name, documentation)  # type: ignore
+
+    def histogram(self, name: str, documentation: str = '', **kwargs) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, **kwargs)  # type: ignore
+
+    def render(self) -> str:
+        """Renders every metric in the Prometheus text exposition format."""
+        lines = []
+
+        for metric in self:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.TYPE}')
+
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+
+        return '\n'.join(lines) + '\n'
@@ -1,18 +1,22 @@
 from __future__ import annotations
 
+from contextvars import ContextVar
 from discord.ext import commands
 from discord.utils import maybe_coroutine
 
-from typing import Awaitable, Union, TYPE_CHECKING
+from typing import Awaitable, Optional, Union, TYPE_CHECKING
 
 from ..helpers.context_managers import Processing
+from ..helpers.timings import StageTimings
+from .config import PROGRESS_EDIT_IN_PLACE
 
 if TYPE_CHECKING:
     from .. import Photon
 
 __all__ = (
     'Cog',
-    'Context'
+    'Context',
+    'current_context',
 )
 
 
@@ -26,5 +30,18 @@ class Cog(commands.Cog):
 
 
 class Context(commands.Context):
+    def __init__(self, **attrs) -> None:
+        super().__init__(**attrs)
+        self.timings: StageTimings = StageTimings()
+        self.rest_calls: int = 0
+
+        # Seconds until a preview or the result was shown, and until the result was, see Processing
+        self.first_response: Optional[float] = None
+        self.final_response: Optional[float] = None
+
     def processing(self) -> Processing:
-        return Processing(self)
+        return Processing(self, edit_in_place=PROGRESS_EDIT_IN_PLACE)
+
+
+# The context of the command being invoked, if any, for attributing work done on its behalf
+current_context: ContextVar[Optional[Context]] = ContextVar('current_context', default=None)
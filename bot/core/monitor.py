@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import asyncio
+import inspect
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from collections import deque
+from types import FrameType
+from typing import NamedTuple, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .metrics import Metrics
+
+__all__ = (
+    'Stall',
+    'LoopMonitor',
+)
+
+log = logging.getLogger(__name__)
+
+
+class Stall(NamedTuple):
+    """A moment where the event loop was caught blocked."""
+    timestamp: float
+    blocked_for: float
+    task: Optional[str]
+    stack: str
+
+
+class LoopMonitor:
+    """Watches the event loop for lag and for calls that block it.
+
+    A task wakes up every ``interval`` seconds and records how late it woke up.
+    Meanwhile a watchdog thread checks that the task keeps waking up; if it hasn't for
+    longer than ``threshold`` seconds, something is blocking the loop, so the watchdog
+    captures the loop thread's current stack and logs it, along with the coroutine at its
+    base, which is what the blocking task is running.
+    """
+
+    MAX_STALLS = 20
+
+    def __init__(self, metrics: Metrics, *, interval: float, threshold: float) -> None:
+        self.interval: float = interval
+        self.threshold: float = threshold
+        self.stalls: deque[Stall] = deque(maxlen=self.MAX_STALLS)
+
+        self._lag = metrics.histogram('photon_loop_lag_seconds', 'How late the event loop ran a periodic wakeup')
+        self._stall_count = metrics.counter('photon_loop_stalls_total', 'Times the event loop was caught blocked')
+
+        self._loop_thread: int = None  # type: ignore
+        self._last_tick: float = time.monotonic()
+        self._reported_tick: float = None  # type: ignore
+
+        self._task: asyncio.Task = None  # type: ignore
+        self._stopped: threading.Event = threading.Event()
+
+    def lag(self, q: float, /) -> Optional[float]:
+        return self._lag.quantile(q)
+
+    @staticmethod
+    def _task_coroutine(frame: Optional[FrameType], /) -> Optional[str]:
+        # A task runs one coroutine, which is the outermost one on the loop thread's stack
+        outermost = None
+        while frame is not None:
+            if frame.f_code.co_flags & inspect.CO_COROUTINE:
+                outermost = frame
+            frame = frame.f_back
+
+        if outermost is None:
+            return None
+
+        code = outermost.f_code
+        return f'{getattr(code, "co_qualname", code.co_name)} ({code.co_filename}:{outermost.f_lineno})'
+
+    def _capture(self, blocked_for: float) -> None:
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return
+
+        task = self._task_coroutine(frame)
+        stack = ''.join(traceback.format_stack(frame))
+
+        self.stalls.append(Stall(time.time(), blocked_for, task, stack))
+        self._stall_count.inc()
+
+        log.warning('Event loop blocked for %.0f ms (task: %s), currently at:\n%s', blocked_for * 1000, task, stack)
+
+    def _watchdog(self) -> None:
+        while not self._stopped.wait(self.threshold / 2):
+            tick = self._last_tick
+            blocked_for = time.monotonic() - tick - self.interval
+
+            # Only report each stall once
+            if blocked_for > self.threshold and tick != self._reported_tick:
+                self._reported_tick = tick
+                self._capture(blocked_for)
+
+    async def _run(self) -> None:
+        self._loop_thread = threading.get_ident()
+        self._last_tick = time.monotonic()
+
+        threading.Thread(target=self._watchdog, name='loop-watchdog', daemon=True).start()
+
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+            self._last_tick = now = time.monotonic()
+            lag = max(0.0, now - start - self.interval)
+            self._lag.observe(lag)
+
+            if lag > self.threshold:
+                log.warning('Event loop lagged by %.0f ms', lag * 1000)
+
+    def start(self, loop: asyncio.AbstractEventLoop, /) -> None:
+        self._task = loop.create_task(self._run())
+
+    def close(self) -> None:
+        self._stopped.set()
+
+        if self._task is not None:
+            self._task.cancel()
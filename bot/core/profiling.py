@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import asyncio
+import cProfile
+import hashlib
+import io
+import json
+import logging
+import os
+import pstats
+import shutil
+import threading
+import time
+import tracemalloc
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, TYPE_CHECKING, Union
+
+if TYPE_CHECKING:
+    from .metrics import Metrics
+
+__all__ = 'SlowRenderProfiler',
+
+log = logging.getLogger(__name__)
+
+
+class SlowRenderProfiler:
+    """Re-runs renders that were slower than ``threshold`` seconds under a profiler.
+
+    The re-run happens in a background thread with its own event loop, whose only
+    executor thread has :mod:`cProfile` enabled, so the render's blocking work is what gets
+    profiled. Optionally :mod:`tracemalloc` records allocations during the re-run too (note
+    that it is process-wide, so it slows other renders down while it runs).
+
+    Each profile is written to its own directory under ``directory`` along with the input
+    hash and render parameters. The oldest profiles are deleted to keep the total under
+    ``max_bytes``; an input that already has a profile is not profiled again.
+    """
+
+    TOP_FUNCTIONS = 40
+    TOP_ALLOCATIONS = 25
+
+    def __init__(
+        self,
+        metrics: Metrics,
+        *,
+        directory: str,
+        threshold: float,
+        max_bytes: int,
+        trace_memory: bool = True,
+    ) -> None:
+        self.directory: str = directory
+        self.threshold: float = threshold
+        self.max_bytes: int = max_bytes
+        self.trace_memory: bool = trace_memory
+
+        self._lock: threading.Lock = threading.Lock()
+        self._profiled = metrics.counter('photon_slow_renders_profiled_total', 'Slow renders re-run under the profiler')
+
+    def _existing(self, digest: str) -> bool:
+        try:
+            return any(name.endswith(digest) for name in os.listdir(self.directory))
+        except FileNotFoundError:
+            return False
+
+    def _rotate(self) -> None:
+        entries = []
+
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            size = sum(
+                os.path.getsize(os.path.join(root, file))
+                for root, _, files in os.walk(path) for file in files
+            )
+            entries.append((os.path.getmtime(path), path, size))
+
+        total = sum(size for _, _, size in entries)
+
+        for _, path, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def _run(self, factory: Callable[[], Awaitable[Any]]) -> tuple[cProfile.Profile, float, list[str]]:
+        profiler = cProfile.Profile()
+        executor = ThreadPoolExecutor(max_workers=1, initializer=profiler.enable, thread_name_prefix='profiler')
+
+        loop = asyncio.new_event_loop()
+        loop.set_default_executor(executor)
+
+        if self.trace_memory:
+            tracemalloc.start()
+
+        start = time.perf_counter()
+        try:
+            loop.run_until_complete(factory())
+        finally:
+            elapsed = time.perf_counter() - start
+
+            # The profiler must be disabled from the thread it was enabled in
+            executor.submit(profiler.disable).result()
+            loop.close()
+            executor.shutdown()
+
+            allocations = []
+            if self.trace_memory:
+                snapshot = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+                allocations = [str(stat) for stat in snapshot.statistics('lineno')[:self.TOP_ALLOCATIONS]]
+
+        return profiler, elapsed, allocations
+
+    def _profile(
+        self, factory: Callable[[], Awaitable[Any]], data: Union[bytes, memoryview], params: dict[str, Any],
+    ) -> None:
+        digest = hashlib.sha256(data).hexdigest()[:16]
+        if self._existing(digest):
+            return
+
+        try:
+            profiler, elapsed, allocations = self._run(factory)
+        except Exception:
+            log.exception('Profiling a slow render failed')
+            return
+
+        path = os.path.join(self.directory, f'{time.strftime("%Y%m%d-%H%M%S")}-{digest}')
+        os.makedirs(path, exist_ok=True)
+
+        profiler.dump_stats(os.path.join(path, 'profile.pstats'))
+
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(self.TOP_FUNCTIONS)
+
+        with open(os.path.join(path, 'summary.txt'), 'w') as fp:
+            fp.write(summary.getvalue())
+
+        if allocations:
+            with open(os.path.join(path, 'allocations.txt'), 'w') as fp:
+                fp.write('\n'.join(allocations))
+
+        with open(os.path.join(path, 'params.json'), 'w') as fp:
+            json.dump({
+                'sha256': hashlib.sha256(data).hexdigest(),
+                'input_bytes': len(data),
+                'profiled_seconds': elapsed,
+                **params,
+            }, fp, indent=2, default=str)
+
+        self._rotate()
+        self._profiled.inc()
+        log.info('Profiled a slow render (%.2fs originally) into %s', params.get('elapsed_seconds', 0), path)
+
+    def _guarded(self, *args: Any) -> None:
+        # One profile at a time; renders that are slow while a profile is running are skipped
+        if not self._lock.acquire(blocking=False):
+            return
+
+        try:
+            self._profile(*args)
+        finally:
+            self._lock.release()
+
+    def observe(
+        self,
+        elapsed: float,
+        factory: Callable[[], Awaitable[Any]],
+        *,
+        data: Union[bytes, memoryview],
+        params: dict[str, Any],
+    ) -> None:
+        """Reports a finished render; if it took longer than the threshold, ``factory()`` is re-run
+        under the profiler in the background.
+        """
+        if elapsed < self.threshold:
+            return
+
+        params = dict(params, elapsed_seconds=elapsed)
+        threading.Thread(
+            target=self._guarded, args=(factory, data, params), name='slow-render-profiler', daemon=True,
+        ).start()
@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import time
+
+from typing import Optional
+
+from .errors import BudgetExceeded
+
+__all__ = (
+    'TokenBucket',
+    'CostLimiter',
+)
+
+
+class TokenBucket:
+    """A token bucket holding up to ``capacity`` tokens, refilled at ``rate`` tokens per second."""
+
+    __slots__ = ('capacity', 'rate', 'tokens', 'updated')
+
+    def __init__(self, capacity: float, rate: float) -> None:
+        if rate <= 0:
+            raise ValueError(f'A token bucket must refill at a positive rate, not {rate}')
+
+        self.capacity: float = capacity
+        self.rate: float = rate
+        self.tokens: float = capacity
+        self.updated: float = time.monotonic()
+
+    def _refill(self, now: float, /) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    @property
+    def full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+    def retry_after(self, cost: float, /) -> float:
+        """How many seconds until ``cost`` tokens are available, or ``0`` if they already are."""
+        self._refill(time.monotonic())
+        cost = min(cost, self.capacity)  # A full bucket always admits one job
+
+        if self.tokens >= cost:
+            return 0
+        return (cost - self.tokens) / self.rate
+
+    def consume(self, cost: float, /) -> None:
+        self._refill(time.monotonic())
+        self.tokens -= min(cost, self.capacity)
+
+    def refund(self, cost: float, /) -> None:
+        self._refill(time.monotonic())
+        self.tokens = min(self.capacity, self.tokens + min(cost, self.capacity))
+
+
+class CostLimiter:
+    """Charges each job its estimated cost against a per-user and a per-guild token bucket.
+
+    Costs are in abstract units (see ``IFunnyCaption.estimate_cost``); anything cheaper
+    than ``minimum_cost`` is charged ``minimum_cost``.
+    """
+
+    PRUNE_THRESHOLD = 1024
+
+    def __init__(
+        self,
+        *,
+        user_capacity: float,
+        user_rate: float,
+        guild_capacity: float,
+        guild_rate: float,
+        minimum_cost: float = 1,
+    ) -> None:
+        # Buckets are only created once a job is charged, so bad rates are caught here instead
+        for name, rate in (('user_rate', user_rate), ('guild_rate', guild_rate)):
+            if rate <= 0:
+                raise ValueError(f'{name} must be positive, not {rate}')
+
+        self.user_capacity: float = user_capacity
+        self.user_rate: float = user_rate
+        self.guild_capacity: float = guild_capacity
+        self.guild_rate: float = guild_rate
+        self.minimum_cost: float = minimum_cost
+
+        self._users: dict[int, TokenBucket] = {}
+        self._guilds: dict[int, TokenBucket] = {}
+
+    @staticmethod
+    def _prune(buckets: dict[int, TokenBucket], /) -> None:
+        # A full bucket is indistinguishable from a new one, so it doesn't need to be kept around
+        for key in [key for key, bucket in buckets.items() if bucket.full]:
+            del buckets[key]
+
+    def _bucket(self, buckets: dict[int, TokenBucket], key: int, capacity: float, rate: float) -> TokenBucket:
+        try:
+            return buckets[key]
+        except KeyError:
+            if len(buckets) >= self.PRUNE_THRESHOLD:
+                self._prune(buckets)
+
+            bucket = buckets[key] = TokenBucket(capacity, rate)
+            return bucket
+
+    def _buckets(self, user_id: int, guild_id: Optional[int]) -> list[tuple[str, TokenBucket]]:
+        buckets = [('user', self._bucket(self._users, user_id, self.user_capacity, self.user_rate))]
+
+        if guild_id is not None:
+            buckets.append(('guild', self._bucket(self._guilds, guild_id, self.guild_capacity, self.guild_rate)))
+
+        return buckets
+
+    def acquire(self, cost: float, *, user_id: int, guild_id: Optional[int]) -> float:
+        """Charges ``cost`` to the given user and guild, returning the cost actually charged.
+
+        Raises :class:`BudgetExceeded` without charging anything if either budget can't afford it.
+        """
+        cost = max(cost, self.minimum_cost)
+        buckets = self._buckets(user_id, guild_id)
+
+        for scope, bucket in buckets:
+            if retry_after := bucket.retry_after(cost):
+                raise BudgetExceeded(scope, retry_after)
+
+        for _, bucket in buckets:
+            bucket.consume(cost)
+
+        return cost
+
+    def refund(self, cost: float, *, user_id: int, guild_id: Optional[int]) -> None:
+        """Gives back a cost previously charged by :meth:`acquire`, e.g. when the job never ran."""
+        for _, bucket in self._buckets(user_id, guild_id):
+            bucket.refund(cost)
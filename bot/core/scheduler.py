@@ -0,0 +1,373 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import logging
+import time
+
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Hashable, Iterator, Optional, TypeVar
+
+from ..helpers.cancellation import Cancelled, CancellationToken
+from ..helpers.misc import settle
+from .errors import DeadlineExceeded, QueueFull, RenderCancelled
+
+R = TypeVar('R')
+PositionCallback = Callable[[int], Awaitable[None]]
+
+__all__ = (
+    'RenderJob',
+    'RenderScheduler',
+)
+
+log = logging.getLogger(__name__)
+
+
+def _render_cancelled(cancelled: Cancelled, /) -> RenderCancelled:
+    # What blocking work raises, as shown to the user
+    if cancelled.reason == CancellationToken.DEADLINE:
+        error = DeadlineExceeded(cancelled.timeout)
+    else:
+        error = RenderCancelled(cancelled.reason)
+
+    error.__cause__ = cancelled
+    return error
+
+
+class RenderJob:
+    """A unit of work waiting in, or being run by, a :class:`RenderScheduler`.
+
+    Every job owns a :class:`CancellationToken`, which is passed to the job's function
+    as the ``token`` keyword argument.
+    """
+
+    def __init__(
+        self,
+        func: Callable[..., Awaitable[Any]],
+        args: tuple[Any, ...],
+        kwargs: dict[str, Any],
+        *,
+        guild_id: Optional[int],
+        user_id: int,
+        priority: int,
+        tag: Optional[Hashable],
+        on_position: Optional[PositionCallback],
+    ) -> None:
+        self.func: Callable[..., Awaitable[Any]] = func
+        self.args: tuple[Any, ...] = args
+        self.kwargs: dict[str, Any] = kwargs
+
+        self.guild_id: Optional[int] = guild_id
+        self.user_id: int = user_id
+        self.priority: int = priority
+        self.tag: Optional[Hashable] = tag
+
+        self.token: CancellationToken = CancellationToken()
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.task: Optional[asyncio.Task] = None
+        self.enqueued_at: float = time.perf_counter()
+        self.started_at: float = None  # type: ignore
+
+        self._on_position: Optional[PositionCallback] = on_position
+        self._position: int = None  # type: ignore
+        self._notifier: Optional[asyncio.Task] = None
+
+        # Position callbacks run in the submitter's context, e.g. for per-command REST call accounting
+        self._context: contextvars.Context = contextvars.copy_context()
+
+    @property
+    def wait_time(self) -> float:
+        """How long this job spent in the queue, in seconds."""
+        return (self.started_at or time.perf_counter()) - self.enqueued_at
+
+    def cancel(self, reason: str, /) -> None:
+        """Cancels this job, whether it is queued or running. Its submitter sees :class:`RenderCancelled`."""
+        self.token.cancel(reason)
+
+        if not self.future.done():
+            self.future.set_exception(_render_cancelled(self.token.exception()))
+
+    async def _notify(self) -> None:
+        # Callbacks run one at a time; positions that changed meanwhile are skipped for the latest one
+        reported = None
+
+        while reported != self._position:
+            reported = self._position
+
+            try:
+                await self._on_position(reported)  # type: ignore
+            except Exception:
+                log.exception('Position callback for a render job raised')
+
+    def update_position(self, position: int, /) -> None:
+        """Reports this job's queue position to its callback, if it changed.
+
+        A position of ``0`` means the job has started running.
+        """
+        if self._on_position is None or position == self._position:
+            return
+
+        # Don't report "started" to jobs that never had to wait
+        if position == 0 and self._position is None:
+            self._position = 0
+            return
+
+        self._position = position
+        if self._notifier is None or self._notifier.done():
+            self._notifier = self._context.run(asyncio.create_task, self._notify())
+
+
+class _FairQueue:
+    """A round-robin queue across guilds, and across users within each guild.
+
+    A single user queueing many jobs only ever delays their own guild, and a single busy
+    guild only ever delays itself.
+    """
+
+    def __init__(self) -> None:
+        self._guilds: OrderedDict[Optional[int], OrderedDict[int, deque[RenderJob]]] = OrderedDict()
+        self._size: int = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self) -> Iterator[RenderJob]:
+        """Yields the queued jobs in the order they would be popped, without popping them."""
+        guilds = deque(
+            (guild_id, deque((user_id, deque(jobs)) for user_id, jobs in users.items()))
+            for guild_id, users in self._guilds.items()
+        )
+
+        while guilds:
+            guild_id, users = guilds.popleft()
+            user_id, jobs = users.popleft()
+            yield jobs.popleft()
+
+            if jobs:
+                users.append((user_id, jobs))
+            if users:
+                guilds.append((guild_id, users))
+
+    def push(self, job: RenderJob, /) -> None:
+        users = self._guilds.setdefault(job.guild_id, OrderedDict())
+        users.setdefault(job.user_id, deque()).append(job)
+        self._size += 1
+
+    def pop(self) -> RenderJob:
+        guild_id, users = next(iter(self._guilds.items()))
+        user_id, jobs = next(iter(users.items()))
+        job = jobs.popleft()
+
+        if jobs:
+            users.move_to_end(user_id)
+        else:
+            del users[user_id]
+
+        if users:
+            self._guilds.move_to_end(guild_id)
+        else:
+            del self._guilds[guild_id]
+
+        self._size -= 1
+        return job
+
+    def remove(self, job: RenderJob, /) -> bool:
+        try:
+            users = self._guilds[job.guild_id]
+            jobs = users[job.user_id]
+            jobs.remove(job)
+        except (KeyError, ValueError):
+            return False
+
+        if not jobs:
+            del users[job.user_id]
+        if not users:
+            del self._guilds[job.guild_id]
+
+        self._size -= 1
+        return True
+
+
+class RenderScheduler:
+    """Runs render jobs on a fixed number of workers.
+
+    Jobs are picked by priority (higher first), then fairly across guilds and users.
+    Once ``max_queue`` jobs are waiting, new submissions are rejected with :class:`QueueFull`.
+
+    Blocking work done for a job before it runs, like laying out a caption while the job waits
+    in the queue, goes through :attr:`executor`, which has as many threads as there are workers.
+
+    A running job is cancelled once it runs for longer than ``deadline`` seconds. Its submitter
+    sees :class:`DeadlineExceeded` right away, while the job's token makes its blocking work stop
+    at the next check; its worker is only freed, and :meth:`submit` only returns, once it has.
+    """
+
+    def __init__(self, *, workers: int, max_queue: int, deadline: float) -> None:
+        self.workers: int = workers
+        self.max_queue: int = max_queue
+        self.deadline: float = deadline
+        self.active: int = 0
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(workers, thread_name_prefix='render-ahead')
+
+        self._queues: dict[int, _FairQueue] = {}
+        self._tagged: dict[Hashable, set[RenderJob]] = {}
+        self._condition: asyncio.Condition = None  # type: ignore
+        self._tasks: list[asyncio.Task] = []
+
+    @property
+    def queued(self) -> int:
+        return sum(map(len, self._queues.values()))
+
+    @property
+    def utilization(self) -> float:
+        return self.active / self.workers
+
+    def start(self, loop: asyncio.AbstractEventLoop, /) -> None:
+        self._condition = asyncio.Condition()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+
+        for job in self._ordered():
+            job.future.cancel()
+
+        self._queues.clear()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def cancel(self, tag: Hashable, /, reason: str = 'cancelled') -> int:
+        """Cancels every queued or running job submitted with the given tag, returning how many there were."""
+        jobs = self._tagged.get(tag, ())
+
+        for job in list(jobs):
+            job.cancel(reason)
+
+        return len(jobs)
+
+    def _ordered(self) -> Iterator[RenderJob]:
+        for priority in sorted(self._queues, reverse=True):
+            yield from self._queues[priority]
+
+    def _pop(self) -> RenderJob:
+        priority = max(self._queues)
+        queue = self._queues[priority]
+        job = queue.pop()
+
+        if not queue:
+            del self._queues[priority]
+
+        return job
+
+    def _discard(self, job: RenderJob, /) -> None:
+        queue = self._queues.get(job.priority)
+        if queue is not None and queue.remove(job):
+            if not queue:
+                del self._queues[job.priority]
+
+            self._broadcast_positions()
+
+    def _broadcast_positions(self) -> None:
+        for position, job in enumerate(self._ordered(), start=1):
+            job.update_position(position)
+
+    async def _run(self, job: RenderJob, /) -> None:
+        job.started_at = time.perf_counter()
+        job.update_position(0)
+        job.token.set_deadline(self.deadline)
+
+        job.task = task = asyncio.create_task(job.func(*job.args, token=job.token, **job.kwargs))
+
+        def on_done(_: asyncio.Future) -> None:
+            # However the job ended, anything still running for it should stop
+            job.token.cancel()
+            task.cancel()
+
+        job.future.add_done_callback(on_done)
+
+        self.active += 1
+        try:
+            await asyncio.wait((task,), timeout=self.deadline)
+
+            if not task.done():
+                job.cancel(CancellationToken.DEADLINE)
+                await asyncio.wait((task,))
+        finally:
+            self.active -= 1
+
+        if job.future.done():
+            return
+
+        if task.cancelled():
+            job.future.cancel()
+        elif (exc := task.exception()) is not None:
+            job.future.set_exception(_render_cancelled(exc) if isinstance(exc, Cancelled) else exc)
+        else:
+            job.future.set_result(task.result())
+
+    async def _worker(self) -> None:
+        while True:
+            async with self._condition:
+                await self._condition.wait_for(lambda: self._queues)
+                job = self._pop()
+
+            self._broadcast_positions()
+
+            if not job.future.done():
+                await self._run(job)
+
+    async def submit(
+        self,
+        func: Callable[..., Awaitable[R]],
+        /,
+        *args: Any,
+        guild_id: Optional[int],
+        user_id: int,
+        priority: int = 0,
+        tag: Hashable = None,
+        on_position: PositionCallback = None,
+        **kwargs: Any,
+    ) -> R:
+        """Queues ``func(*args, token=..., **kwargs)`` and waits for its result.
+
+        Cancelling the caller removes the job from the queue, or cancels it if it is already running.
+        Jobs can also be cancelled later through their ``tag``, see :meth:`cancel`. Either way this
+        only returns once the job has stopped running, so its arguments can be cleaned up afterwards.
+        """
+        if self.queued >= self.max_queue:
+            raise QueueFull(self.max_queue)
+
+        job = RenderJob(
+            func, args, kwargs,
+            guild_id=guild_id,
+            user_id=user_id,
+            priority=priority,
+            tag=tag,
+            on_position=on_position,
+        )
+
+        if tag is not None:
+            self._tagged.setdefault(tag, set()).add(job)
+
+        async with self._condition:
+            self._queues.setdefault(priority, _FairQueue()).push(job)
+            self._condition.notify()
+
+        self._broadcast_positions()
+
+        try:
+            return await job.future
+        finally:
+            self._discard(job)
+
+            if tag is not None:
+                jobs = self._tagged[tag]
+                jobs.discard(job)
+
+                if not jobs:
+                    del self._tagged[tag]
+
+            if job.task is not None:
+                await settle(job.task)
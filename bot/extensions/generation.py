@@ -1,17 +1,42 @@
+import asyncio
 import discord
+import time
 
 from discord.ext import commands
-from typing import Optional, Union
+from typing import Any, Callable, Optional, Sequence, Union
 
-from .. import Cog, Context, Photon
+from .. import Cog, Context, DeadlineExceeded, OutputTooLarge, Photon, QueueFull, RenderBusy, RenderTooLarge
+from ..core.config import (
+    CONVERSION_CACHE_MISS_TTL,
+    CONVERSION_CACHE_TTL,
+    CONVERSION_CACHE_UNTRACKED_MEMBER_TTL,
+    MAX_ANIMATION_PIXELS,
+    MAX_IMAGE_PIXELS,
+    PREVIEW_ANIMATIONS,
+    PREVIEW_MIN_FRAMES,
+    SPOOL_INPUTS_OVER,
+    SPOOL_OUTPUTS,
+)
 from ..features import *
-from ..helpers import ImageFinder, url_from_emoji
+from ..helpers import (
+    CancellationToken,
+    ConversionCache,
+    Encoded,
+    ImageData,
+    ImageFinder,
+    ImageProbe,
+    StageTimings,
+    gather_or_cancel,
+    probe_image,
+    url_from_emoji,
+)
+from ..helpers.context_managers import Processing
 
 
 class TryLink(commands.Converter):
     async def convert(self, ctx: commands.Context, argument: str) -> Union[bytes, str]:
         if len(argument) < 8:
-            async with ctx.bot.session.get(url_from_emoji(argument)) as response:
+            async with ctx.bot.fetcher.get(url_from_emoji(argument)) as response:
                 if response.ok:
                     return await response.read()
 
@@ -21,32 +46,299 @@ class TryLink(commands.Converter):
         return argument
 
 
+class ImageQuery(commands.Converter):
+    """Converts to a member or emoji through the cog's finder, which caches them, or else to an image link."""
+
+    async def convert(
+        self, ctx: commands.Context, argument: str,
+    ) -> Union[discord.Member, discord.Emoji, discord.PartialEmoji, bytes, str]:
+        result = await ctx.cog.finder.convert(ctx, argument)
+        if not isinstance(result, str):
+            return result
+
+        return await TryLink().convert(ctx, argument)
+
+
+class ExplicitImageQuery(commands.Converter):
+    """Like :class:`ImageQuery`, but only for mentions, custom emojis and links.
+
+    Meant for :class:`commands.Greedy`, which would otherwise take the first words of a caption
+    that happen to be a member's or an emoji's name as images.
+    """
+
+    async def convert(
+        self, ctx: commands.Context, argument: str,
+    ) -> Union[discord.Member, discord.Emoji, discord.PartialEmoji, str]:
+        if ImageFinder.MENTION_REGEX.match(argument) or ImageFinder.CUSTOM_EMOJI_REGEX.match(argument):
+            result = await ctx.cog.finder.convert(ctx, argument)
+            if not isinstance(result, str):
+                return result
+
+        elif ImageFinder.URL_REGEX.match(argument.strip('<>')):
+            return argument
+
+        raise commands.BadArgument('Not a mention, custom emoji or image URL.')
+
+
 class ImageGeneration(Cog, name='Image Generation'):
     """Generates images/gifs."""
 
-    _CONVERTER = Optional[
-        Union[
-            discord.Member,
-            discord.Emoji,
-            discord.PartialEmoji,
-            TryLink
-        ]
-    ]
+    DEFAULT_UPLOAD_LIMIT = 1024 * 1024 * 8  # 8 MiB, the limit in DMs
+    OUTPUT_SIZE_BUCKETS = tuple(1024 * 2 ** i for i in range(0, 16))  # 1 KiB to 32 MiB
+    # Renders that failed for lack of room or time, whose admission cost is given back
+    UNRENDERED = (QueueFull, RenderBusy, RenderTooLarge, DeadlineExceeded)
+
+    _CONVERTER = Optional[ImageQuery]
 
     def __setup__(self) -> None:
-        self.finder: ImageFinder = ImageFinder()
+        # Member updates only arrive with the members intent, without it members are only remembered briefly
+        member_ttl = None if self.bot.intents.members else CONVERSION_CACHE_UNTRACKED_MEMBER_TTL
+        self.finder: ImageFinder = ImageFinder(
+            spool_threshold=SPOOL_INPUTS_OVER,
+            conversion_cache=ConversionCache(
+                ttl=CONVERSION_CACHE_TTL, miss_ttl=CONVERSION_CACHE_MISS_TTL, member_ttl=member_ttl,
+            ),
+        )
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before: discord.Member, after: discord.Member) -> None:
+        self.finder.conversion_cache.invalidate_member(after.id)
+
+    @commands.Cog.listener()
+    async def on_user_update(self, before: discord.User, after: discord.User) -> None:
+        self.finder.conversion_cache.invalidate_member(after.id)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member) -> None:
+        self.finder.conversion_cache.invalidate_member(member.id)
+
+    @commands.Cog.listener()
+    async def on_guild_emojis_update(
+        self, guild: discord.Guild, before: Sequence[discord.Emoji], after: Sequence[discord.Emoji],
+    ) -> None:
+        self.finder.conversion_cache.invalidate_emojis(guild.id)
+
+    @staticmethod
+    def _probe(image: ImageData) -> ImageProbe:
+        return probe_image(image, max_pixels=MAX_IMAGE_PIXELS, max_total_pixels=MAX_ANIMATION_PIXELS)
+
+    async def _render_caption(
+        self,
+        image: ImageData,
+        probe: ImageProbe,
+        text: str,
+        *,
+        timings: StageTimings,
+        token: CancellationToken,
+        quality: dict[str, Any],
+        max_bytes: int,
+        layout: CaptionLayout = None,
+        shared: SharedCaption = None,
+        preview: Callable[[discord.File], None] = None,
+    ) -> discord.File:
+        start = time.perf_counter()
+
+        async with IFunnyCaption(
+            image,
+            text=text,
+            max_bytes=max_bytes,
+            spool_output=SPOOL_OUTPUTS,
+            token=token,
+            timings=timings,
+            layout=layout,
+            shared=shared,
+            **quality,
+        ) as caption:
+            if preview is not None:
+                preview(await caption.render_preview())
+
+            file = await caption.render()
+            result = caption.result
+
+        self._observe_output('IFunnyCaption', result)
+        if result.size > max_bytes:
+            raise OutputTooLarge(result.size, max_bytes)
+
+        elapsed = time.perf_counter() - start
+        profiler = self.bot.profiler
+
+        if profiler is not None and elapsed >= profiler.threshold:
+            # The view keeps the input alive once the command closes it, and is only copied in the
+            # profiler's thread, when the render is re-run with the same settings
+            data = image.view()
+            profiler.observe(
+                elapsed,
+                lambda: self._render_caption_plain(data.tobytes(), text, quality, max_bytes=max_bytes),
+                data=data,
+                params=dict(
+                    feature='IFunnyCaption', text=text, max_bytes=max_bytes, stages=timings.stages, **quality,
+                ),
+            )
+
+        return file
+
+    async def _schedule_caption(
+        self,
+        callback: Processing,
+        image: ImageData,
+        probe: ImageProbe,
+        text: str,
+        *,
+        timings: StageTimings,
+        max_bytes: int,
+        **kwargs: Any,
+    ) -> discord.File:
+        quality = self.bot.degradation.quality._asdict()
+        memory = IFunnyCaption.estimate_memory(
+            probe, text=text, max_width=quality['max_width'], max_frames=quality['max_frames'], max_bytes=max_bytes,
+        )
+
+        waiting_since = time.perf_counter()
+
+        # Reserved before queueing, so renders waiting for memory don't hold on to a worker
+        async with self.bot.memory.reserve(memory):
+            timings.add('memory', time.perf_counter() - waiting_since)
+
+            return await callback.schedule(
+                self._render_caption,
+                image,
+                probe,
+                text,
+                timings=timings,
+                quality=quality,
+                max_bytes=max_bytes,
+                **kwargs,
+            )
+
+    def _observe_output(self, feature: str, result: Encoded) -> None:
+        metrics = self.bot.metrics
+        labels = dict(feature=feature, format=result.format)
+
+        metrics.histogram(
+            'photon_render_output_bytes', 'Size of rendered images', buckets=self.OUTPUT_SIZE_BUCKETS,
+        ).observe(result.size, **labels)
+        metrics.histogram(
+            'photon_render_encode_seconds', 'Time spent encoding rendered images, over every attempt',
+        ).observe(result.encode_time, **labels)
+        metrics.counter(
+            'photon_render_encode_attempts_total', 'Encodes it took to fit rendered images into the upload limit',
+        ).inc(result.attempts, **labels)
+
+    @staticmethod
+    async def _render_caption_plain(
+        image: bytes, text: str, quality: dict[str, Any], *, max_bytes: int,
+    ) -> discord.File:
+        # Fitting into the upload limit is often what made the render slow, so it is done here too
+        async with IFunnyCaption(
+            image, text=text, max_bytes=max_bytes, spool_output=SPOOL_OUTPUTS, **quality,
+        ) as caption:
+            return await caption.render()
+
+    async def _caption(self, ctx: Context, image: ImageData, caption: str) -> None:
+        with ctx.timings.stage('probe'):
+            probe = await asyncio.to_thread(self._probe, image)
+
+        max_bytes = ctx.guild.filesize_limit if ctx.guild else self.DEFAULT_UPLOAD_LIMIT
+        budget = dict(user_id=ctx.author.id, guild_id=ctx.guild and ctx.guild.id)
+        cost = self.bot.limiter.acquire(IFunnyCaption.estimate_cost(probe), **budget)
+
+        # Once admitted, the caption is laid out at the image's output width while the job waits in the queue
+        width, _ = IFunnyCaption.output_size(probe, max_width=self.bot.degradation.quality.max_width)
+        layout = IFunnyCaption.speculate(caption, width=width, executor=self.bot.scheduler.executor)
+
+        try:
+            async with ctx.processing() as callback:
+                # Long animations take a while to encode, so their first frame is shown in the meantime
+                preview = PREVIEW_ANIMATIONS and probe.frames >= PREVIEW_MIN_FRAMES
+
+                try:
+                    file = await self._schedule_caption(
+                        callback,
+                        image,
+                        probe,
+                        caption,
+                        timings=ctx.timings,
+                        max_bytes=max_bytes,
+                        layout=layout,
+                        preview=callback.preview if preview else None,
+                    )
+                except self.UNRENDERED:
+                    self.bot.limiter.refund(cost, **budget)
+                    raise
+
+                await callback(file)
+        finally:
+            layout.discard()
+
+    async def _caption_many(self, ctx: Context, images: list[ImageData], caption: str) -> None:
+        with ctx.timings.stage('probe'):
+            probes = await gather_or_cancel(*(asyncio.to_thread(self._probe, image) for image in images))
+
+        # Every result goes into one message, so they split its upload limit
+        max_bytes = (ctx.guild.filesize_limit if ctx.guild else self.DEFAULT_UPLOAD_LIMIT) // len(images)
+        budget = dict(user_id=ctx.author.id, guild_id=ctx.guild and ctx.guild.id)
+        cost = self.bot.limiter.acquire(sum(map(IFunnyCaption.estimate_cost, probes)), **budget)
+
+        # One caption is laid out per output width, while the renders wait in the queue
+        shared = SharedCaption(caption, executor=self.bot.scheduler.executor)
+        max_width = self.bot.degradation.quality.max_width
+
+        for probe in probes:
+            shared.speculate(IFunnyCaption.output_size(probe, max_width=max_width)[0])
+
+        try:
+            async with ctx.processing() as callback:
+                # Renders run in parallel, so each keeps its own timings
+                timings = [StageTimings() for _ in images]
+
+                try:
+                    files = await gather_or_cancel(*(
+                        self._schedule_caption(
+                            callback,
+                            image,
+                            probe,
+                            caption,
+                            timings=image_timings,
+                            max_bytes=max_bytes,
+                            shared=shared,
+                        )
+                        for image, probe, image_timings in zip(images, probes, timings)
+                    ))
+                except self.UNRENDERED:
+                    self.bot.limiter.refund(cost, **budget)
+                    raise
+                finally:
+                    for image_timings in timings:
+                        ctx.timings.merge(image_timings)
+
+                for i, file in enumerate(files, start=1):
+                    file.filename = f'caption-{i}.{file.filename.rpartition(".")[2]}'
+
+                await callback(*files)
+        finally:
+            shared.close()
 
     @commands.command('caption')
-    @commands.cooldown(1, 5, commands.BucketType.user)
     @commands.max_concurrency(1, commands.BucketType.user)
     async def caption(self, ctx: Context, image: _CONVERTER, *, caption: str) -> None:
-        image = await self.finder.find(ctx, image, run_conversions=False)
+        with ctx.timings.stage('fetch'):
+            image = await self.finder.find(ctx, image, run_conversions=False)
 
-        async with ctx.processing() as callback:
-            async with IFunnyCaption(image, text=caption) as caption:
-                await callback(await caption.render())
+        with image:
+            await self._caption(ctx, image, caption)
+
+    @commands.command('captionmany', aliases=('bcaption',))
+    @commands.max_concurrency(1, commands.BucketType.user)
+    async def caption_many(self, ctx: Context, images: commands.Greedy[ExplicitImageQuery], *, caption: str) -> None:
+        """Puts the same caption on several images at once, given as links, custom emojis, mentions or attachments."""
+        with ctx.timings.stage('fetch'):
+            images = await self.finder.find_many(ctx, images)
 
-        del caption
+        try:
+            await self._caption_many(ctx, images, caption)
+        finally:
+            for image in images:
+                image.close()
 
 
 def setup(bot: Photon) -> None:
@@ -0,0 +1,78 @@
+import datetime
+
+from discord.ext import commands
+
+from .. import Cog, Context, Photon
+
+
+class Statistics(Cog):
+    """Internal statistics about the bot."""
+
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def _stage_table(self) -> str:
+        histogram = self.bot.metrics.histogram('photon_command_stage_seconds')
+        rows = sorted(
+            (labels['command'], labels['stage']) for labels in histogram.label_sets()
+        )
+
+        if not rows:
+            return 'No commands recorded yet.'
+
+        lines = [f'{"command":<12} {"stage":<10} {"p50":>9} {"p95":>9} {"p99":>9} {"n":>6}']
+
+        for command, stage in rows:
+            quantiles = (
+                histogram.quantile(q, command=command, stage=stage) * 1000
+                for q in self.QUANTILES
+            )
+            formatted = ' '.join(f'{value:>7.1f}ms' for value in quantiles)
+            count = histogram.count(command=command, stage=stage)
+
+            lines.append(f'{command:<12} {stage:<10} {formatted} {count:>6,}')
+
+        return '\n'.join(lines)
+
+    def _lag_summary(self) -> str:
+        monitor = self.bot.loop_monitor
+        quantiles = [monitor.lag(q) for q in self.QUANTILES]
+
+        if quantiles[0] is None:
+            return 'Event loop lag: no samples yet'
+
+        formatted = ', '.join(f'p{q * 100:g} {value * 1000:.1f}ms' for q, value in zip(self.QUANTILES, quantiles))
+        return f'Event loop lag: {formatted}, {len(monitor.stalls)} recent stalls'
+
+    @commands.group('stats', invoke_without_command=True)
+    @commands.is_owner()
+    async def stats(self, ctx: Context) -> None:
+        scheduler = self.bot.scheduler
+
+        header = (
+            f'Render queue: {scheduler.queued:,}/{scheduler.max_queue:,} waiting, '
+            f'{scheduler.active}/{scheduler.workers} workers busy, '
+            f'quality level {self.bot.degradation.level}\n'
+            f'{self._lag_summary()}'
+        )
+
+        await ctx.send(f'{header}\n```\n{self._stage_table()}\n```')
+
+    @stats.command('stall')
+    @commands.is_owner()
+    async def stats_stall(self, ctx: Context) -> None:
+        """Shows where the event loop was blocked most recently."""
+        if not self.bot.loop_monitor.stalls:
+            return await ctx.send('The event loop has not been caught blocked.')
+
+        stall = self.bot.loop_monitor.stalls[-1]
+        when = datetime.datetime.fromtimestamp(stall.timestamp, datetime.timezone.utc)
+
+        # Keep the innermost frames, that's where the blocking call is
+        stack = stall.stack[-1700:]
+        await ctx.send(
+            f'Blocked for {stall.blocked_for * 1000:.0f}ms at {when:%H:%M:%S} UTC in {stall.task}\n```py\n{stack}\n```'
+        )
+
+
+def setup(bot: Photon) -> None:
+    bot.add_cog(Statistics(bot))
@@ -1 +1 @@
-from .ifunny_caption import IFunnyCaption
+from .ifunny_caption import CaptionLayout, IFunnyCaption, SharedCaption
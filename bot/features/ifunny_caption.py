@@ -1,17 +1,122 @@
 from __future__ import annotations
 
+import asyncio
 import discord
+import logging
+import math
+import os
 
-from io import BytesIO
-from PIL import Image, ImageFont, ImageSequence
+from concurrent.futures import Executor
+from functools import cache, partial
+from PIL import Image, ImageFont
 from pilmoji import Pilmoji
 
 from bot.helpers import wrap_text
-from bot.helpers.misc import proportionally_scale, to_thread
-from bot.helpers.pil import FallbackFont
-from bot.helpers.transparency import save_transparent_gif
+from bot.helpers.buffers import ImageData
+from bot.helpers.cancellation import CancellationToken
+from bot.helpers.emoji import CachedTwemoji
+from bot.helpers.encoding import Encoded
+from bot.helpers.misc import proportionally_scale
+from bot.helpers.pil import FallbackFont, FallbackFontPool
+from bot.helpers.pipeline import Pipeline
+from bot.helpers.probe import ImageProbe
+from bot.helpers.timings import StageTimings
 
-__all__ = 'IFunnyCaption',
+__all__ = (
+    'CaptionLayout',
+    'IFunnyCaption',
+    'SharedCaption',
+)
+
+log = logging.getLogger(__name__)
+
+FONT_PATH = './bot/assets/fonts/futura.ttf'
+FALLBACK_FONT_PATH = './bot/assets/fonts/unifont.ttf'  # Too large to ship with the repository
+
+
+@cache
+def _has_fallback_font() -> bool:
+    if os.path.isfile(FALLBACK_FONT_PATH):
+        return True
+
+    log.warning('%s is missing, captions with characters Futura lacks will fail to render', FALLBACK_FONT_PATH)
+    return False
+
+
+def _stack_caption(caption: Image.Image, frame: Image.Image, /) -> Image.Image:
+    result = Image.new('RGBA', (frame.width, caption.height + frame.height))
+    result.paste(caption, (0, 0))
+    result.paste(frame, (0, caption.height), frame)
+
+    frame.close()
+    return result
+
+
+class CaptionLayout:
+    """A caption being laid out ahead of time, see :meth:`IFunnyCaption.speculate`.
+
+    Whoever :meth:`claim`\s the layout owns its font; a layout that is never claimed
+    must be :meth:`discard`\ed so that the font goes back to the pool.
+    """
+
+    def __init__(self, task: asyncio.Future[tuple[FallbackFont, Image.Image]], /) -> None:
+        self._task: asyncio.Future[tuple[FallbackFont, Image.Image]] = task
+        self._claimed: bool = False
+
+    async def claim(self) -> tuple[FallbackFont, Image.Image]:
+        # Cancelling the claimant leaves the layout to finish, and to be released, on its own
+        result = await asyncio.shield(self._task)
+        self._claimed = True
+        return result
+
+    async def wait(self) -> Image.Image:
+        """Waits for the caption image without claiming it."""
+        _, image = await asyncio.shield(self._task)
+        return image
+
+    def discard(self) -> None:
+        """Releases the layout once it is done, unless it was claimed."""
+        if not self._claimed:
+            self._claimed = True
+            self._task.add_done_callback(self._release)
+
+    @staticmethod
+    def _release(task: asyncio.Future[tuple[FallbackFont, Image.Image]]) -> None:
+        if task.cancelled() or task.exception() is not None:
+            return
+
+        font, image = task.result()
+        image.close()
+        IFunnyCaption._fonts.release(font)
+
+
+class SharedCaption:
+    """One caption put on several images, laid out once for each output width they end up at.
+
+    Pass this as ``shared=`` to every :class:`IFunnyCaption` that uses it; they borrow the
+    caption image rather than owning it. Once they are all done, :meth:`close` releases it.
+    """
+
+    def __init__(self, text: str, /, *, executor: Executor = None) -> None:
+        self.text: str = text
+        self.executor: Executor | None = executor
+        self._layouts: dict[int, CaptionLayout] = {}
+
+    def speculate(self, width: int = None) -> None:
+        """Starts laying out the caption for the given output width, if it isn't already."""
+        width = width or IFunnyCaption.MAX_WIDTH
+        if width not in self._layouts:
+            self._layouts[width] = IFunnyCaption.speculate(self.text, width=width, executor=self.executor)
+
+    async def get(self, width: int, /) -> Image.Image:
+        self.speculate(width)
+        return await self._layouts[width].wait()
+
+    def close(self) -> None:
+        for layout in self._layouts.values():
+            layout.discard()
+
+        self._layouts.clear()
 
 
 class IFunnyCaption:
@@ -25,19 +130,148 @@ class IFunnyCaption:
     MAX_WIDTH = 600
     LINE_SPACING = 2.5
 
+    # Relative CPU cost per output pixel, used for admission control
+    COST_WEIGHT = 1.0
+
+    # In order of preference; GIF for animations and PNG otherwise, then WebP when those don't fit,
+    # and APNG for animations last, for builds of Pillow without animated WebP
+    FORMATS = ('gif', 'png', 'webp', 'apng')
+
     # noinspection PyTypeChecker
-    def __init__(self, image_bytes: bytes, *, text: str) -> None:
-        self._image_bytes: bytes = image_bytes
-        self._rescale: tuple[int, int] = None
-        self._fallback_duration: int = None
+    def __init__(
+        self,
+        image_bytes: bytes | ImageData,
+        *,
+        text: str,
+        max_width: int = None,
+        max_frames: int = None,
+        colors: int = None,
+        max_bytes: int = None,
+        spool_output: bool = False,
+        token: CancellationToken = None,
+        timings: StageTimings = None,
+        layout: CaptionLayout = None,
+        shared: SharedCaption = None,
+    ) -> None:
+        self._image_bytes: bytes | ImageData = image_bytes
+        self._layout: CaptionLayout | None = layout
+        self._shared: SharedCaption | None = shared
+        self.max_width: int = max_width or self.MAX_WIDTH
+        self.max_frames: int | None = max_frames
+        self.colors: int = colors or 256
+        self.token: CancellationToken = token or CancellationToken()
+        self.timings: StageTimings = timings or StageTimings()
+
+        self.pipeline: Pipeline = Pipeline(
+            max_size=self.max_width,
+            min_size=self.MIN_WIDTH,
+            max_frames=max_frames,
+            colors=self.colors,
+            formats=self.FORMATS,
+            max_bytes=max_bytes,
+            spool_output=spool_output,
+            token=self.token,
+            timings=self.timings,
+        )
+        self._size: tuple[int, int] = None
 
         self.text: str = text[:self.MAX_CHARS]
         self.font: FallbackFont = None
         self.image: Image.Image = None
 
         self.caption_image: Image.Image = None
-        self.frames: list[Image.Image] = []
-        self.durations: list[int] = []
+        self.result: Encoded = None
+
+    @staticmethod
+    def _create_font(base_size: int) -> FallbackFont:
+        return FallbackFont(
+            ImageFont.truetype(
+                FONT_PATH, size=base_size,
+            ),
+            lambda: ImageFont.truetype(
+                FALLBACK_FONT_PATH, size=round(base_size * (7 / 9)),
+            ),
+            fallback_offset=(0, round(base_size * (5 / 18))),
+        )
+
+    _fonts = FallbackFontPool(_create_font.__func__)  # type: ignore
+
+    @staticmethod
+    def _base_font_size(width: int) -> int:
+        return width // (9 if width < 400 else 12)
+
+    @classmethod
+    def prewarm(cls, width: int = MAX_WIDTH) -> None:
+        """Loads the font used for the given output width, and its glyph coverage, ahead of time.
+
+        The fallback font is skipped, with a warning logged once, if it isn't installed. This blocks.
+        """
+        font = cls._fonts.acquire(cls._base_font_size(width))
+        try:
+            if _has_fallback_font():
+                font.fallback  # Loaded on first use otherwise
+        finally:
+            cls._fonts.release(font)
+
+    @classmethod
+    def _layout_caption(
+        cls, text: str, width: int, token: CancellationToken | None = None,
+    ) -> tuple[FallbackFont, Image.Image]:
+        font = cls._fonts.acquire(cls._base_font_size(width))
+
+        try:
+            return font, cls._draw_caption(text[:cls.MAX_CHARS], font, width, token)
+        except BaseException:
+            cls._fonts.release(font)
+            raise
+
+    @classmethod
+    def speculate(cls, text: str, *, width: int = None, executor: Executor = None) -> CaptionLayout:
+        """Starts laying out the caption in ``executor``, or the event loop's default one, for an output
+        ``width`` pixels wide (see :meth:`output_size`), before the image is decoded.
+
+        Pass the result as ``layout=``; if the image ends up a different width, it is laid out again.
+        """
+        width = width or cls.MAX_WIDTH
+        loop = asyncio.get_running_loop()
+        return CaptionLayout(loop.run_in_executor(executor, cls._layout_caption, text, width))
+
+    @classmethod
+    def output_size(cls, probe: ImageProbe, /, *, max_width: int = None) -> tuple[int, int]:
+        """The size the probed image is scaled to, before the caption is added."""
+        return proportionally_scale(probe.size, min_dimension=cls.MIN_WIDTH, max_dimension=max_width or cls.MAX_WIDTH)
+
+    @classmethod
+    def _estimate_caption_height(cls, text: str, width: int) -> int:
+        # Assumes characters about half as wide as the font size
+        font_size = cls._base_font_size(width)
+        per_line = max(1, width * 2 // font_size)
+        lines = sum(max(1, math.ceil(len(line) / per_line)) for line in text[:cls.MAX_CHARS].split('\n'))
+
+        return font_size * lines + round((lines - 1) * cls.LINE_SPACING) + round(font_size / 2.3) * 2
+
+    @classmethod
+    def estimate_memory(
+        cls, probe: ImageProbe, /, *, text: str, max_width: int = None, max_frames: int = None, max_bytes: int = None,
+    ) -> int:
+        """Estimates the peak memory of captioning the probed image, in bytes. See :meth:`Pipeline.estimate_memory`."""
+        max_width = max_width or cls.MAX_WIDTH
+        width, _ = cls.output_size(probe, max_width=max_width)
+
+        return Pipeline.estimate_memory(
+            probe,
+            max_size=max_width,
+            min_size=cls.MIN_WIDTH,
+            max_frames=max_frames,
+            formats=cls.FORMATS,
+            max_bytes=max_bytes,
+            extra_height=cls._estimate_caption_height(text, width),
+        )
+
+    @classmethod
+    def estimate_cost(cls, probe: ImageProbe, /) -> float:
+        """Estimates the cost of captioning the probed image, in megapixels rendered."""
+        return Pipeline.estimate_cost(probe, max_size=cls.MAX_WIDTH, min_size=cls.MIN_WIDTH, weight=cls.COST_WEIGHT)
 
     @property
     def font_size(self) -> int:
@@ -49,126 +283,137 @@ class IFunnyCaption:
 
     @property
     def width(self) -> int:
-        if self._rescale:
-            return self._rescale[0]
-        return self.image.width
+        return self.size[0]
 
     @property
     def height(self) -> int:
-        if self._rescale:
-            return self._rescale[1]
-        return self.image.height
+        return self.size[1]
 
     @property
     def size(self) -> tuple[int, int]:
-        return self._rescale or self.image.size
+        return self._size
 
     @property
     def final_size(self) -> tuple[int, int]:
         return self.width, self.height + self.offset
 
-    @to_thread
-    def _open_image(self) -> None:
-        self.image = image = Image.open(BytesIO(self._image_bytes))
-        self._fallback_duration = image.info.get('duration', 64)
+    @property
+    def durations(self) -> list[int]:
+        return self.pipeline.durations
 
-        self._rescale = proportionally_scale(
-            image.size,
-            min_dimension=self.MIN_WIDTH,
-            max_dimension=self.MAX_WIDTH
-        )
+    def _open_image(self) -> None:
+        self.image = image = self.pipeline.open(self._image_bytes)
+        self._size = self.pipeline.output_size(image)
 
-    @to_thread
-    def _open_font(self) -> None:
-        base_size = self.width // (9 if self.width < 400 else 12)
+    def _load_image(self) -> None:
+        # Decodes the first frame, which is what takes time for static images
+        with self.timings.stage('decode'):
+            self.image.load()
 
-        self.font = FallbackFont(
-            ImageFont.truetype(
-                './bot/assets/fonts/futura.ttf', size=base_size,
-            ),
-            lambda: ImageFont.truetype(
-                './bot/assets/fonts/unifont.ttf', size=round(base_size * (7 / 9)),
-            ),
-            fallback_offset=(0, round(base_size * (5 / 18))),
-        )
+    def _load_font(self) -> None:
+        self.font = self._fonts.acquire(self._base_font_size(self.width))
 
-    @to_thread
     def _close_image(self) -> None:
-        self.image.close()
-        self.caption_image.close()
-
-        for frame in self.frames:
-            frame.close()
-
-        self.frames = []
-
-    def _split_text(self) -> list[str]:
-        return wrap_text(self.text, self.font, self.width)  # type: ignore
-
-    def _render_caption(self) -> None:
-        lines = self._split_text()
+        if self.image is not None:
+            self.image.close()
+        if self.caption_image is not None and self._shared is None:
+            self.caption_image.close()
+
+    @classmethod
+    def _draw_caption(
+        cls, text: str, font: FallbackFont, width: int, token: CancellationToken | None = None,
+    ) -> Image.Image:
+        lines = wrap_text(text, font, width)  # type: ignore
         line_count = len(lines)
 
-        padding = round(self.font_size / 2.3)
+        font_size = font.size
+        padding = round(font_size / 2.3)
 
-        height = self.font_size * line_count
-        height += round((line_count - 1) * self.LINE_SPACING)  # Line spacing
+        height = font_size * line_count
+        height += round((line_count - 1) * cls.LINE_SPACING)  # Line spacing
         height += padding * 2
 
-        image = self.caption_image = Image.new('RGBA', (self.width, height), (255, 255, 255))
+        image = Image.new('RGBA', (width, height), (255, 255, 255))
 
-        with Pilmoji(image, emoji_position_offset=(0, round((7 / 36) * self.font.size))) as pilmoji:
-            with self.font.session(pilmoji.draw):
+        with Pilmoji(image, source=CachedTwemoji, emoji_position_offset=(0, round((7 / 36) * font_size))) as pilmoji:
+            with font.session(pilmoji.draw):
                 for i, line in enumerate(lines):
-                    offset = int(self.LINE_SPACING * i + self.font_size * i)
+                    if token is not None:
+                        token.check()
+                    offset = int(cls.LINE_SPACING * i + font_size * i)
 
-                    width, _ = pilmoji.getsize(line, self.font)  # type: ignore
-                    x_offset = int((self.width - width) / 2)
+                    line_width, _ = pilmoji.getsize(line, font)  # type: ignore
+                    x_offset = int((width - line_width) / 2)
 
-                    pilmoji.text((x_offset, padding // 2 + offset), line, (0, 0, 0), self.font)  # type: ignore
+                    pilmoji.text((x_offset, padding // 2 + offset), line, (0, 0, 0), font)  # type: ignore
 
-    def _render_frame(self, frame: Image.Image, /) -> None:
-        actual = Image.new("RGBA", self.final_size)
+        return image
+
+    def _render_caption(self) -> None:
+        with self.timings.stage('font'):
+            self._load_font()
 
-        frame = frame.convert('RGBA')
-        actual.paste(self.caption_image, (0, 0))
-        actual.paste(frame, (0, self.offset), frame)
+        with self.timings.stage('layout'):
+            self.caption_image = self._draw_caption(self.text, self.font, self.width, self.token)
 
-        self.frames.append(actual)
-        self.durations.append(frame.info.get('duration', self._fallback_duration))
+    async def _prepare_caption(self) -> None:
+        if self._shared is not None:
+            with self.timings.stage('layout'):
+                self.caption_image = await self._shared.get(self.width)
+            return
 
-        frame.close()
-        del frame
+        if self._layout is not None:
+            font, caption_image = await self._layout.claim()
+            self._layout = None
 
-    @to_thread
-    def _render(self) -> tuple[BytesIO, str]:
-        self._render_caption()
+            if caption_image.width == self.width:
+                self.font, self.caption_image = font, caption_image
+                return
 
-        for frame in ImageSequence.Iterator(self.image):
-            if self._rescale:
-                frame = frame.resize(self._rescale)
-            self._render_frame(frame)
+            caption_image.close()
+            self._fonts.release(font)
 
-        stream = BytesIO()
+        await self.token.run_in_thread(self._render_caption)
 
-        if len(self.durations) > 1:
-            save_transparent_gif(self.frames, self.durations, stream)
-            stream.seek(0)
-            return stream, 'gif'
+    def _render_preview(self) -> Encoded:
+        return self.pipeline.preview(self.image, [partial(_stack_caption, self.caption_image)])
 
-        self.frames[0].save(stream, 'png')
-        stream.seek(0)
-        return stream, 'png'
+    async def render_preview(self) -> discord.File:
+        """Renders just the first frame, as a PNG, to show until :meth:`render` is done."""
+        result = await self.token.run_in_thread(self._render_preview)
+        return discord.File(result.stream, f'preview.{result.extension}')
+
+    def _render(self) -> Encoded:
+        return self.pipeline.run(self.image, [partial(_stack_caption, self.caption_image)])
 
     async def render(self) -> discord.File:
-        stream, fmt = await self._render()
-        return discord.File(stream, f'caption.{fmt}')
+        self.result = result = await self.token.run_in_thread(self._render)
+        return discord.File(result.stream, f'caption.{result.extension}')
 
     async def __aenter__(self) -> IFunnyCaption:
-        await self._open_image()
-        await self._open_font()
+        try:
+            await self.token.run_in_thread(self._open_image)
+            # The caption only depends on the output width, so it is laid out while the image decodes
+            results = await asyncio.gather(
+                self._prepare_caption(), self.token.run_in_thread(self._load_image), return_exceptions=True,
+            )
+
+            # Both must be done before cleaning up after a failure
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+        except BaseException:
+            if self._layout is not None:
+                self._layout.discard()
+            await self.__aexit__()
+            raise
+
         return self
 
     async def __aexit__(self, *_) -> None:
-        await self._close_image()
+        # Nothing is still using the image or font by now, see CancellationToken.run_in_thread
+        await asyncio.to_thread(self._close_image)
+
+        if self.font is not None:
+            self._fonts.release(self.font)
         del self.font
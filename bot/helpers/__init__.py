@@ -1,4 +1,61 @@
-from .finder import *
-from .misc import *
-from .pil import *
-from .transparency import *
+# Helpers are imported lazily: several of them pull in PIL, fontTools and pilmoji,
+# which the bot doesn't need until the first image command.
+from importlib import import_module
+from typing import Any, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .buffers import *
+    from .cancellation import *
+    from .emoji import *
+    from .encoding import *
+    from .finder import *
+    from .misc import *
+    from .pil import *
+    from .pipeline import *
+    from .probe import *
+    from .timings import *
+    from .transparency import *
+
+_EXPORTS = {
+    'ImageData': 'buffers',
+    'open_stream': 'buffers',
+    'Cancelled': 'cancellation',
+    'CancellationToken': 'cancellation',
+    'CachedTwemoji': 'emoji',
+    'prewarm_emoji': 'emoji',
+    'ANIMATED_FORMATS': 'encoding',
+    'STATIC_FORMATS': 'encoding',
+    'Encoded': 'encoding',
+    'encode_frames': 'encoding',
+    'negotiate_formats': 'encoding',
+    'ConversionCache': 'finder',
+    'ImageFinder': 'finder',
+    'gather_or_cancel': 'misc',
+    'proportionally_scale': 'misc',
+    'settle': 'misc',
+    'to_thread': 'misc',
+    'url_from_emoji': 'misc',
+    'wrap_text': 'pil',
+    'FrameOp': 'pipeline',
+    'Pipeline': 'pipeline',
+    'ImageProbe': 'probe',
+    'probe_image': 'probe',
+    'StageTimings': 'timings',
+    'save_transparent_gif': 'transparency',
+}
+
+__all__ = tuple(_EXPORTS)
+
+
+def __getattr__(name: str) -> Any:
+    try:
+        module = _EXPORTS[name]
+    except KeyError:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}') from None
+
+    value = globals()[name] = getattr(import_module(f'.{module}', __name__), name)
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(_EXPORTS))
@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import io
+import mmap
+import tempfile
+
+from typing import AsyncIterable, BinaryIO, Callable, Optional, Union
+
+__all__ = (
+    'ImageData',
+    'open_stream',
+)
+
+
+class _ViewReader(io.RawIOBase):
+    """A read-only file over a memoryview, with its own position."""
+
+    def __init__(self, view: memoryview, /) -> None:
+        self._view: memoryview = view
+        self._position: int = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def close(self) -> None:
+        # Lets the mapping underneath be closed
+        if not self.closed:
+            self._view.release()
+
+        super().close()
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+
+        self._position = max(0, offset)
+        return self._position
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self._view) if size is None or size < 0 else self._position + size
+        data = self._view[self._position:end].tobytes()
+
+        self._position += len(data)
+        return data
+
+    def readinto(self, buffer: Union[bytearray, memoryview]) -> int:
+        chunk = self._view[self._position:self._position + len(buffer)]
+        buffer[:len(chunk)] = chunk
+
+        self._position += len(chunk)
+        return len(chunk)
+
+
+class ImageData:
+    """Downloaded image bytes, shared by every stage of a job without being copied.
+
+    Data up to ``spool_threshold`` bytes stays in memory as :class:`bytes`. Anything larger is
+    written to an anonymous temporary file as it streams in and memory-mapped, so it lives in
+    the page cache instead of the heap. Either way :meth:`open` hands out independent readers
+    and :meth:`view` a memoryview, neither of which copies the data.
+
+    :meth:`close` releases the temporary file and mapping right away, which this does as a context
+    manager too. Otherwise they are released once the last reference to this goes away.
+    """
+
+    SPOOL_THRESHOLD = 1024 * 1024  # 1 MiB
+
+    __slots__ = ('_data', '_file')
+
+    def __init__(self, data: Union[bytes, mmap.mmap], /, *, file: Optional[BinaryIO] = None) -> None:
+        self._data: Union[bytes, mmap.mmap] = data
+        self._file: Optional[BinaryIO] = file
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __repr__(self) -> str:
+        return f'<ImageData size={len(self)} spooled={self.spooled}>'
+
+    def __enter__(self) -> ImageData:
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    @property
+    def spooled(self) -> bool:
+        return self._file is not None
+
+    @classmethod
+    async def from_chunks(
+        cls,
+        chunks: AsyncIterable[bytes],
+        *,
+        max_size: int,
+        on_too_large: Callable[[int], Exception],
+        spool_threshold: int = SPOOL_THRESHOLD,
+    ) -> ImageData:
+        """Collects streamed chunks, spooling them to disk past ``spool_threshold`` bytes.
+
+        Raises ``on_too_large(size)`` as soon as more than ``max_size`` bytes come in.
+        """
+        buffered: list[bytes] = []
+        file = None
+        size = 0
+
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_size:
+                    raise on_too_large(size)
+
+                if file is not None:
+                    file.write(chunk)
+                    continue
+
+                buffered.append(chunk)
+                if size > spool_threshold:
+                    file = tempfile.TemporaryFile()
+                    file.writelines(buffered)
+                    buffered.clear()
+
+            if file is None:
+                return cls(b''.join(buffered))
+
+            file.flush()
+            return cls(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ), file=file)
+        except BaseException:
+            # Timeouts, broken streams and cancellation included
+            if file is not None:
+                file.close()
+            raise
+
+    def close(self) -> None:
+        """Releases the data. Readers and views over it must not be used afterwards."""
+        data, self._data = self._data, b''
+
+        if self._file is not None:
+            try:
+                data.close()  # type: ignore
+            except BufferError:
+                # A view is still around somewhere, the mapping goes along with it
+                pass
+
+            self._file.close()
+            self._file = None
+
+    def view(self) -> memoryview:
+        return memoryview(self._data)
+
+    def open(self) -> BinaryIO:
+        """Opens a new reader over the data, starting at the beginning."""
+        if isinstance(self._data, bytes):
+            # BytesIO shares the bytes object's buffer until something is written to it
+            return io.BytesIO(self._data)
+
+        return _ViewReader(self.view())  # type: ignore
+
+
+def open_stream(data: Union[bytes, ImageData], /) -> BinaryIO:
+    """Opens a reader over image bytes, without copying them."""
+    if isinstance(data, ImageData):
+        return data.open()
+
+    return io.BytesIO(data)
@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import threading
+import time
+
+from typing import Any, Callable, TypeVar
+
+from .misc import settle
+
+R = TypeVar('R')
+
+__all__ = (
+    'Cancelled',
+    'CancellationToken',
+)
+
+
+class Cancelled(Exception):
+    """Raised from blocking work whose :class:`CancellationToken` was cancelled.
+
+    The render scheduler reports it to the job's submitter as ``RenderCancelled``, or
+    ``DeadlineExceeded`` when ``reason`` is :attr:`CancellationToken.DEADLINE`.
+    """
+
+    def __init__(self, reason: str, timeout: float = None, /) -> None:
+        self.reason: str = reason
+        self.timeout: float = timeout  # type: ignore
+        super().__init__(reason)
+
+
+class CancellationToken:
+    """A thread-safe flag that blocking render work checks between steps, so it can stop early.
+
+    A token is cancelled either explicitly through :meth:`cancel`, or implicitly once its
+    deadline passes.
+    """
+
+    DEADLINE = 'deadline'
+
+    __slots__ = ('_event', 'reason', 'timeout', 'deadline')
+
+    def __init__(self) -> None:
+        self._event: threading.Event = threading.Event()
+        self.reason: str = None  # type: ignore
+        self.timeout: float = None  # type: ignore
+        self.deadline: float = None  # type: ignore
+
+    def set_deadline(self, timeout: float, /) -> None:
+        """Cancels this token ``timeout`` seconds from now."""
+        self.timeout = timeout
+        self.deadline = time.monotonic() + timeout
+
+    @property
+    def cancelled(self) -> bool:
+        if self._event.is_set():
+            return True
+
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel(self.DEADLINE)
+            return True
+
+        return False
+
+    def cancel(self, reason: str = 'cancelled', /) -> None:
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    def exception(self) -> Cancelled:
+        return Cancelled(self.reason, self.timeout)
+
+    def check(self) -> None:
+        """Raises :class:`Cancelled` if this token has been cancelled."""
+        if self.cancelled:
+            raise self.exception()
+
+    async def run_in_thread(self, func: Callable[..., R], /, *args: Any) -> R:
+        """Runs ``func(*args)`` in a thread, like :func:`asyncio.to_thread`, but doesn't return before it does.
+
+        Threads can't be interrupted, so if the caller is cancelled, this token is cancelled and the
+        thread waited for until it stops at its next check. Whatever it was using can then be
+        cleaned up safely once the cancellation is raised.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(None, contextvars.copy_context().run, func, *args)
+
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            self.cancel()
+
+            try:
+                await settle(future)
+            finally:
+                # Whatever the thread ended with, the cancellation is what is raised
+                if future.done() and not future.cancelled():
+                    future.exception()
+            raise
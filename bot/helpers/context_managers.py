@@ -1,39 +1,182 @@
 from __future__ import annotations
 
+import asyncio
 import discord
 import time
 
 from discord.context_managers import Typing
 from discord.ext import commands
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+R = TypeVar('R')
 
 
 class Processing:
+    """Shows the progress of a command in a message, and delivers its result.
+
+    With ``edit_in_place``, that one message goes from queued to processing to the result, and
+    no typing indicator is shown since the message already says what is going on. Otherwise the
+    message is deleted once the result has been sent as a new message, with typing shown meanwhile.
+
+    When the result is edited in place, a :meth:`preview` of it can be shown until it is ready.
+    How long it took until something was shown, and until the result was, is recorded on the
+    context as ``first_response`` and ``final_response``, in seconds since the command started.
+    """
     EMOJI = '<a:ablobbouncefast:878313868340920391>'
+    POSITION_EDIT_INTERVAL = 2.0  # Minimum seconds between queue position edits
 
-    def __init__(self, ctx: commands.Context, /) -> None:
+    def __init__(self, ctx: commands.Context, /, *, edit_in_place: bool = True) -> None:
         self.ctx: commands.Context = ctx
+        self.edit_in_place: bool = edit_in_place
 
         self._start: float = None
         self._message: discord.Message = None
         self._typing_ctx: Typing = None
+        self._delivered: bool = False
+        self._finished: bool = False
+        self._position: Optional[int] = None
+        self._last_position_edit: float = 0.0
+        self._position_task: Optional[asyncio.Task] = None
+        self._preview_task: Optional[asyncio.Task] = None
 
     async def __aenter__(self) -> Processing:
         self._message = await self.ctx.reply(f'{self.EMOJI} Processing...')
-        self._typing_ctx = ctx = self.ctx.typing()
-        await ctx.__aenter__()
+
+        if not self.edit_in_place:
+            self._typing_ctx = ctx = self.ctx.typing()
+            await ctx.__aenter__()
 
         self._start = time.perf_counter()
         return self
 
     async def __aexit__(self, *_) -> None:
-        await self._message.delete(delay=0)
-        await self._typing_ctx.__aexit__(None, None, None)
+        self._finished = True
+        await self._settle(self._position_task)
+        await self._settle(self._preview_task)
 
-    async def __call__(self, file: discord.File, /) -> None:
-        delta = time.perf_counter() - self._start
+        if not self._delivered:
+            await self._message.delete(delay=0)
+
+        if self._typing_ctx is not None:
+            await self._typing_ctx.__aexit__(None, None, None)
+
+    async def _show_position(self) -> None:
+        shown = None
+
+        while (position := self._position) != shown:
+            if position:
+                # Moving up the queue is throttled, but the latest position is shown once it may be
+                delay = self._last_position_edit + self.POSITION_EDIT_INTERVAL - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+
+                content = f'{self.EMOJI} Queued (position {position:,})...'
+            else:
+                # Starting to process is always shown right away
+                content = f'{self.EMOJI} Processing...'
+
+            self._last_position_edit = time.perf_counter()
+            await self._message.edit(content=content)
+            shown = position
+
+    async def _on_position(self, position: int, /) -> None:
+        # Edited in the background by one task at a time, which is settled before the result is shown
+        self._position = position
+
+        if self._finished:
+            return
+
+        if self._position_task is None or self._position_task.done():
+            self._position_task = asyncio.create_task(self._show_position())
+
+    async def schedule(self, func: Callable[..., Awaitable[R]], /, *args: Any, priority: int = 0, **kwargs: Any) -> R:
+        """Runs ``func`` through the bot's render scheduler, reporting the queue position in the processing message."""
+        ctx = self.ctx
+        queued_at = time.perf_counter()
+
+        async def run(*args: Any, **kwargs: Any) -> R:
+            ctx.timings.add('queue', time.perf_counter() - queued_at)
+            return await func(*args, **kwargs)
+
+        return await ctx.bot.scheduler.submit(
+            run,
+            *args,
+            guild_id=ctx.guild and ctx.guild.id,
+            user_id=ctx.author.id,
+            priority=priority,
+            tag=ctx.message.id,
+            on_position=self._on_position,
+            **kwargs,
+        )
 
-        embed = discord.Embed(color=0x2F3136, timestamp=self.ctx.message.created_at)
-        embed.set_footer(text=f'{delta * 1000:.1f} ms', icon_url=self.ctx.author.avatar)
+    def _responded(self, *, final: bool) -> None:
+        elapsed = self.ctx.timings.elapsed
+
+        if getattr(self.ctx, 'first_response', None) is None:
+            self.ctx.first_response = elapsed
+        if final:
+            self.ctx.final_response = elapsed
+
+    async def _show_preview(self, file: discord.File, /) -> None:
+        embed = discord.Embed(color=0x2F3136)
         embed.set_image(url='attachment://' + file.filename)
 
-        await self.ctx.send(embed=embed, file=file)
+        await self._message.edit(content=f'{self.EMOJI} Rendering the rest...', embed=embed, attachments=[file])
+        self._responded(final=False)
+
+    def preview(self, file: discord.File, /) -> None:
+        """Shows a preview of the result in the progress message, in the background.
+
+        Only the first preview is shown, and only when the result is edited in place.
+        """
+        if self.edit_in_place and self._preview_task is None:
+            self._preview_task = asyncio.create_task(self._show_preview(file))
+
+    @staticmethod
+    async def _settle(task: Optional[asyncio.Task], /) -> None:
+        # Progress that hasn't been shown yet isn't worth holding up the result for
+        if task is None:
+            return
+
+        if not task.done():
+            task.cancel()
+
+        try:
+            await task
+        except (asyncio.CancelledError, discord.HTTPException):
+            pass
+
+    async def __call__(self, *files: discord.File) -> None:
+        """Delivers the results, each in its own embed, in one message."""
+        delta = time.perf_counter() - self._start
+        embeds = []
+
+        for file in files:
+            embed = discord.Embed(color=0x2F3136)
+            embed.set_image(url='attachment://' + file.filename)
+            embeds.append(embed)
+
+        embeds[-1].timestamp = self.ctx.message.created_at
+        embeds[-1].set_footer(text=f'{delta * 1000:.1f} ms', icon_url=self.ctx.author.avatar)
+
+        with self.ctx.timings.stage('upload'):
+            if not self.edit_in_place:
+                await self.ctx.send(embeds=embeds, files=list(files))
+                self._responded(final=True)
+                return
+
+            # Nothing may edit the message after the result is in it
+            self._finished = True
+            await self._settle(self._position_task)
+            await self._settle(self._preview_task)
+
+            try:
+                await self._message.edit(content=None, embeds=embeds, attachments=list(files))
+            except discord.NotFound:
+                # The progress message was deleted in the meantime
+                await self.ctx.send(embeds=embeds, files=list(files))
+            else:
+                self._delivered = True
+
+            self._responded(final=True)
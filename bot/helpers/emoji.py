@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import threading
+
+from collections import OrderedDict
+from io import BytesIO
+from typing import Callable, ClassVar, Hashable, Optional
+
+from pilmoji import EMOJI_REGEX
+from pilmoji.source import Twemoji
+
+__all__ = (
+    'CachedTwemoji',
+    'prewarm_emoji',
+)
+
+
+class CachedTwemoji(Twemoji):
+    """A Twemoji source whose downloads are shared between every render.
+
+    Pilmoji creates a source per drawing session, so the cache lives on the class.
+    The ``MAX_SIZE`` most recently used emojis are kept.
+    """
+
+    MAX_SIZE: ClassVar[int] = 1024
+
+    _cache: ClassVar[OrderedDict[Hashable, bytes]] = OrderedDict()
+    _lock: ClassVar[threading.Lock] = threading.Lock()
+
+    @classmethod
+    def _get_cached(cls, key: Hashable, fetch: Callable[[], Optional[BytesIO]]) -> Optional[BytesIO]:
+        with cls._lock:
+            if (data := cls._cache.get(key)) is not None:
+                cls._cache.move_to_end(key)
+                return BytesIO(data)
+
+        stream = fetch()
+        if stream is None or not (data := stream.getvalue()):
+            return stream
+
+        with cls._lock:
+            cls._cache[key] = data
+            while len(cls._cache) > cls.MAX_SIZE:
+                cls._cache.popitem(last=False)
+
+        return BytesIO(data)
+
+    def get_emoji(self, emoji: str, /) -> Optional[BytesIO]:
+        fetch = super().get_emoji
+        return self._get_cached(emoji, lambda: fetch(emoji))
+
+    def get_discord_emoji(self, id: int, /) -> Optional[BytesIO]:
+        fetch = super().get_discord_emoji
+        return self._get_cached(int(id), lambda: fetch(id))
+
+
+COMMON_EMOJI = '😂😭💀🔥😳🤣😎🙏👍😩🥺😈🤡🗿💯✨🎉👀😐🤔'
+
+
+def prewarm_emoji(emoji: str = COMMON_EMOJI, /) -> None:
+    """Downloads the given emojis into the shared cache. This blocks."""
+    source = CachedTwemoji()
+
+    for match in EMOJI_REGEX.findall(emoji):
+        source.get_emoji(match)
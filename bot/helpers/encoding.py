@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import tempfile
+import time
+
+from contextlib import contextmanager
+from io import BytesIO
+from typing import BinaryIO, Iterable, Iterator, NamedTuple, Optional, Sequence
+
+from PIL import Image, features
+
+from .cancellation import CancellationToken
+from .timings import StageTimings
+from .transparency import save_transparent_gif
+
+__all__ = (
+    'ANIMATED_FORMATS',
+    'STATIC_FORMATS',
+    'Encoded',
+    'encode_frames',
+    'negotiate_formats',
+)
+
+ANIMATED_FORMATS = ('gif', 'webp', 'apng')
+STATIC_FORMATS = ('png', 'webp')
+
+
+class Encoded(NamedTuple):
+    """An encoded image and what it took to produce it."""
+    stream: BinaryIO
+    format: str
+    size: int
+    encode_time: float
+    attempts: int = 1
+
+    @property
+    def extension(self) -> str:
+        return 'png' if self.format == 'apng' else self.format
+
+
+def _supported(fmt: str, *, animated: bool) -> bool:
+    if fmt not in (ANIMATED_FORMATS if animated else STATIC_FORMATS):
+        return False
+
+    if fmt == 'webp':
+        return features.check('webp_anim' if animated else 'webp')
+
+    return True
+
+
+def negotiate_formats(formats: Sequence[str], *, animated: bool) -> list[str]:
+    """Filters ``formats`` down to the ones this build of Pillow can encode, keeping their order.
+
+    Falls back to GIF for animations and PNG otherwise.
+    """
+    return [fmt for fmt in formats if _supported(fmt, animated=animated)] or ['gif' if animated else 'png']
+
+
+@contextmanager
+def _encode_stage(timings: StageTimings) -> Iterator[None]:
+    # Frames may be produced lazily while the encoder runs, so time spent in other stages is taken back out
+    before = sum(timings.stages.values())
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        timings.add('encode', time.perf_counter() - start - (sum(timings.stages.values()) - before))
+
+
+def encode_frames(
+    frames: Iterable[Image.Image],
+    durations: list[int],
+    fmt: str,
+    *,
+    animated: bool,
+    colors: int = 256,
+    quality: int = 80,
+    spool: bool = False,
+    token: Optional[CancellationToken] = None,
+    timings: Optional[StageTimings] = None,
+) -> Encoded:
+    """Encodes RGBA frames in the given format. ``frames`` may be lazy, see :func:`save_transparent_gif`.
+
+    ``colors`` applies to GIFs and static PNGs, ``quality`` to WebP. With ``spool``, the output
+    is written to a temporary file rather than kept in memory.
+    """
+    timings = timings or StageTimings()
+    encoded_before = timings.stages.get('encode', 0)
+
+    stream = tempfile.TemporaryFile() if spool else BytesIO()
+    frames = iter(frames)
+
+    if fmt == 'gif':
+        save_transparent_gif(frames, durations, stream, colors=colors, token=token, timings=timings)
+    else:
+        first = next(frames)
+        if token is not None:
+            token.check()
+
+        with _encode_stage(timings):
+            if fmt == 'webp':
+                first.save(
+                    stream, 'WEBP', save_all=animated, append_images=frames, duration=durations,
+                    loop=0, quality=quality, method=4,
+                )
+            elif animated:
+                # APNG walks the frames twice
+                first.save(
+                    stream, 'PNG', save_all=True, append_images=list(frames), duration=durations,
+                    loop=0, disposal=1, blend=0,
+                )
+            else:
+                if colors < 256:
+                    first = first.quantize(colors, method=Image.FASTOCTREE)
+                first.save(stream, 'PNG')
+
+    size = stream.tell()
+    stream.seek(0)
+
+    return Encoded(stream, fmt, size, timings.stages['encode'] - encoded_before)
@@ -1,8 +1,11 @@
 from __future__ import annotations
 
+import asyncio
 import functools
 import re
-from typing import Optional, TYPE_CHECKING, Union
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Hashable, Optional, Sequence, TYPE_CHECKING, Union
 
 import aiohttp
 import discord
@@ -10,16 +13,17 @@ import humanize
 from discord.asset import AssetMixin
 from discord.ext import commands
 
-from .misc import url_from_emoji
+from .buffers import ImageData
+from .misc import gather_or_cancel, url_from_emoji
 
 if TYPE_CHECKING:
     from io import BufferedIOBase
     from os import PathLike
 
-    from aiohttp import ClientSession
+    from aiohttp import ClientResponse
     from discord.ext.commands import Context
 
-    from typing import Any, Protocol
+    from typing import Any, AsyncContextManager, Protocol
 
     QueryT = Union[discord.Member, discord.Emoji, discord.PartialEmoji, str]
     SaveT = Union[str, bytes, PathLike, BufferedIOBase]
@@ -37,9 +41,143 @@ if TYPE_CHECKING:
     class SupportsAvatar(Protocol):
         avatar: discord.Asset
 
+    class ClientSession(Protocol):
+        # An aiohttp session, or the bot's FetchClient
+        def get(self, url: str, /) -> AsyncContextManager[ClientResponse]:
+            ...
+
 BadArgument = commands.BadArgument
 
-__all__ = 'ImageFinder',
+__all__ = (
+    'ConversionCache',
+    'ImageFinder',
+)
+
+
+class ConversionCache:
+    """Remembers what text queries converted to, so repeat lookups skip gateway member queries and API fetches.
+
+    Emojis are kept for ``ttl`` seconds, members for ``member_ttl`` (``ttl`` by default), and queries
+    that converted to nothing (kept as the query text) for ``miss_ttl``. Entries for a member are dropped
+    when :meth:`invalidate_member` is called, e.g. when their name or avatar changes, and entries for a
+    guild's emojis when :meth:`invalidate_emojis` is. Past ``max_size`` entries, the least recently used go first.
+
+    Those events need the members intent, so a member's avatar is also remembered with their entry. If
+    :meth:`get` is given a way to look up a fresher copy of the member and their avatar differs, the entry
+    is dropped. Without the intent, a short ``member_ttl`` bounds how long anything else stays stale.
+    """
+
+    MAX_SIZE = 4096
+
+    def __init__(
+        self, *, ttl: float = 300.0, miss_ttl: float = 60.0, member_ttl: float = None, max_size: int = MAX_SIZE,
+    ) -> None:
+        self.ttl: float = ttl
+        self.miss_ttl: float = miss_ttl
+        self.member_ttl: float = ttl if member_ttl is None else member_ttl
+        self.max_size: int = max_size
+
+        # Key -> when it expires, what it converted to, and the avatar of the member it converted to
+        self._entries: OrderedDict[tuple[int, str], tuple[float, QueryT, Optional[str]]] = OrderedDict()
+        self._owned: dict[Hashable, set[tuple[int, str]]] = {}  # What an entry depends on -> its keys
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _owner(guild_id: int, value: QueryT) -> Optional[Hashable]:
+        if isinstance(value, (discord.Member, discord.User)):
+            return 'member', value.id
+
+        if isinstance(value, discord.Emoji):
+            return 'emojis', guild_id
+
+        return None
+
+    @staticmethod
+    def _avatar(user: SupportsAvatar) -> Optional[str]:
+        return user.avatar and user.avatar.key
+
+    def _remove(self, key: tuple[int, str]) -> None:
+        _, value, _ = self._entries.pop(key)
+
+        owner = self._owner(key[0], value)
+        if owner is not None:
+            keys = self._owned[owner]
+            keys.discard(key)
+            if not keys:
+                del self._owned[owner]
+
+    def get(
+        self,
+        guild_id: Optional[int],
+        text: str,
+        *,
+        lookup_member: Callable[[int], Optional[SupportsAvatar]] = None,
+    ) -> Optional[QueryT]:
+        """Returns what the text converted to in the guild, if remembered.
+
+        ``lookup_member`` is called with the ID of a remembered member, and may return a fresher
+        copy of them (or ``None``), whose avatar is compared with the one they had when remembered.
+        """
+        key = guild_id or 0, text
+
+        try:
+            expires_at, value, avatar = self._entries[key]
+        except KeyError:
+            return None
+
+        if time.monotonic() >= expires_at:
+            self._remove(key)
+            return None
+
+        if (
+            lookup_member is not None
+            and isinstance(value, (discord.Member, discord.User))
+            and (current := lookup_member(value.id)) is not None
+            and self._avatar(current) != avatar
+        ):
+            self.invalidate_member(value.id)
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, guild_id: Optional[int], text: str, value: QueryT) -> None:
+        key = guild_id or 0, text
+        if key in self._entries:
+            self._remove(key)
+
+        avatar = None
+        if isinstance(value, str):
+            ttl = self.miss_ttl
+        elif isinstance(value, (discord.Member, discord.User)):
+            ttl, avatar = self.member_ttl, self._avatar(value)
+        else:
+            ttl = self.ttl
+
+        self._entries[key] = time.monotonic() + ttl, value, avatar
+
+        owner = self._owner(key[0], value)
+        if owner is not None:
+            self._owned.setdefault(owner, set()).add(key)
+
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+
+    def _invalidate(self, owner: Hashable) -> None:
+        for key in self._owned.get(owner, set()).copy():
+            self._remove(key)
+
+    def invalidate_member(self, user_id: int, /) -> None:
+        self._invalidate(('member', user_id))
+
+    def invalidate_emojis(self, guild_id: int, /) -> None:
+        self._invalidate(('emojis', guild_id))
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._owned.clear()
 
 
 class ImageFinder:
@@ -48,8 +186,13 @@ class ImageFinder:
     DEFAULT_MAX_WIDTH = 2048
     DEFAULT_MAX_HEIGHT = DEFAULT_MAX_WIDTH
     DEFAULT_MAX_SIZE = 1024 * 1024 * 6  # 6 MiB
+    DEFAULT_MAX_BATCH = 4
+    DEFAULT_MAX_BATCH_SIZE = 1024 * 1024 * 16  # 16 MiB
+    CHUNK_SIZE = 1024 * 64
 
     URL_REGEX = re.compile(r'https?://\S+')
+    MENTION_REGEX = re.compile(r'<@!?[0-9]{15,20}>$')
+    CUSTOM_EMOJI_REGEX = re.compile(r'<a?:[A-Za-z0-9_]+:[0-9]{15,20}>$')
     TENOR_REGEX = re.compile(r'https?://(www\.)?tenor\.com/view/\S+/?')
     GIPHY_REGEX = re.compile(r'https?://(www\.)?giphy\.com/gifs/[A-Za-z0-9]+/?')
 
@@ -69,19 +212,29 @@ class ImageFinder:
 
     CONVERTERS = (
         commands.MemberConverter,
+        commands.EmojiConverter,
         commands.PartialEmojiConverter
     )
+    CONVERSION_TIMEOUT = 3.0  # Seconds a single conversion may wait on the gateway or API
 
     def __init__(
         self,
         *,
         max_width: int = DEFAULT_MAX_WIDTH,
         max_height: int = DEFAULT_MAX_HEIGHT,
-        max_size: int = DEFAULT_MAX_SIZE
+        max_size: int = DEFAULT_MAX_SIZE,
+        max_batch: int = DEFAULT_MAX_BATCH,
+        max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+        spool_threshold: int = ImageData.SPOOL_THRESHOLD,
+        conversion_cache: ConversionCache = None
     ) -> None:
         self.max_width: int = max_width
         self.max_height: int = max_height
         self.max_size: int = max_size
+        self.max_batch: int = max_batch
+        self.max_batch_size: int = max_batch_size
+        self.spool_threshold: int = spool_threshold
+        self.conversion_cache: ConversionCache = conversion_cache or ConversionCache()
 
     @property
     def max_size_humanized(self) -> str:
@@ -103,16 +256,44 @@ class ImageFinder:
                 text = await response.text(encoding='utf-8')
                 return 'https://media' + text.split('https://media')[2].split('"')[0]
 
+    @staticmethod
+    def _lookup_member(ctx: commands.Context, user_id: int, /) -> Optional[SupportsAvatar]:
+        # The author and mentions come with the message, so they're current even without the members intent
+        if ctx.author.id == user_id:
+            return ctx.author
+
+        if (mentioned := discord.utils.get(ctx.message.mentions, id=user_id)) is not None:
+            return mentioned
+
+        return ctx.guild and ctx.guild.get_member(user_id)
+
     async def _run_conversions(self, ctx: commands.Context, text: str) -> QueryT:
+        guild_id = ctx.guild and ctx.guild.id
+        lookup_member = functools.partial(self._lookup_member, ctx)
+
+        if (cached := self.conversion_cache.get(guild_id, text, lookup_member=lookup_member)) is not None:
+            return cached
+
+        result, timed_out = text, False
         for converter in self.CONVERTERS:
             try:
-                result = await converter().convert(ctx, text)
-            except commands.ConversionError:
+                result = await asyncio.wait_for(converter().convert(ctx, text), self.CONVERSION_TIMEOUT)
+            except asyncio.TimeoutError:
+                timed_out = True
+            except (commands.BadArgument, commands.ConversionError):
                 continue
             else:
-                return result
+                break
+
+        # A conversion that timed out might still succeed next time
+        if not timed_out or not isinstance(result, str):
+            self.conversion_cache.put(guild_id, text, result)
 
-        return text
+        return result
+
+    async def convert(self, ctx: commands.Context, text: str) -> QueryT:
+        """Converts text to the member or emoji it refers to, or returns it as is if it refers to neither."""
+        return await self._run_conversions(ctx, text)
 
     async def sanitize(
         self,
@@ -121,7 +302,7 @@ class ImageFinder:
         *,
         allowed_content_types: set[str] = None,
         allowed_suffixes: set[str] = None
-    ) -> bytes:
+    ) -> ImageData:
         if isinstance(result, AssetMixin):
             result = await result.read()
 
@@ -147,14 +328,14 @@ class ImageFinder:
                     f'Attachment height of {result.height:,} surpasses the maximum of {self.max_height:,}.'
                 )
 
-            return await result.read()
+            return ImageData(await result.read())
 
         elif isinstance(result, bytes):
             if len(result) > self.max_size:
                 their_size = humanize.naturalsize(len(result), binary=True, format='%.2f')
                 raise BadArgument(f'Image is too large. ({their_size} > {self.max_size_humanized})')
 
-            return result
+            return ImageData(result)
 
         elif isinstance(result, str):
             result = result.strip('<>')
@@ -179,10 +360,84 @@ class ImageFinder:
                             their_size = humanize.naturalsize(length, binary=True, format='%.2f')
                             raise BadArgument(f'Image is too large. ({their_size} > {self.max_size_humanized})')
 
-                    return await response.read()
+                    # Streamed so that servers that lie about (or omit) the length are cut off early
+                    return await ImageData.from_chunks(
+                        response.content.iter_chunked(self.CHUNK_SIZE),
+                        max_size=self.max_size,
+                        on_too_large=lambda _: BadArgument(f'Image is too large. (> {self.max_size_humanized})'),
+                        spool_threshold=self.spool_threshold,
+                    )
 
             except aiohttp.InvalidURL:
                 raise BadArgument('Invalid image/image URL.')
+            except asyncio.TimeoutError:
+                raise BadArgument('Fetching your image took too long.')
+            except aiohttp.ClientError:
+                raise BadArgument('Could not fetch your image.')
+
+    def _sanitizer(self, ctx: Context, *, allow_gifs: bool) -> Callable[..., Awaitable[ImageData]]:
+        allowed_content_types = self.ALLOWED_CONTENT_TYPES.copy()
+        allowed_suffixes = self.ALLOWED_SUFFIXES.copy()
+
+        if allow_gifs:
+            allowed_content_types.add('image/gif')
+            allowed_suffixes.add('.gif')
+
+        return functools.partial(
+            self.sanitize,
+            session=ctx.bot.fetcher,
+            allowed_content_types=allowed_content_types,
+            allowed_suffixes=allowed_suffixes
+        )
+
+    async def find_many(
+        self,
+        ctx: Context,
+        queries: Sequence[QueryT] = (),
+        *,
+        allow_gifs: bool = True,
+        user_avatars: bool = True
+    ) -> list[ImageData]:
+        """Finds every queried image, then every image attached to the message, fetching them concurrently.
+
+        Each image goes through the same checks as in :meth:`find`, and together they may
+        be at most ``max_batch`` images and ``max_batch_size`` bytes.
+        """
+        attachments = ctx.message.attachments
+        count = len(queries) + len(attachments)
+
+        if not count:
+            raise BadArgument('No attachments or links given.')
+
+        if count > self.max_batch:
+            raise BadArgument(f'Too many images. ({count} > {self.max_batch})')
+
+        sanitize = self._sanitizer(ctx, allow_gifs=allow_gifs)
+        tasks = [
+            *(
+                asyncio.ensure_future(
+                    self.find(ctx, query, allow_gifs=allow_gifs, user_avatars=user_avatars, run_conversions=False)
+                )
+                for query in queries
+            ),
+            *(asyncio.ensure_future(sanitize(attachment)) for attachment in attachments),
+        ]
+
+        try:
+            images = await gather_or_cancel(*tasks)
+
+            if (size := sum(map(len, images))) > self.max_batch_size:
+                their_size = humanize.naturalsize(size, binary=True, format='%.2f')
+                limit = humanize.naturalsize(self.max_batch_size, binary=True, format='%.2f')
+                raise BadArgument(f'Images are too large together. ({their_size} > {limit})')
+        except BaseException:
+            # The images that did arrive aren't handed to anyone
+            for task in tasks:
+                if task.done() and not task.cancelled() and task.exception() is None:
+                    task.result().close()
+            raise
+
+        return images
 
     async def find(
         self,
@@ -193,34 +448,21 @@ class ImageFinder:
         user_avatars: bool = True,
         fallback_to_user: bool = True,
         run_conversions: bool = True
-    ) -> bytes:
+    ) -> ImageData:
         if query is not None and run_conversions and isinstance(query, str):
             query = await self._run_conversions(ctx, query)
 
         query: Optional[QueryT]
+        sanitize = self._sanitizer(ctx, allow_gifs=allow_gifs)
 
-        allowed_content_types = self.ALLOWED_CONTENT_TYPES.copy()
-        allowed_suffixes = self.ALLOWED_SUFFIXES.copy()
-
-        if allow_gifs:
-            allowed_content_types.add('image/gif')
-            allowed_suffixes.add('.gif')
-
-        sanitize = functools.partial(
-            self.sanitize,
-            session=ctx.bot.session,
-            allowed_content_types=allowed_content_types,
-            allowed_suffixes=allowed_suffixes
-        )
-
-        async def do_user_avatar(user: SupportsAvatar) -> bytes:
+        async def do_user_avatar(user: SupportsAvatar) -> ImageData:
             avatar = user.avatar
             if not allow_gifs:
                 avatar = user.avatar.with_format('png')
 
             return await sanitize(avatar)
 
-        async def fallback() -> Optional[bytes]:
+        async def fallback() -> Optional[ImageData]:
             # I cannot figure out a way to make this code look good
 
             message: discord.Message = ctx.message
@@ -9,7 +9,9 @@ R = TypeVar('R')
 EMOJI_REGEX = re.compile(r'<(a)?:([a-zA-Z0-9_]{2,32}):([0-9]{17,25})>')
 
 __all__ = (
+    'gather_or_cancel',
     'proportionally_scale',
+    'settle',
     'to_thread',
     'url_from_emoji'
 )
@@ -24,6 +26,46 @@ def to_thread(func: Callable[..., R]) -> Callable[..., Awaitable[R]]:
     return wrapper
 
 
+async def gather_or_cancel(*aws: Awaitable[R]) -> list[R]:
+    """Like :func:`asyncio.gather`, but cancels the others as soon as one fails.
+
+    The error is only raised once every cancelled task is done, so whatever they were using
+    can be cleaned up right after.
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+
+        for task in tasks:
+            try:
+                await settle(task)
+            except asyncio.CancelledError:
+                pass  # The error being handled is raised either way
+
+        raise
+
+
+async def settle(future: asyncio.Future, /) -> None:
+    """Waits for the future to be done, even if cancelled in the meantime.
+
+    A cancellation received while waiting is raised once it is done.
+    """
+    cancelled = False
+
+    while not future.done():
+        try:
+            await asyncio.wait((future,))
+        except asyncio.CancelledError:
+            cancelled = True
+
+    if cancelled:
+        raise asyncio.CancelledError
+
+
 def proportionally_scale(
     old: tuple[int, int],
     *,
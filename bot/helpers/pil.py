@@ -1,7 +1,8 @@
 from __future__ import annotations
 
 import re
-from functools import partial
+import threading
+from functools import lru_cache, partial
 from typing import Callable, Iterator, TYPE_CHECKING
 
 from fontTools.ttLib import TTFont
@@ -16,6 +17,16 @@ __all__ = (
 )
 
 
+@lru_cache(maxsize=None)
+def _font_regex(path: str) -> re.Pattern[str]:
+    # Parsing the cmap is by far the most expensive part of loading a font, and it only
+    # depends on the font file
+    with TTFont(path) as font:
+        characters = {chr(code) for table in font["cmap"].tables for code in table.cmap}
+
+    return re.compile('([^%s]+)' % ''.join(map(re.escape, sorted(characters))))
+
+
 def _pilmoji_parse_line(line: str, /) -> list[Node]:
     nodes = []
 
@@ -194,10 +205,7 @@ class FallbackFont:
         return self._size
 
     def _load_font_regex(self) -> None:
-        with TTFont(self.font.path) as font:
-            characters = (chr(code) for table in font["cmap"].tables for code, _ in table.cmap.items())
-
-        self._regex = re.compile('([^%s]+)' % ''.join(map(re.escape, characters)))
+        self._regex = _font_regex(self.font.path)
 
     def _split_text(self, text: str) -> Iterator[list[str]]:
         yield from (self._regex.split(line) for line in text.split('\n'))
@@ -290,3 +298,33 @@ class FallbackFont:
 
             y += 4 + self._size
             x = xy[0]
+
+
+class FallbackFontPool:
+    """Keeps fonts around between renders, keyed by size.
+
+    :class:`FallbackFont` patches the font it wraps while drawing, so a font is handed
+    to one render at a time: :meth:`acquire` checks one out and :meth:`release` returns it.
+    At most ``max_idle`` idle fonts are kept per size.
+    """
+
+    def __init__(self, factory: Callable[[int], FallbackFont], *, max_idle: int = 4) -> None:
+        self.factory: Callable[[int], FallbackFont] = factory
+        self.max_idle: int = max_idle
+
+        self._idle: dict[int, list[FallbackFont]] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def acquire(self, size: int, /) -> FallbackFont:
+        with self._lock:
+            if idle := self._idle.get(size):
+                return idle.pop()
+
+        return self.factory(size)
+
+    def release(self, font: FallbackFont, /) -> None:
+        with self._lock:
+            idle = self._idle.setdefault(font.size, [])
+
+            if len(idle) < self.max_idle:
+                idle.append(font)
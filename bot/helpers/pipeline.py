@@ -0,0 +1,348 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import math
+
+from concurrent.futures import Executor
+from typing import Callable, Iterable, Iterator, Optional, Sequence, TYPE_CHECKING
+
+from PIL import Image, ImageSequence
+
+from .buffers import ImageData, open_stream
+from .cancellation import CancellationToken
+from .encoding import Encoded, encode_frames, negotiate_formats
+from .misc import proportionally_scale
+from .timings import StageTimings
+
+if TYPE_CHECKING:
+    from .probe import ImageProbe
+
+__all__ = (
+    'FrameOp',
+    'Pipeline',
+)
+
+FrameOp = Callable[[Image.Image], Image.Image]
+
+
+class Pipeline:
+    """Decodes an image, runs each of its frames through a series of operations, and encodes the result.
+
+    Operations are plain callables that take an RGBA frame and return the new frame. They are fused:
+    every operation runs on a frame before the next frame is decoded, and frames are handed to the
+    encoder as they are produced, so only a couple of full-color frames are in memory at once.
+
+    Frames are scaled to fit ``max_size`` (and ``min_size``) before the operations see them. If
+    ``max_frames`` is given, only every n-th frame is kept and the skipped frames' durations are
+    added to the kept ones. Time is recorded in ``timings`` as the ``decode``, ``compose``,
+    ``quantize`` and ``encode`` stages.
+
+    The output is encoded in the first of ``formats`` that suits it (animated or not) and that
+    Pillow can encode. With ``max_bytes``, every format is tried in order and the first that fits
+    is used; if none does, the format that came out smallest is encoded again at decreasing scale,
+    colors and quality (see ``FIT_STEPS``) until it fits. The first attempt streams like any other
+    run, and every later one decodes the image again rather than keeping its frames in memory.
+
+    With ``spool_output``, the output is encoded into a temporary file instead of memory.
+
+    :meth:`run` blocks; :meth:`render` runs it in an executor. Pipelines given to a process pool
+    must not have a ``token``, and their operations must be picklable (module-level functions or
+    :func:`functools.partial`\\s of them).
+    """
+
+    # Scale, colors and WebP quality tried in order when fitting the output into ``max_bytes``
+    FIT_STEPS = (
+        (1.0, 256, 80),
+        (1.0, 128, 65),
+        (0.8, 128, 55),
+        (0.65, 64, 45),
+        (0.5, 64, 35),
+        (0.35, 32, 25),
+    )
+
+    def __init__(
+        self,
+        *,
+        max_size: int,
+        min_size: int = None,
+        max_frames: int = None,
+        colors: int = 256,
+        quality: int = 80,
+        formats: Sequence[str] = ('gif', 'png'),
+        max_bytes: int = None,
+        spool_output: bool = False,
+        token: CancellationToken = None,
+        timings: StageTimings = None,
+    ) -> None:
+        self.max_size: int = max_size
+        self.min_size: Optional[int] = min_size
+        self.max_frames: Optional[int] = max_frames
+        self.colors: int = colors
+        self.quality: int = quality
+        self.formats: tuple[str, ...] = tuple(formats)
+        self.max_bytes: Optional[int] = max_bytes
+        self.spool_output: bool = spool_output
+        self.token: Optional[CancellationToken] = token
+        self.timings: StageTimings = timings or StageTimings()
+
+        self.durations: list[int] = []
+
+    @staticmethod
+    def estimate_memory(
+        probe: ImageProbe,
+        /,
+        *,
+        max_size: int,
+        min_size: int = None,
+        max_frames: int = None,
+        formats: Sequence[str] = ('gif', 'png'),
+        max_bytes: int = None,
+        extra_height: int = 0,
+    ) -> int:
+        """Estimates the peak memory of running a pipeline over the probed image, in bytes.
+
+        This is a rough upper bound: the decoder's current and previous frame, a couple of frames
+        on their way through the operations, the palette-mapped copies the GIF encoder keeps, every
+        frame when an animation may be encoded as WebP or APNG, whose encoders hold on to them all,
+        and, with ``max_bytes``, the smallest output so far next to the one being encoded.
+        ``extra_height`` is added to output frames, for operations that make them taller.
+        """
+        # Pillow stores anything wider than a byte per pixel in four; animation frames become RGB(A)
+        source_depth = 1 if probe.mode in ('1', 'L', 'P') and not probe.animated else 4
+        source = probe.width * probe.height * source_depth
+
+        width, height = proportionally_scale(probe.size, min_dimension=min_size, max_dimension=max_size)
+        pixels = width * (height + extra_height)
+        frames = min(probe.frames, max_frames) if max_frames else probe.frames
+
+        total = 2 * source + 2 * pixels * 4 + frames * pixels
+        if max_bytes is not None:
+            total += 2 * max_bytes
+
+        # Only the first format is used unless the output has to fit into max_bytes
+        candidates = negotiate_formats(formats, animated=probe.animated)
+        if max_bytes is None:
+            candidates = candidates[:1]
+        if probe.animated and {'webp', 'apng'}.intersection(candidates):
+            total += frames * pixels * 4
+
+        return total
+
+    @staticmethod
+    def estimate_cost(
+        probe: ImageProbe, /, *, max_size: int, min_size: int = None, weight: float = 1.0,
+    ) -> float:
+        """Estimates the cost of running a pipeline over the probed image, in megapixels rendered."""
+        width, height = proportionally_scale(probe.size, min_dimension=min_size, max_dimension=max_size)
+        return probe.frames * width * height * weight / 1_000_000
+
+    def output_size(self, image: Image.Image, /) -> tuple[int, int]:
+        """The size frames of the given image have once they reach the operations."""
+        return proportionally_scale(image.size, min_dimension=self.min_size, max_dimension=self.max_size)
+
+    def open(self, data: bytes | ImageData, /) -> Image.Image:
+        """Opens the image, reading only its header. This blocks."""
+        with self.timings.stage('decode'):
+            return Image.open(open_stream(data))
+
+    def _check(self) -> None:
+        if self.token is not None:
+            self.token.check()
+
+    def _frame_step(self, image: Image.Image, /) -> int:
+        if not self.max_frames:
+            return 1
+
+        return max(1, math.ceil(getattr(image, 'n_frames', 1) / self.max_frames))
+
+    def _source_frames(self, image: Image.Image, /) -> Iterator[tuple[Image.Image, int]]:
+        size = self.output_size(image)
+        step = self._frame_step(image)
+        fallback_duration = image.info.get('duration', 64)
+
+        frames = enumerate(ImageSequence.Iterator(image))
+        pending = None
+
+        while True:
+            with self.timings.stage('decode'):
+                self._check()
+
+                try:
+                    i, frame = next(frames)
+                except StopIteration:
+                    break
+
+                duration = frame.info.get('duration', fallback_duration)
+
+                if i % step:
+                    # Skipped frames still take up time in the output
+                    pending[1] += duration  # type: ignore
+                    continue
+
+                if frame.size != size:
+                    frame = frame.resize(size)
+                frame = frame.convert('RGBA')
+
+            # A frame is only handed on once the frames skipped after it have been added to its duration
+            if pending is not None:
+                yield pending[0], pending[1]
+
+            pending = [frame, duration]
+
+        if pending is not None:
+            yield pending[0], pending[1]
+
+    def frames(self, image: Image.Image, ops: Iterable[FrameOp], /) -> Iterator[Image.Image]:
+        """Lazily runs every frame of the image through the operations.
+
+        The duration of each frame is appended to :attr:`durations` as it is yielded.
+        """
+        ops = tuple(ops)
+
+        for frame, duration in self._source_frames(image):
+            with self.timings.stage('compose'):
+                for op in ops:
+                    frame = op(frame)
+
+            self.durations.append(duration)
+            yield frame
+
+    @staticmethod
+    def _peek(frames: Iterator[Image.Image], /) -> tuple[Iterator[Image.Image], bool]:
+        """Returns the frames again, and whether there is more than one of them."""
+        first = next(frames)
+        second = next(frames, None)
+
+        if second is None:
+            return iter((first,)), False
+
+        return itertools.chain((first, second), frames), True
+
+    def _encode(self, frames: Iterable[Image.Image], fmt: str, *, animated: bool, **options: int) -> Encoded:
+        return encode_frames(
+            frames,
+            self.durations,
+            fmt,
+            animated=animated,
+            spool=self.spool_output,
+            token=self.token,
+            timings=self.timings,
+            **options,
+        )
+
+    def _decode_again(self, image: Image.Image, ops: tuple[FrameOp, ...], scale: float, /) -> Iterator[Image.Image]:
+        """Runs the image through the operations again from its first frame, scaling the results."""
+        self.durations.clear()  # Shared with the encoder, so cleared in place
+        frames = self.frames(image, ops)
+
+        if scale == 1:
+            return frames
+
+        def scaled() -> Iterator[Image.Image]:
+            for frame in frames:
+                result = frame.resize((round(frame.width * scale), round(frame.height * scale)), Image.LANCZOS)
+                frame.close()
+                yield result
+
+        return scaled()
+
+    def _encode_to_fit(
+        self,
+        image: Image.Image,
+        ops: tuple[FrameOp, ...],
+        frames: Optional[Iterator[Image.Image]],
+        formats: list[str],
+        *,
+        animated: bool,
+    ) -> Encoded:
+        best, best_scale, attempts, encode_time = None, 1.0, 0, 0.0
+
+        for step in self.FIT_STEPS:
+            scale, colors, quality = step
+
+            # Output size scales roughly with area, skip steps that can't get close enough
+            if (
+                best is not None
+                and step is not self.FIT_STEPS[-1]
+                and best.size * (scale / best_scale) ** 2 > self.max_bytes * 1.5
+            ):
+                continue
+
+            options = dict(colors=min(colors, self.colors), quality=min(quality, self.quality))
+
+            for fmt in formats:
+                # The first attempt uses the frames already on their way; later ones start over
+                if frames is None:
+                    frames = self._decode_again(image, ops, scale)
+
+                result = self._encode(frames, fmt, animated=animated, **options)
+                frames = None
+                attempts += 1
+                encode_time += result.encode_time
+
+                if best is None or result.size < best.size:
+                    if best is not None:
+                        best.stream.close()
+                    best, best_scale = result, scale
+                elif result is not best:
+                    result.stream.close()
+
+                if result.size <= self.max_bytes:
+                    return result._replace(attempts=attempts, encode_time=encode_time)
+
+            # Every format was tried at full quality, only the one that came out smallest is searched further
+            formats = [best.format]  # type: ignore
+
+        # Nothing fit, the caller decides what to do with the smallest result
+        return best._replace(attempts=attempts, encode_time=encode_time)  # type: ignore
+
+    def preview(self, image: Image.Image, ops: Iterable[FrameOp], /) -> Encoded:
+        """Runs only the first frame of an opened image through the operations and encodes it as a PNG.
+
+        Time taken is recorded as the ``preview`` stage. This blocks, and must not run at the same time
+        as :meth:`run` on the same image.
+        """
+        with self.timings.stage('preview'):
+            self._check()
+            image.seek(0)
+
+            frame = image
+            if frame.size != (size := self.output_size(image)):
+                frame = frame.resize(size)
+            frame = frame.convert('RGBA')
+
+            for op in ops:
+                frame = op(frame)
+
+            # Kept out of the encode stage, which is about the result
+            return encode_frames((frame,), [], 'png', animated=False, spool=self.spool_output, token=self.token)
+
+    def run(self, data: bytes | ImageData | Image.Image, ops: Iterable[FrameOp], /) -> Encoded:
+        """Decodes, processes and encodes the image. This blocks."""
+        image = data if isinstance(data, Image.Image) else self.open(data)
+        ops = tuple(ops)
+
+        try:
+            frames, animated = self._peek(self.frames(image, ops))
+            formats = negotiate_formats(self.formats, animated=animated)
+
+            if self.max_bytes is None:
+                return self._encode(frames, formats[0], animated=animated, colors=self.colors, quality=self.quality)
+
+            return self._encode_to_fit(image, ops, frames, formats, animated=animated)
+        finally:
+            if image is not data:
+                image.close()
+
+    async def render(
+        self,
+        data: bytes | ImageData | Image.Image,
+        ops: Iterable[FrameOp],
+        /,
+        *,
+        executor: Executor = None,
+    ) -> Encoded:
+        """Runs the pipeline in the given executor, or the event loop's default one."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, self.run, data, tuple(ops))
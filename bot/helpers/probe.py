@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+from typing import NamedTuple, Union
+
+from discord.ext.commands import BadArgument
+from PIL import Image, UnidentifiedImageError
+
+from .buffers import ImageData, open_stream
+
+__all__ = (
+    'ImageProbe',
+    'probe_image',
+)
+
+MAX_PIXELS = 4096 * 4096  # Per frame
+MAX_TOTAL_PIXELS = 500_000_000  # Over every frame, what decoding an animation costs
+
+
+class ImageProbe(NamedTuple):
+    """Cheap metadata about an image, read without decoding its pixel data."""
+    format: str
+    mode: str
+    width: int
+    height: int
+    frames: int
+
+    @property
+    def size(self) -> tuple[int, int]:
+        return self.width, self.height
+
+    @property
+    def animated(self) -> bool:
+        return self.frames > 1
+
+
+def probe_image(
+    data: Union[bytes, ImageData],
+    /,
+    *,
+    max_pixels: int = MAX_PIXELS,
+    max_total_pixels: int = MAX_TOTAL_PIXELS,
+) -> ImageProbe:
+    """Reads the format, mode, dimensions and frame count of the given image.
+
+    Images with frames larger than ``max_pixels``, or animations with more than ``max_total_pixels``
+    over all of their frames, are refused before anything is decoded.
+
+    This blocks (GIF frame counting has to walk the file), so run it in a thread.
+    """
+    try:
+        with Image.open(open_stream(data)) as image:
+            width, height = image.size
+            if width * height > max_pixels:
+                raise BadArgument(f'Image is too large to render. ({width:,}x{height:,} pixels)')
+
+            frames = getattr(image, 'n_frames', 1)
+            if width * height * frames > max_total_pixels:
+                raise BadArgument(
+                    f'Animation is too large to render. ({frames:,} frames of {width:,}x{height:,} pixels)'
+                )
+
+            return ImageProbe(image.format, image.mode, width, height, frames)
+    except Image.DecompressionBombError:
+        raise BadArgument('Image is too large to render.')
+    except (UnidentifiedImageError, OSError):
+        raise BadArgument('Could not read your image.')
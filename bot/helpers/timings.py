@@ -0,0 +1,44 @@
+from __future__ import annotations
+
+import time
+
+from contextlib import contextmanager
+from typing import Iterator
+
+__all__ = 'StageTimings',
+
+
+class StageTimings:
+    """Records how long each stage of a job took, in seconds.
+
+    Time spent in a stage that is entered more than once is summed up.
+    """
+
+    __slots__ = ('started', 'stages')
+
+    def __init__(self) -> None:
+        self.started: float = time.perf_counter()
+        self.stages: dict[str, float] = {}
+
+    def __iter__(self) -> Iterator[tuple[str, float]]:
+        return iter(self.stages.items())
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def add(self, stage: str, seconds: float, /) -> None:
+        self.stages[stage] = self.stages.get(stage, 0) + seconds
+
+    def merge(self, other: StageTimings, /) -> None:
+        """Adds the time spent in each stage of another job to this one."""
+        for stage, seconds in other:
+            self.add(stage, seconds)
+
+    @contextmanager
+    def stage(self, stage: str, /) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
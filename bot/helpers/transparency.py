@@ -2,13 +2,18 @@
 # This is a pretty rushed bot so I couldn't be bothered to do this myself
 # (as you can see this is not my code style at all)
 
+import time
+
 from PIL.Image import Image
 
 from collections import defaultdict
 from random import randrange
 from itertools import chain
 
-from typing import Union
+from typing import Iterable, Iterator, Optional, Union
+
+from .cancellation import CancellationToken
+from .timings import StageTimings
 
 __all__ = 'save_transparent_gif',
 
@@ -16,27 +21,28 @@ __all__ = 'save_transparent_gif',
 class TransparentAnimatedGifConverter:
     _PALETTE_SLOTSET = set(range(256))
 
-    def __init__(self, img_rgba: Image, alpha_threshold: int = 0) -> None:
+    def __init__(self, img_rgba: Image, alpha_threshold: int = 0, colors: int = 256) -> None:
         self._img_rgba = img_rgba
         self._alpha_threshold = alpha_threshold
+        self._colors = colors
 
         self._img_p = None
-        self._img_p_data = None
         self._palette_replaces = None
 
     def _process_pixels(self) -> None:
-        self._transparent_pixels = {
-            idx
-            for idx, alpha in enumerate(self._img_rgba.getchannel(channel='A').getdata())
-            if alpha <= self._alpha_threshold
-        }
+        # Masks instead of per-pixel Python sets and byte copies, Pillow does the work in C
+        alpha = self._img_rgba.getchannel(channel='A')
+        threshold = self._alpha_threshold
+
+        self._transparent_mask = alpha.point(lambda a: 255 if a <= threshold else 0, '1')
+        self._opaque_mask = alpha.point(lambda a: 0 if a <= threshold else 255, '1')
 
     def _set_parsed_palette(self) -> None:
         palette = self._img_p.getpalette()
         self._img_p_used_palette_idxs = {
             idx
-            for pal_idx, idx in enumerate(self._img_p_data)
-            if pal_idx not in self._transparent_pixels
+            for idx, count in enumerate(self._img_p.histogram(mask=self._opaque_mask))
+            if count
         }
 
         self._img_p_parsedpalette = {
@@ -89,16 +95,13 @@ class TransparentAnimatedGifConverter:
 
     def _adjust_pixels(self) -> None:
         if self._palette_replaces['idx_from']:
-            trans_table = bytearray.maketrans(
+            trans_table = bytes.maketrans(
                 bytes(self._palette_replaces['idx_from']),
                 bytes(self._palette_replaces['idx_to'])
             )
-            self._img_p_data = self._img_p_data.translate(trans_table)
-
-        for idx_pixel in self._transparent_pixels:
-            self._img_p_data[idx_pixel] = 0
+            self._img_p = self._img_p.point(list(trans_table))
 
-        self._img_p.frombytes(data=bytes(self._img_p_data))
+        self._img_p.paste(0, mask=self._transparent_mask)
 
     def _adjust_palette(self) -> None:
         unused_color = self._get_unused_color()
@@ -108,8 +111,7 @@ class TransparentAnimatedGifConverter:
         self._img_p.putpalette(data=final_palette)
 
     def process(self) -> Image:
-        self._img_p = self._img_rgba.convert(mode='P')
-        self._img_p_data = bytearray(self._img_p.tobytes())
+        self._img_p = self._img_rgba.convert(mode='P', colors=self._colors)
         self._palette_replaces = dict(idx_from=list(), idx_to=list())
         self._process_pixels()
         self._process_palette()
@@ -120,24 +122,58 @@ class TransparentAnimatedGifConverter:
         return self._img_p
 
 
-def _create_animated_gif(images: list[Image], durations: Union[int, list[int]]) -> tuple[Image, dict]:
-    save_kwargs = {}
-    new_images: list[Image] = []
+def _convert_frame(frame: Image, colors: int) -> Image:
+    # The converter only reads the RGBA frame, so it doesn't need a copy of its own
+    if frame.mode != 'RGBA':
+        frame = frame.convert(mode='RGBA')
+
+    converter = TransparentAnimatedGifConverter(img_rgba=frame, colors=colors)
+    return converter.process()
+
 
+def _convert_frames(
+    images: Iterable[Image],
+    colors: int,
+    token: Optional[CancellationToken],
+    timings: Optional[StageTimings],
+) -> Iterator[Image]:
+    # Frames are converted lazily as the encoder asks for them, so the encoder stops at the
+    # next frame once the token is cancelled
     for frame in images:
-        thumbnail = frame.copy()
-        thumbnail_rgba = thumbnail.convert(mode='RGBA')
-        thumbnail_rgba.thumbnail(size=frame.size, reducing_gap=3.0)
-        converter = TransparentAnimatedGifConverter(img_rgba=thumbnail_rgba)
-        thumbnail_p = converter.process()
-        new_images.append(thumbnail_p)
-
-    output_image = new_images[0]
+        if token is not None:
+            token.check()
+
+        if timings is None:
+            yield _convert_frame(frame, colors)
+            continue
+
+        with timings.stage('quantize'):
+            converted = _convert_frame(frame, colors)
+        yield converted
+
+
+def _create_animated_gif(
+    images: Iterable[Image],
+    durations: Union[int, list[int]],
+    colors: int,
+    token: Optional[CancellationToken],
+    timings: Optional[StageTimings],
+) -> tuple[Image, dict]:
+    save_kwargs = {}
+    images = iter(images)
+
+    first = next(images)
+    if timings is None:
+        output_image = _convert_frame(first, colors)
+    else:
+        with timings.stage('quantize'):
+            output_image = _convert_frame(first, colors)
+
     save_kwargs.update(
         format='GIF',
         save_all=True,
         optimize=False,
-        append_images=new_images[1:],
+        append_images=_convert_frames(images, colors, token, timings),
         duration=durations,
         disposal=2,  # Other disposals don't work
         loop=0
@@ -145,6 +181,30 @@ def _create_animated_gif(images: list[Image], durations: Union[int, list[int]])
     return output_image, save_kwargs
 
 
-def save_transparent_gif(images: list[Image], durations: Union[int, list[int]], save_file) -> None:
-    root_frame, save_args = _create_animated_gif(images, durations)
+def save_transparent_gif(
+    images: Iterable[Image],
+    durations: Union[int, list[int]],
+    save_file,
+    colors: int = 256,
+    token: CancellationToken = None,
+    timings: StageTimings = None,
+) -> None:
+    """Saves the given RGBA frames as a transparent GIF.
+
+    ``images`` may be a lazy iterable, frames are pulled from it as they are encoded. A
+    ``durations`` list only needs to hold a frame's duration by the time it is pulled.
+
+    If ``timings`` is given, time spent quantizing is recorded as the ``quantize`` stage
+    and the rest as the ``encode`` stage.
+    """
+    root_frame, save_args = _create_animated_gif(images, durations, colors, token, timings)
+
+    if timings is None:
+        return root_frame.save(save_file, **save_args)
+
+    before = sum(timings.stages.values())
+    start = time.perf_counter()
     root_frame.save(save_file, **save_args)
+
+    # Frames are quantized (and possibly produced) while the encoder runs, so take that time back out
+    timings.add('encode', time.perf_counter() - start - (sum(timings.stages.values()) - before))
@@ -1,4 +1,21 @@
+import argparse
+import logging
+
 from bot.core.bot import Photon
 
 if __name__ == '__main__':
-    Photon().run()
+    parser = argparse.ArgumentParser(description='Runs Photon.')
+    parser.add_argument(
+        '--clusters', type=int, default=1,
+        help='number of processes to split the shards across (default: run in this process)',
+    )
+    parser.add_argument('--shards', type=int, help='total shard count (default: what Discord recommends)')
+    args = parser.parse_args()
+
+    if args.clusters > 1:
+        from bot.core.cluster import Supervisor
+
+        logging.basicConfig(level=logging.INFO)
+        Supervisor(clusters=args.clusters, shard_count=args.shards).run()
+    else:
+        Photon(shard_count=args.shards).run()
@@ -0,0 +1,163 @@
+import asyncio
+import contextlib
+import io
+import time
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+
+from bot.core.bot import Photon
+from bot.core.degradation import DegradationPolicy
+from bot.core.errors import DeadlineExceeded, RenderCancelled
+from bot.core.memory import MemoryBudget
+from bot.core.metrics import Metrics
+from bot.core.ratelimit import CostLimiter
+from bot.core.scheduler import RenderScheduler
+from bot.extensions.generation import ImageGeneration
+from bot.helpers import ImageData, StageTimings
+from bot.helpers.cancellation import CancellationToken, Cancelled
+from bot.helpers.encoding import encode_frames
+from bot.helpers.pipeline import Pipeline
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class CountingToken(CancellationToken):
+    """Cancels itself once it has been checked ``limit`` times."""
+
+    __slots__ = ('checks', 'limit')
+
+    def __init__(self, limit: int = None) -> None:
+        super().__init__()
+        self.checks = 0
+        self.limit = limit
+
+    def check(self) -> None:
+        self.checks += 1
+        if self.limit is not None and self.checks >= self.limit:
+            self.cancel('test')
+
+        super().check()
+
+
+def animation(frames: int = 6) -> bytes:
+    images = [Image.new('RGB', (64, 48), (i * 40, 0, 0)) for i in range(frames)]
+
+    buffer = io.BytesIO()
+    images[0].save(buffer, 'GIF', save_all=True, append_images=images[1:], duration=40, loop=0)
+    return buffer.getvalue()
+
+
+def identity(frame: Image.Image) -> Image.Image:
+    return frame
+
+
+def test_pipeline_checks_its_token_for_every_frame():
+    token = CountingToken()
+    Pipeline(max_size=64, token=token).run(animation(6), [identity])
+
+    # At least once per frame while decoding, and once per frame while quantizing
+    assert token.checks >= 12
+
+
+def test_pipeline_stops_partway_once_cancelled():
+    token = CountingToken(limit=3)
+
+    with pytest.raises(Cancelled) as info:
+        Pipeline(max_size=64, token=token).run(animation(6), [identity])
+
+    assert info.value.reason == 'test'
+    assert token.checks == 3
+
+
+def test_quantizer_stops_at_the_next_frame_once_cancelled():
+    token = CancellationToken()
+    converted = []
+
+    def frames():
+        for i in range(6):
+            if i == 2:
+                token.cancel('test')
+            converted.append(i)
+            yield Image.new('RGBA', (32, 32), (i * 40, 0, 0, 255))
+
+    with pytest.raises(Cancelled):
+        encode_frames(frames(), [40] * 6, 'gif', animated=True, token=token)
+
+    assert len(converted) < 6
+
+
+def test_deadline_raises_deadline_exceeded_and_refunds_the_budget():
+    async def main():
+        scheduler = RenderScheduler(workers=1, max_queue=4, deadline=0.05)
+        scheduler.start(asyncio.get_running_loop())
+
+        limiter = CostLimiter(user_capacity=10, user_rate=1e-6, guild_capacity=10, guild_rate=1e-6)
+        cog = object.__new__(ImageGeneration)
+        cog.bot = SimpleNamespace(
+            limiter=limiter,
+            scheduler=scheduler,
+            memory=MemoryBudget(Metrics(), capacity=1 << 30, max_wait=1),
+            degradation=SimpleNamespace(quality=DegradationPolicy.LEVELS[0]),
+        )
+
+        async def slow_render(*_args, token, **_kwargs):
+            def work():
+                while True:
+                    time.sleep(0.005)
+                    token.check()
+
+            await token.run_in_thread(work)
+
+        cog._render_caption = slow_render
+
+        class Callback:
+            async def schedule(self, func, *args, **kwargs):
+                return await scheduler.submit(func, *args, guild_id=None, user_id=1, **kwargs)
+
+            def preview(self, _file):
+                pass
+
+        @contextlib.asynccontextmanager
+        async def processing():
+            yield Callback()
+
+        ctx = SimpleNamespace(
+            timings=StageTimings(), guild=None, author=SimpleNamespace(id=1), processing=processing,
+        )
+
+        buffer = io.BytesIO()
+        Image.new('RGB', (640, 480)).save(buffer, 'PNG')
+
+        try:
+            with pytest.raises(DeadlineExceeded):
+                await cog._caption(ctx, ImageData(buffer.getvalue()), 'caption')
+        finally:
+            await scheduler.close()
+
+        # The whole budget is back, so a job costing all of it is admitted again
+        limiter.acquire(10, user_id=1, guild_id=None)
+
+    run(main())
+
+
+def test_cancelling_by_deleting_the_message_is_silent():
+    async def main():
+        sent = []
+
+        async def send(content):
+            sent.append(content)
+
+        ctx = SimpleNamespace(send=send)
+        bot = SimpleNamespace(ERROR_EMOJI='!')
+
+        await Photon.on_command_error(bot, ctx, RenderCancelled(RenderCancelled.MESSAGE_DELETED))
+        assert not sent
+
+        await Photon.on_command_error(bot, ctx, DeadlineExceeded(60))
+        assert len(sent) == 1 and 'took too long' in sent[0]
+
+    run(main())
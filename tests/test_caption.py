@@ -0,0 +1,87 @@
+import pickle
+
+import pytest
+from PIL import Image
+
+from bot.caption import CaptionJob, find_jobs, render_job
+from bot.core.errors import OutputTooLarge
+
+
+def image(path, size=(64, 48)):
+    Image.new('RGB', size, (200, 40, 40)).save(path)
+    return path
+
+
+def test_directory_captions_come_from_sidecars_or_the_default(tmp_path):
+    image(tmp_path / 'a.png')
+    image(tmp_path / 'b.jpg')
+    (tmp_path / 'a.txt').write_text('own caption\n', encoding='utf-8')
+    (tmp_path / 'notes.md').write_text('not an image', encoding='utf-8')
+
+    assert find_jobs(tmp_path, text='default') == [
+        CaptionJob(tmp_path / 'a.png', 'own caption'),
+        CaptionJob(tmp_path / 'b.jpg', 'default'),
+    ]
+
+
+def test_every_image_needs_a_caption(tmp_path):
+    image(tmp_path / 'a.png')
+
+    with pytest.raises(ValueError, match='No caption'):
+        find_jobs(tmp_path)
+
+
+def test_manifest_paths_are_relative_to_it(tmp_path):
+    (tmp_path / 'images').mkdir()
+    image(tmp_path / 'images' / 'a.png')
+    image(tmp_path / 'images' / 'b.png')
+    (tmp_path / 'images' / 'b.txt').write_text('sidecar', encoding='utf-8')
+
+    manifest = tmp_path / 'manifest.csv'
+    manifest.write_text('path,text\nimages/a.png,from the manifest\nimages/b.png,\n', encoding='utf-8')
+
+    assert find_jobs(manifest) == [
+        CaptionJob(tmp_path / 'images' / 'a.png', 'from the manifest'),
+        CaptionJob(tmp_path / 'images' / 'b.png', 'sidecar'),
+    ]
+
+
+def test_sources_must_have_distinct_file_names(tmp_path):
+    for directory in ('one', 'two'):
+        (tmp_path / directory).mkdir()
+        image(tmp_path / directory / 'a.png')
+
+    manifest = tmp_path / 'manifest.csv'
+    manifest.write_text('path,text\none/a.png,x\ntwo/a.png,y\n', encoding='utf-8')
+
+    with pytest.raises(ValueError, match='same file name'):
+        find_jobs(manifest)
+
+
+def test_outputs_keep_the_source_suffix(tmp_path):
+    output = tmp_path / 'out'
+    output.mkdir()
+
+    results = [
+        render_job(CaptionJob(image(tmp_path / name), 'caption'), output, {})
+        for name in ('a.png', 'a.jpg')
+    ]
+
+    assert [result.output.name for result in results] == ['a.png.png', 'a.jpg.png']
+    assert all(result.output.stat().st_size == result.size for result in results)
+
+
+def test_outputs_over_the_limit_fail_without_being_written(tmp_path):
+    output = tmp_path / 'out'
+    output.mkdir()
+    job = CaptionJob(image(tmp_path / 'a.png', size=(400, 300)), 'caption')
+
+    with pytest.raises(OutputTooLarge) as info:
+        render_job(job, output, {'max_bytes': 64})
+
+    assert info.value.limit == 64
+    assert not any(output.iterdir())
+
+    # Raised in worker processes, so it has to make it back to the parent
+    error = pickle.loads(pickle.dumps(info.value))
+    assert (error.size, error.limit, str(error)) == (info.value.size, 64, str(info.value))
@@ -0,0 +1,47 @@
+from bot.core.cluster import Supervisor, split_shards
+from bot.core.metrics import Metrics
+
+
+def test_split_shards_into_contiguous_even_ranges():
+    assert split_shards(10, 3) == [[0, 1, 2, 3], [4, 5, 6], [7, 8, 9]]
+    assert split_shards(4, 4) == [[0], [1], [2], [3]]
+    assert split_shards(1, 1) == [[0]]
+
+
+def test_split_shards_covers_every_shard_once():
+    for shard_count in range(1, 40):
+        for clusters in range(1, shard_count + 1):
+            ranges = split_shards(shard_count, clusters)
+            sizes = {len(shards) for shards in ranges}
+
+            assert len(ranges) == clusters
+            assert sum(ranges, []) == list(range(shard_count))
+            assert max(sizes) - min(sizes) <= 1
+
+
+def test_relabel_merges_clusters_under_one_family():
+    metrics = Metrics()
+    metrics.counter('photon_commands_total', 'Commands run').inc(3, command='caption')
+    metrics.gauge('photon_render_queue_depth', 'Render jobs waiting').set(2)
+    text = metrics.render()
+
+    families = {}
+    Supervisor._relabel(text, 0, families)
+    Supervisor._relabel(text, 1, families)
+
+    commands = families['photon_commands_total']
+    assert sum(line.startswith('# TYPE') for line in commands) == 1
+    assert sum(line.startswith('# HELP') for line in commands) == 1
+    assert 'photon_commands_total{cluster="0",command="caption"} 3' in commands
+    assert 'photon_commands_total{cluster="1",command="caption"} 3' in commands
+
+    queue = families['photon_render_queue_depth']
+    assert 'photon_render_queue_depth{cluster="0"} 2' in queue
+    assert 'photon_render_queue_depth{cluster="1"} 2' in queue
+
+
+def test_relabel_skips_lines_it_cannot_parse():
+    families = {}
+    Supervisor._relabel('# TYPE up gauge\nup 1\nnot a sample\n\n', 2, families)
+
+    assert families == {'up': ['# TYPE up gauge', 'up{cluster="2"} 1']}
@@ -0,0 +1,128 @@
+from types import SimpleNamespace
+
+import discord
+import pytest
+
+from bot.helpers import finder
+from bot.helpers.finder import ConversionCache
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(finder, 'time', SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+def user(user_id: int = 5, avatar: str = None) -> discord.User:
+    return discord.User(
+        state=None, data={'id': str(user_id), 'username': 'someone', 'discriminator': '0', 'avatar': avatar},
+    )
+
+
+def emoji(emoji_id: int = 7, guild_id: int = 1) -> discord.Emoji:
+    return discord.Emoji(
+        guild=SimpleNamespace(id=guild_id),
+        state=None,
+        data={'id': str(emoji_id), 'name': 'blob', 'require_colons': True, 'managed': False, 'animated': False},
+    )
+
+
+def test_entries_expire(clock):
+    cache = ConversionCache(ttl=300, miss_ttl=60)
+    member, blob = user(), emoji()
+
+    cache.put(1, 'someone', member)
+    cache.put(1, 'blob', blob)
+    cache.put(1, 'nobody', 'nobody')
+
+    clock.now += 59
+    assert cache.get(1, 'someone') is member
+    assert cache.get(1, 'nobody') == 'nobody'
+
+    clock.now += 1
+    assert cache.get(1, 'nobody') is None
+    assert cache.get(1, 'blob') is blob
+
+    clock.now += 240
+    assert cache.get(1, 'someone') is None
+    assert cache.get(1, 'blob') is None
+    assert len(cache) == 0
+
+
+def test_member_ttl(clock):
+    cache = ConversionCache(ttl=300, member_ttl=10)
+    cache.put(1, 'someone', user())
+    cache.put(1, 'blob', emoji())
+
+    clock.now += 10
+    assert cache.get(1, 'someone') is None
+    assert cache.get(1, 'blob') is not None
+
+
+def test_entries_are_per_guild(clock):
+    cache = ConversionCache()
+    cache.put(1, 'someone', user(5))
+    cache.put(None, 'someone', user(6))
+
+    assert cache.get(1, 'someone').id == 5
+    assert cache.get(None, 'someone').id == 6
+    assert cache.get(2, 'someone') is None
+
+
+def test_least_recently_used_are_evicted(clock):
+    cache = ConversionCache(max_size=2)
+    cache.put(1, 'a', 'a')
+    cache.put(1, 'b', 'b')
+
+    # Looking an entry up makes it the most recently used
+    assert cache.get(1, 'a') == 'a'
+    cache.put(1, 'c', 'c')
+
+    assert len(cache) == 2
+    assert cache.get(1, 'b') is None
+    assert cache.get(1, 'a') == 'a'
+    assert cache.get(1, 'c') == 'c'
+
+
+def test_invalidating_a_member(clock):
+    cache = ConversionCache()
+    cache.put(1, 'someone', user(5))
+    cache.put(2, '<@5>', user(5))
+    cache.put(1, 'other', user(6))
+
+    cache.invalidate_member(5)
+
+    assert cache.get(1, 'someone') is None
+    assert cache.get(2, '<@5>') is None
+    assert cache.get(1, 'other') is not None
+
+
+def test_invalidating_emojis(clock):
+    cache = ConversionCache()
+    cache.put(1, 'blob', emoji(7, guild_id=1))
+    cache.put(2, 'blob', emoji(8, guild_id=2))
+
+    cache.invalidate_emojis(1)
+
+    assert cache.get(1, 'blob') is None
+    assert cache.get(2, 'blob') is not None
+
+
+def test_changed_avatar_drops_the_member(clock):
+    cache = ConversionCache()
+    member = user(5, 'a' * 32)
+    cache.put(1, 'someone', member)
+
+    assert cache.get(1, 'someone', lookup_member=lambda _: None) is member
+    assert cache.get(1, 'someone', lookup_member=lambda user_id: user(user_id, 'a' * 32)) is member
+    assert cache.get(1, 'someone', lookup_member=lambda user_id: user(user_id, 'b' * 32)) is None
+    assert len(cache) == 0
@@ -0,0 +1,86 @@
+from types import SimpleNamespace
+
+import pytest
+
+from bot.core import degradation
+from bot.core.degradation import DegradationPolicy
+from bot.core.metrics import Metrics
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(degradation, 'time', SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+def policy(scheduler) -> DegradationPolicy:
+    return DegradationPolicy(scheduler, Metrics(), degrade_at=2, recover_at=0.5, interval=10)
+
+
+def load(scheduler, *, queued: int, active: int) -> None:
+    scheduler.queued = queued
+    scheduler.utilization = active / scheduler.workers
+
+
+def test_degrades_one_step_per_interval_under_sustained_load(clock):
+    scheduler = SimpleNamespace(workers=4, queued=0, utilization=0)
+    quality = policy(scheduler)
+    load(scheduler, queued=8, active=4)
+
+    assert quality.evaluate() == DegradationPolicy.LEVELS[1]
+
+    # A single burst doesn't take it further
+    clock.now += 5
+    assert quality.evaluate() == DegradationPolicy.LEVELS[1]
+
+    clock.now += 5
+    assert quality.evaluate() == DegradationPolicy.LEVELS[2]
+
+    for _ in range(5):
+        clock.now += 10
+        quality.evaluate()
+
+    assert quality.level == len(DegradationPolicy.LEVELS) - 1
+
+
+def test_backlog_alone_does_not_degrade_while_workers_are_idle(clock):
+    scheduler = SimpleNamespace(workers=4, queued=0, utilization=0)
+    quality = policy(scheduler)
+    load(scheduler, queued=8, active=3)
+
+    assert quality.evaluate() == DegradationPolicy.LEVELS[0]
+
+
+def test_recovers_only_once_the_backlog_falls_below_recover_at(clock):
+    scheduler = SimpleNamespace(workers=4, queued=0, utilization=0)
+    quality = policy(scheduler)
+    load(scheduler, queued=8, active=4)
+    quality.evaluate()
+    clock.now += 10
+    quality.evaluate()
+    assert quality.level == 2
+
+    # Between the two thresholds, the level holds
+    load(scheduler, queued=4, active=4)
+    clock.now += 10
+    assert quality.evaluate() == DegradationPolicy.LEVELS[2]
+
+    load(scheduler, queued=2, active=4)
+    clock.now += 10
+    assert quality.evaluate() == DegradationPolicy.LEVELS[1]
+
+    # Recovering is paced like degrading
+    clock.now += 1
+    assert quality.evaluate() == DegradationPolicy.LEVELS[1]
+
+    clock.now += 9
+    assert quality.evaluate() == DegradationPolicy.LEVELS[0]
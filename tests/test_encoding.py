@@ -0,0 +1,80 @@
+import io
+
+import pytest
+from PIL import Image, features
+
+from bot.features.ifunny_caption import IFunnyCaption
+from bot.helpers import encoding
+from bot.helpers.encoding import encode_frames, negotiate_formats
+from bot.helpers.pipeline import Pipeline
+
+
+@pytest.fixture
+def without_webp(monkeypatch):
+    monkeypatch.setattr(encoding.features, 'check', lambda feature: not feature.startswith('webp'))
+
+
+def frames(count: int = 4) -> list[Image.Image]:
+    return [Image.new('RGBA', (48, 32), (i * 60, 0, 255 - i * 60, 255)) for i in range(count)]
+
+
+def animation(count: int = 4) -> bytes:
+    images = [frame.convert('RGB') for frame in frames(count)]
+
+    buffer = io.BytesIO()
+    images[0].save(buffer, 'GIF', save_all=True, append_images=images[1:], duration=40, loop=0)
+    return buffer.getvalue()
+
+
+def identity(frame: Image.Image) -> Image.Image:
+    return frame
+
+
+@pytest.mark.skipif(not features.check('webp_anim'), reason='Pillow was built without WebP')
+def test_negotiation_keeps_supported_formats_in_order():
+    assert negotiate_formats(IFunnyCaption.FORMATS, animated=True) == ['gif', 'webp', 'apng']
+    assert negotiate_formats(IFunnyCaption.FORMATS, animated=False) == ['png', 'webp']
+    assert negotiate_formats(('webp', 'gif'), animated=True) == ['webp', 'gif']
+
+
+def test_negotiation_drops_webp_when_pillow_cannot_encode_it(without_webp):
+    assert negotiate_formats(IFunnyCaption.FORMATS, animated=True) == ['gif', 'apng']
+    assert negotiate_formats(IFunnyCaption.FORMATS, animated=False) == ['png']
+
+
+def test_negotiation_falls_back_to_gif_or_png(without_webp):
+    assert negotiate_formats(('webp',), animated=True) == ['gif']
+    assert negotiate_formats(('webp', 'apng'), animated=False) == ['png']
+
+
+def test_encodes_apng_with_every_frame():
+    result = encode_frames(frames(4), [40] * 4, 'apng', animated=True)
+
+    assert result.extension == 'png'
+    with Image.open(result.stream) as image:
+        assert image.format == 'PNG'
+        assert image.n_frames == 4
+
+
+@pytest.mark.skipif(not features.check('webp_anim'), reason='Pillow was built without WebP')
+def test_encodes_animated_webp():
+    result = encode_frames(frames(4), [40] * 4, 'webp', animated=True)
+
+    assert result.extension == 'webp'
+    with Image.open(result.stream) as image:
+        assert image.format == 'WEBP'
+        assert image.n_frames == 4
+
+
+def test_fitting_tries_apng_when_webp_is_unavailable(without_webp, monkeypatch):
+    tried = []
+    encode = Pipeline._encode
+
+    def recording(self, frames, fmt, **kwargs):
+        tried.append(fmt)
+        return encode(self, frames, fmt, **kwargs)
+
+    monkeypatch.setattr(Pipeline, '_encode', recording)
+    Pipeline(max_size=48, formats=IFunnyCaption.FORMATS, max_bytes=1).run(animation(), [identity])
+
+    assert tried[:2] == ['gif', 'apng']
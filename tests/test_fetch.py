@@ -0,0 +1,135 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+
+from bot.core.fetch import FetchClient
+from bot.core.metrics import Metrics
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def client(**options) -> FetchClient:
+    options = dict(
+        pool_size=8,
+        per_host=4,
+        discord_per_host=8,
+        keepalive=5.0,
+        dns_ttl=60,
+        pool_timeout=1.0,
+        connect_timeout=1.0,
+        read_timeout=1.0,
+        total_timeout=5.0,
+        retries=2,
+    ) | options
+
+    client = FetchClient(Metrics(), **options)
+    client._backoff = lambda attempt: 0.01  # No need to wait long between attempts here
+    return client
+
+
+async def serve(handler) -> tuple[web.AppRunner, str]:
+    app = web.Application()
+    app.router.add_get('/image', handler)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    return runner, f'http://127.0.0.1:{port}/image'
+
+
+def statuses(*codes: int):
+    remaining = list(codes)
+    calls = []
+
+    async def handler(_request):
+        calls.append(None)
+        return web.Response(status=remaining.pop(0) if remaining else 200, body=b'image')
+
+    return handler, calls
+
+
+def test_retries_transient_statuses():
+    async def main():
+        handler, calls = statuses(503, 502)
+        runner, url = await serve(handler)
+        fetcher = client()
+
+        try:
+            async with fetcher.get(url) as response:
+                assert response.status == 200
+                assert await response.read() == b'image'
+        finally:
+            await fetcher.close()
+            await runner.cleanup()
+
+        assert len(calls) == 3
+        assert fetcher.external.in_use == 0
+
+    run(main())
+
+
+def test_returns_the_last_response_once_out_of_retries():
+    async def main():
+        handler, calls = statuses(503, 503, 503, 503)
+        runner, url = await serve(handler)
+        fetcher = client(retries=1)
+
+        try:
+            async with fetcher.get(url) as response:
+                assert response.status == 503
+        finally:
+            await fetcher.close()
+            await runner.cleanup()
+
+        assert len(calls) == 2
+
+    run(main())
+
+
+def test_does_not_retry_other_errors():
+    async def main():
+        handler, calls = statuses(404)
+        runner, url = await serve(handler)
+        fetcher = client()
+
+        try:
+            async with fetcher.get(url) as response:
+                assert response.status == 404
+        finally:
+            await fetcher.close()
+            await runner.cleanup()
+
+        assert len(calls) == 1
+
+    run(main())
+
+
+def test_total_timeout_covers_every_attempt():
+    async def main():
+        async def slow(_request):
+            await asyncio.sleep(0.3)
+            return web.Response(status=503)
+
+        runner, url = await serve(slow)
+        fetcher = client(total_timeout=0.5, retries=5)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+
+        try:
+            with pytest.raises(asyncio.TimeoutError):
+                async with fetcher.get(url):
+                    pass
+        finally:
+            await fetcher.close()
+            await runner.cleanup()
+
+        assert loop.time() - start < 1.0
+
+    run(main())
@@ -0,0 +1,97 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from discord.ext import commands
+
+from bot.extensions.generation import ExplicitImageQuery
+from bot.helpers import ImageData, ImageFinder
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def context(*attachments) -> SimpleNamespace:
+    return SimpleNamespace(message=SimpleNamespace(attachments=list(attachments)), bot=SimpleNamespace(fetcher=None))
+
+
+def test_batch_needs_at_least_one_image():
+    with pytest.raises(commands.BadArgument, match='No attachments'):
+        run(ImageFinder().find_many(context()))
+
+
+def test_batch_counts_queries_and_attachments_together():
+    finder = ImageFinder(max_batch=3)
+
+    with pytest.raises(commands.BadArgument, match=r'Too many images\. \(4 > 3\)'):
+        run(finder.find_many(context(object(), object()), [b'a', b'b']))
+
+
+def test_batch_returns_every_image_in_order():
+    images = run(ImageFinder(max_batch=3).find_many(context(), [b'one', b'two', b'three']))
+
+    assert [image.view().tobytes() for image in images] == [b'one', b'two', b'three']
+
+
+def test_batch_may_not_be_too_large_together(monkeypatch):
+    closed = []
+    close = ImageData.close
+
+    def recording(self):
+        closed.append(self)
+        close(self)
+
+    monkeypatch.setattr(ImageData, 'close', recording)
+    finder = ImageFinder(max_size=100, max_batch_size=150)
+
+    with pytest.raises(commands.BadArgument, match='too large together'):
+        run(finder.find_many(context(), [b'x' * 80, b'y' * 80]))
+
+    # Each image was within max_size, and none of them is left open
+    assert len(closed) == 2
+
+
+class Converter:
+    def __init__(self) -> None:
+        self.member = SimpleNamespace(id=1)
+        self.queries = []
+
+    async def convert(self, _ctx, text):
+        # Resolves any text, like a guild with members and emojis named after every word
+        self.queries.append(text)
+        return self.member
+
+
+def explicit(argument: str, finder: Converter):
+    return run(ExplicitImageQuery().convert(SimpleNamespace(cog=SimpleNamespace(finder=finder)), argument))
+
+
+def test_batch_queries_must_be_explicit():
+    finder = Converter()
+
+    for word in ('hello', 'blob', ':blob:', '<@hello>'):
+        with pytest.raises(commands.BadArgument):
+            explicit(word, finder)
+
+    assert not finder.queries
+
+
+def test_batch_queries_accept_mentions_custom_emojis_and_links():
+    finder = Converter()
+
+    assert explicit('<@123456789012345678>', finder) is finder.member
+    assert explicit('<@!123456789012345678>', finder) is finder.member
+    assert explicit('<a:blob:123456789012345678>', finder) is finder.member
+    assert explicit('https://example.com/a.png', finder) == 'https://example.com/a.png'
+    assert explicit('<https://example.com/a.png>', finder) == '<https://example.com/a.png>'
+
+    assert len(finder.queries) == 3
+
+
+def test_batch_mentions_that_resolve_to_nothing_are_not_images():
+    finder = Converter()
+    finder.member = '<@123456789012345678>'
+
+    with pytest.raises(commands.BadArgument):
+        explicit('<@123456789012345678>', finder)
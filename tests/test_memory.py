@@ -0,0 +1,166 @@
+import asyncio
+
+import pytest
+
+from bot.core.errors import RenderBusy, RenderTooLarge
+from bot.core.memory import MemoryBudget
+from bot.core.metrics import Metrics
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def budget(*, capacity: int = 100, max_wait: float = 1.0) -> MemoryBudget:
+    return MemoryBudget(Metrics(), capacity=capacity, max_wait=max_wait)
+
+
+def test_reserves_and_releases():
+    async def main():
+        memory = budget()
+
+        async with memory.reserve(60):
+            assert memory.reserved == 60
+            assert memory.available == 40
+
+        assert memory.reserved == 0
+
+    run(main())
+
+
+def test_rejects_what_could_never_fit():
+    async def main():
+        memory = budget()
+
+        with pytest.raises(RenderTooLarge):
+            async with memory.reserve(101):
+                pass
+
+        assert memory.reserved == 0
+
+    run(main())
+
+
+def test_waiters_are_served_in_order():
+    async def main():
+        memory = budget()
+        order = []
+
+        async def render(name, size, hold):
+            async with memory.reserve(size):
+                order.append(name)
+                await hold.wait()
+
+        first, large, small = asyncio.Event(), asyncio.Event(), asyncio.Event()
+        large.set()
+        small.set()
+
+        holder = asyncio.ensure_future(render('first', 60, first))
+        await asyncio.sleep(0)
+        waiting_large = asyncio.ensure_future(render('large', 80, large))
+        await asyncio.sleep(0)
+        # Would fit right now, but mustn't jump ahead of the render already waiting
+        waiting_small = asyncio.ensure_future(render('small', 10, small))
+        await asyncio.sleep(0)
+
+        assert memory.waiting == 2
+        assert order == ['first']
+
+        first.set()
+        await asyncio.gather(holder, waiting_large, waiting_small)
+
+        assert order == ['first', 'large', 'small']
+        assert memory.reserved == 0
+
+    run(main())
+
+
+def test_gives_up_after_max_wait():
+    async def main():
+        memory = budget(max_wait=0.05)
+        hold = asyncio.Event()
+
+        async def holder():
+            async with memory.reserve(100):
+                await hold.wait()
+
+        task = asyncio.ensure_future(holder())
+        await asyncio.sleep(0)
+
+        with pytest.raises(RenderBusy):
+            async with memory.reserve(10):
+                pass
+
+        assert memory.waiting == 0
+        hold.set()
+        await task
+        assert memory.reserved == 0
+
+    run(main())
+
+
+def test_cancelled_waiter_lets_the_next_one_through():
+    async def main():
+        memory = budget()
+        hold = asyncio.Event()
+
+        async def holder():
+            async with memory.reserve(60):
+                await hold.wait()
+
+        async def waiter(size):
+            async with memory.reserve(size):
+                return size
+
+        task = asyncio.ensure_future(holder())
+        await asyncio.sleep(0)
+        blocked = asyncio.ensure_future(waiter(80))
+        await asyncio.sleep(0)
+        behind = asyncio.ensure_future(waiter(30))
+        await asyncio.sleep(0)
+
+        blocked.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await blocked
+
+        # With the large waiter gone, the small one fits next to the holder
+        assert await asyncio.wait_for(behind, 1) == 30
+
+        hold.set()
+        await task
+        assert memory.reserved == 0
+        assert memory.waiting == 0
+
+    run(main())
+
+
+def test_cancelled_after_being_granted_releases():
+    async def main():
+        memory = budget()
+        hold = asyncio.Event()
+
+        async def holder():
+            async with memory.reserve(60):
+                await hold.wait()
+
+        async def waiter():
+            async with memory.reserve(80):
+                pass
+
+        task = asyncio.ensure_future(holder())
+        await asyncio.sleep(0)
+        waiting = asyncio.ensure_future(waiter())
+        await asyncio.sleep(0)
+
+        # The reservation is granted, but the waiter is cancelled before it wakes up to use it
+        hold.set()
+        await task
+        assert memory.reserved == 80
+        waiting.cancel()
+
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+
+        assert memory.reserved == 0
+
+    run(main())
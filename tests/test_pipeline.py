@@ -0,0 +1,53 @@
+import io
+import os
+import random
+
+from PIL import Image
+
+from bot.helpers.pipeline import Pipeline
+
+
+def noisy_animation(frames: int = 8, size: tuple[int, int] = (160, 120), duration: int = 50) -> bytes:
+    # Noise compresses badly, so the output has to be shrunk to fit
+    rng = random.Random(0)
+    images = [Image.frombytes('RGB', size, rng.randbytes(size[0] * size[1] * 3)) for _ in range(frames)]
+
+    buffer = io.BytesIO()
+    images[0].save(buffer, 'GIF', save_all=True, append_images=images[1:], duration=duration, loop=0)
+    return buffer.getvalue()
+
+
+def identity(frame: Image.Image) -> Image.Image:
+    return frame
+
+
+def test_runs_without_a_size_limit():
+    result = Pipeline(max_size=160).run(noisy_animation(), [identity])
+
+    assert result.format == 'gif'
+    assert result.attempts == 1
+
+
+def test_fits_the_output_into_max_bytes():
+    data = noisy_animation()
+    unlimited = Pipeline(max_size=160).run(data, [identity])
+    max_bytes = unlimited.size // 3
+
+    pipeline = Pipeline(max_size=160, formats=('gif', 'webp'), max_bytes=max_bytes)
+    result = pipeline.run(data, [identity])
+
+    assert result.size <= max_bytes
+    assert result.attempts > 1
+
+    # Starting over for a later attempt doesn't lose or duplicate frame durations
+    assert pipeline.durations == [50] * 8
+
+    result.stream.seek(0, os.SEEK_END)
+    assert result.stream.tell() == result.size
+
+
+def test_returns_the_smallest_attempt_when_nothing_fits():
+    result = Pipeline(max_size=160, formats=('gif',), max_bytes=1).run(noisy_animation(), [identity])
+
+    assert result.size > 1
+    assert result.attempts > 1
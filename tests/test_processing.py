@@ -0,0 +1,152 @@
+import asyncio
+import contextlib
+import io
+from types import SimpleNamespace
+
+import discord
+
+from bot.helpers import StageTimings
+from bot.helpers.context_managers import Processing
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class Message:
+    def __init__(self, *, delay: float = 0.0) -> None:
+        self.delay = delay
+        self.edits = []
+        self.deleted = False
+
+    async def edit(self, *, content, attachments=None, **_) -> None:
+        await asyncio.sleep(self.delay)
+        self.edits.append(content if content is not None else 'result')
+
+    async def delete(self, *, delay=None) -> None:
+        self.deleted = True
+
+
+class Context:
+    def __init__(self, message: Message) -> None:
+        self.progress = message
+        self.sent = []
+        self.typed = False
+        self.timings = StageTimings()
+        self.message = SimpleNamespace(id=1, created_at=None)
+        self.author = SimpleNamespace(id=1, avatar=None)
+
+    async def reply(self, _content) -> Message:
+        return self.progress
+
+    @contextlib.asynccontextmanager
+    async def typing(self):
+        self.typed = True
+        yield
+
+    async def send(self, **kwargs) -> None:
+        self.sent.append(kwargs)
+
+
+def file(name: str = 'result.png') -> discord.File:
+    return discord.File(io.BytesIO(b'image'), filename=name)
+
+
+async def processing(message: Message, **kwargs) -> tuple[Context, Processing]:
+    ctx = Context(message)
+    progress = Processing(ctx, **kwargs)
+    progress.POSITION_EDIT_INTERVAL = 0.05
+    await progress.__aenter__()
+    return ctx, progress
+
+
+def test_queue_positions_are_throttled_but_processing_is_shown_right_away():
+    async def main():
+        message = Message()
+        _, progress = await processing(message)
+
+        await progress._on_position(3)
+        await asyncio.sleep(0)
+        await progress._on_position(2)
+        await progress._on_position(1)
+        await asyncio.sleep(0.01)
+        await progress._on_position(0)
+        await asyncio.sleep(0.1)
+
+        assert message.edits == [f'{Processing.EMOJI} Queued (position 3)...', f'{Processing.EMOJI} Processing...']
+
+    run(main())
+
+
+def test_nothing_edits_the_message_after_the_result():
+    async def main():
+        message = Message()
+        _, progress = await processing(message)
+
+        await progress._on_position(2)
+        await asyncio.sleep(0)
+        await progress._on_position(1)  # Waiting out the throttle when the result arrives
+
+        await progress(file())
+        await progress._on_position(0)
+        progress.preview(file('preview.png'))
+        await progress.__aexit__(None, None, None)
+        await asyncio.sleep(0.1)
+
+        assert message.edits[-1] == 'result'
+        assert message.edits.count('result') == 1
+        assert not message.deleted
+
+    run(main())
+
+
+def test_preview_is_shown_before_the_result():
+    async def main():
+        message = Message(delay=0.01)
+        ctx, progress = await processing(message)
+
+        progress.preview(file('preview.png'))
+        progress.preview(file('second.png'))  # Only the first preview is shown
+        await asyncio.sleep(0.05)
+
+        await progress(file())
+        await progress.__aexit__(None, None, None)
+
+        assert message.edits == [f'{Processing.EMOJI} Rendering the rest...', 'result']
+        assert ctx.first_response < ctx.final_response
+
+    run(main())
+
+
+def test_preview_still_in_flight_does_not_overwrite_the_result():
+    async def main():
+        message = Message(delay=0.05)
+        ctx, progress = await processing(message)
+
+        progress.preview(file('preview.png'))
+        await asyncio.sleep(0)
+        await progress(file())
+        await progress.__aexit__(None, None, None)
+        await asyncio.sleep(0.1)
+
+        assert message.edits == ['result']
+        assert ctx.first_response == ctx.final_response
+
+    run(main())
+
+
+def test_without_editing_in_place_the_result_is_sent_and_progress_deleted():
+    async def main():
+        message = Message()
+        ctx, progress = await processing(message, edit_in_place=False)
+
+        progress.preview(file('preview.png'))
+        await progress(file())
+        await progress.__aexit__(None, None, None)
+
+        assert not message.edits
+        assert len(ctx.sent) == 1
+        assert message.deleted
+        assert ctx.typed
+
+    run(main())
@@ -0,0 +1,98 @@
+from types import SimpleNamespace
+
+import pytest
+
+from bot.core import ratelimit
+from bot.core.errors import BudgetExceeded
+from bot.core.ratelimit import CostLimiter, TokenBucket
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit, 'time', SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+def test_bucket_refills_over_time(clock):
+    bucket = TokenBucket(10, 2)
+    bucket.consume(10)
+
+    assert bucket.retry_after(4) == pytest.approx(2)
+    clock.now += 1
+    assert bucket.retry_after(4) == pytest.approx(1)
+    clock.now += 1
+    assert bucket.retry_after(4) == 0
+
+
+def test_bucket_never_overfills(clock):
+    bucket = TokenBucket(10, 2)
+    clock.now += 100
+
+    assert bucket.tokens <= 10
+    assert bucket.full
+    bucket.refund(5)
+    assert bucket.tokens == 10
+
+
+def test_full_bucket_admits_a_job_costing_more_than_its_capacity(clock):
+    bucket = TokenBucket(10, 1)
+
+    assert bucket.retry_after(50) == 0
+    bucket.consume(50)
+    assert bucket.tokens == 0
+    assert bucket.retry_after(50) == pytest.approx(10)
+
+
+def test_limiter_charges_user_and_guild(clock):
+    limiter = CostLimiter(user_capacity=10, user_rate=1, guild_capacity=15, guild_rate=1)
+
+    assert limiter.acquire(6, user_id=1, guild_id=1) == 6
+    with pytest.raises(BudgetExceeded) as info:
+        limiter.acquire(6, user_id=1, guild_id=1)
+    assert info.value.scope == 'user'
+
+    # Another user of the same guild is only limited by what the guild has left
+    limiter.acquire(6, user_id=2, guild_id=1)
+    with pytest.raises(BudgetExceeded) as info:
+        limiter.acquire(6, user_id=3, guild_id=1)
+    assert info.value.scope == 'guild'
+
+
+def test_rejected_jobs_are_not_charged(clock):
+    limiter = CostLimiter(user_capacity=10, user_rate=1, guild_capacity=5, guild_rate=1)
+
+    limiter.acquire(5, user_id=1, guild_id=1)
+    with pytest.raises(BudgetExceeded):
+        limiter.acquire(5, user_id=1, guild_id=1)
+
+    # The user's bucket wasn't charged for the job the guild's rejected
+    limiter.acquire(5, user_id=1, guild_id=2)
+
+
+def test_minimum_cost_and_refunds(clock):
+    limiter = CostLimiter(user_capacity=3, user_rate=1, guild_capacity=100, guild_rate=1, minimum_cost=1)
+
+    assert limiter.acquire(0.01, user_id=1, guild_id=None) == 1
+    cost = limiter.acquire(2, user_id=1, guild_id=None)
+    with pytest.raises(BudgetExceeded):
+        limiter.acquire(1, user_id=1, guild_id=None)
+
+    limiter.refund(cost, user_id=1, guild_id=None)
+    limiter.acquire(2, user_id=1, guild_id=None)
+
+
+def test_rates_must_be_positive():
+    with pytest.raises(ValueError):
+        TokenBucket(10, 0)
+
+    with pytest.raises(ValueError):
+        CostLimiter(user_capacity=10, user_rate=1, guild_capacity=10, guild_rate=0)
@@ -0,0 +1,248 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from bot.core.errors import DeadlineExceeded, QueueFull, RenderCancelled
+from bot.core.scheduler import RenderScheduler
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def started(*, workers: int = 1, max_queue: int = 16, deadline: float = 5.0) -> RenderScheduler:
+    scheduler = RenderScheduler(workers=workers, max_queue=max_queue, deadline=deadline)
+    scheduler.start(asyncio.get_running_loop())
+    return scheduler
+
+
+def test_runs_jobs_and_passes_a_token():
+    async def main():
+        scheduler = await started()
+
+        async def job(value, *, token):
+            token.check()
+            return value * 2
+
+        try:
+            assert await scheduler.submit(job, 21, guild_id=1, user_id=1) == 42
+            assert scheduler.active == 0
+        finally:
+            await scheduler.close()
+
+    run(main())
+
+
+def test_round_robin_across_guilds_and_users():
+    async def main():
+        scheduler = await started()
+        gate = asyncio.Event()
+        order = []
+
+        async def blocker(*, token):
+            await gate.wait()
+
+        async def job(name, *, token):
+            order.append(name)
+
+        try:
+            blocking = asyncio.ensure_future(scheduler.submit(blocker, guild_id=0, user_id=0))
+            await asyncio.sleep(0)
+
+            submissions = [
+                ('a1-1', 1, 1), ('a1-2', 1, 1), ('a1-3', 1, 1),
+                ('a2-1', 1, 2),
+                ('b3-1', 2, 3), ('b3-2', 2, 3),
+            ]
+            tasks = [
+                asyncio.ensure_future(scheduler.submit(job, name, guild_id=guild_id, user_id=user_id))
+                for name, guild_id, user_id in submissions
+            ]
+            await asyncio.sleep(0)
+
+            gate.set()
+            await asyncio.gather(blocking, *tasks)
+        finally:
+            await scheduler.close()
+
+        # Guilds take turns, and so do users within a guild
+        assert order == ['a1-1', 'b3-1', 'a2-1', 'b3-2', 'a1-2', 'a1-3']
+
+    run(main())
+
+
+def test_higher_priority_runs_first():
+    async def main():
+        scheduler = await started()
+        gate = asyncio.Event()
+        order = []
+
+        async def blocker(*, token):
+            await gate.wait()
+
+        async def job(name, *, token):
+            order.append(name)
+
+        try:
+            blocking = asyncio.ensure_future(scheduler.submit(blocker, guild_id=0, user_id=0))
+            await asyncio.sleep(0)
+
+            low = asyncio.ensure_future(scheduler.submit(job, 'low', guild_id=1, user_id=1))
+            high = asyncio.ensure_future(scheduler.submit(job, 'high', guild_id=2, user_id=2, priority=1))
+            await asyncio.sleep(0)
+
+            gate.set()
+            await asyncio.gather(blocking, low, high)
+        finally:
+            await scheduler.close()
+
+        assert order == ['high', 'low']
+
+    run(main())
+
+
+def test_rejects_submissions_once_the_queue_is_full():
+    async def main():
+        scheduler = await started(max_queue=2)
+        gate = asyncio.Event()
+
+        async def blocker(*, token):
+            await gate.wait()
+
+        try:
+            running = asyncio.ensure_future(scheduler.submit(blocker, guild_id=1, user_id=1))
+            await asyncio.sleep(0)
+            queued = [asyncio.ensure_future(scheduler.submit(blocker, guild_id=1, user_id=1)) for _ in range(2)]
+            await asyncio.sleep(0)
+
+            assert scheduler.queued == 2
+            with pytest.raises(QueueFull):
+                await scheduler.submit(blocker, guild_id=2, user_id=2)
+
+            gate.set()
+            await asyncio.gather(running, *queued)
+        finally:
+            await scheduler.close()
+
+    run(main())
+
+
+def test_reports_queue_positions():
+    async def main():
+        scheduler = await started()
+        gate = asyncio.Event()
+        positions = []
+
+        async def blocker(*, token):
+            await gate.wait()
+
+        async def on_position(position):
+            positions.append(position)
+
+        try:
+            running = asyncio.ensure_future(scheduler.submit(blocker, guild_id=1, user_id=1))
+            await asyncio.sleep(0)
+            ahead = asyncio.ensure_future(scheduler.submit(blocker, guild_id=2, user_id=2))
+            await asyncio.sleep(0)
+            watched = asyncio.ensure_future(scheduler.submit(blocker, guild_id=3, user_id=3, on_position=on_position))
+            await asyncio.sleep(0.01)
+
+            gate.set()
+            await asyncio.gather(running, ahead, watched)
+        finally:
+            await scheduler.close()
+
+        assert positions[0] == 2
+        assert positions[-1] == 0
+
+    run(main())
+
+
+def test_deadline_fails_the_job_but_keeps_the_worker_until_it_stops():
+    async def main():
+        scheduler = await started(deadline=0.05)
+        stopped = threading.Event()
+
+        def work(token):
+            try:
+                while True:
+                    time.sleep(0.01)
+                    token.check()
+            finally:
+                stopped.set()
+
+        async def job(*, token):
+            await token.run_in_thread(work, token)
+
+        try:
+            with pytest.raises(DeadlineExceeded):
+                await scheduler.submit(job, guild_id=1, user_id=1)
+
+            # submit() only returns once the job's thread has stopped
+            assert stopped.is_set()
+            assert scheduler.active == 0
+        finally:
+            await scheduler.close()
+
+    run(main())
+
+
+def test_cancelling_by_tag():
+    async def main():
+        scheduler = await started(workers=2)
+        gate = asyncio.Event()
+
+        async def blocker(*, token):
+            await gate.wait()
+
+        try:
+            tasks = [
+                asyncio.ensure_future(scheduler.submit(blocker, guild_id=1, user_id=user_id, tag='message'))
+                for user_id in range(3)
+            ]
+            await asyncio.sleep(0.01)
+
+            assert scheduler.cancel('message', 'deleted') == 3
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            assert all(isinstance(result, RenderCancelled) for result in results)
+            assert scheduler.queued == 0
+        finally:
+            await scheduler.close()
+
+    run(main())
+
+
+def test_cancelled_submitter_leaves_the_queue():
+    async def main():
+        scheduler = await started()
+        gate = asyncio.Event()
+        ran = []
+
+        async def blocker(*, token):
+            await gate.wait()
+
+        async def job(*, token):
+            ran.append(True)
+
+        try:
+            running = asyncio.ensure_future(scheduler.submit(blocker, guild_id=1, user_id=1))
+            await asyncio.sleep(0)
+            queued = asyncio.ensure_future(scheduler.submit(job, guild_id=2, user_id=2))
+            await asyncio.sleep(0)
+
+            assert scheduler.queued == 1
+            queued.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await queued
+
+            assert scheduler.queued == 0
+            gate.set()
+            await running
+        finally:
+            await scheduler.close()
+
+        assert not ran
+
+    run(main())